@@ -0,0 +1,378 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import sys
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from dotenv import load_dotenv
+from prometheus_client.parser import text_string_to_metric_families
+
+from common.priority import lane_queues
+from common.queues import get_queue_backend, QueueBackend
+from common.utils import get_logger, Queues
+
+load_dotenv()
+
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent
+
+# Worker directory and input queue of every stage the supervisor can scale.
+STAGES = {
+    "email-processing": ("email-processing-worker", Queues.EMAIL_INGESTION_QUEUE),
+    "ocr": ("ocr-worker", Queues.OCR_QUEUE),
+    "document-classifier": (
+        "document-classifier-worker",
+        Queues.DOCUMENT_CLASSIFIER_QUEUE,
+    ),
+    "data-extraction": ("data-extraction-worker", Queues.DATA_EXTRACTION_QUEUE),
+    "policy-coverage-check": (
+        "policy-coverage-check-worker",
+        Queues.POLICY_COVERAGE_CHECK_QUEUE,
+    ),
+    "cost-positions-extraction": (
+        "cost-positions-extraction-worker",
+        Queues.COST_POSITIONS_EXTRACTION_QUEUE,
+    ),
+    "case-plausibility-check": (
+        "case-plausibility-check-worker",
+        Queues.CASE_PLAUSIBILITY_CHECK_QUEUE,
+    ),
+}
+
+
+@dataclass
+class ScalingPolicy:
+    min_replicas: int = 1
+    max_replicas: int = 4
+    # Time in which the current backlog should be drained on top of the arrivals.
+    target_drain_s: float = 60
+    # A queue whose oldest claim is older than this always gets one more replica.
+    max_age_s: float = 120
+    # Only scale down once the desired replicas fall this far below the current.
+    scale_down_hysteresis: float = 0.25
+    scale_up_cooldown_s: float = 15
+    scale_down_cooldown_s: float = 60
+
+
+@dataclass
+class StageObservation:
+    replicas: int
+    depth: int
+    oldest_age_s: float | None
+    # Claims completed per second by all replicas of the stage.
+    throughput: float | None
+    # Change of the queue depth per second since the previous observation.
+    depth_rate: float
+
+
+def desired_replicas(policy: ScalingPolicy, observation: StageObservation) -> int:
+    replicas = observation.replicas
+    desired = replicas
+
+    if observation.throughput is None:
+        # No rate measured yet, keep the current replicas.
+        pass
+    elif observation.throughput > 0 and replicas:
+        per_replica_rate = observation.throughput / replicas
+        arrival_rate = max(observation.throughput + observation.depth_rate, 0)
+        required_rate = arrival_rate + observation.depth / policy.target_drain_s
+        desired = math.ceil(required_rate / per_replica_rate)
+    elif observation.depth == 0:
+        # Idle stage.
+        desired = policy.min_replicas
+    # A backlog without any completed claims is handled by the age rule below.
+
+    if (
+        observation.oldest_age_s is not None
+        and observation.oldest_age_s > policy.max_age_s
+    ):
+        desired = max(desired, replicas + 1)
+
+    return min(max(desired, policy.min_replicas), policy.max_replicas)
+
+
+@dataclass
+class StageState:
+    name: str
+    worker_dir: Path
+    queue: Queues
+    policy: ScalingPolicy
+    processes: dict[int, asyncio.subprocess.Process] = field(default_factory=dict)
+    last_scaled_at: float = float("-inf")
+    last_depth: int | None = None
+    last_sampled_at: float | None = None
+    # Last seen completed-claims counter of every process, keyed by metrics port.
+    completed: dict[int, float] = field(default_factory=dict)
+
+
+class Supervisor:
+    def __init__(
+        self,
+        policies: dict[str, ScalingPolicy],
+        queue_backend: QueueBackend,
+        interval_s: float,
+        base_port: int,
+    ):
+        self.queue_backend = queue_backend
+        self.interval_s = interval_s
+        self.base_port = base_port
+        self.logger = get_logger()
+        self.stages = {
+            name: StageState(
+                name=name,
+                worker_dir=REPOSITORY_ROOT / worker_dir,
+                queue=queue,
+                policy=policies[name],
+            )
+            for name, (worker_dir, queue) in STAGES.items()
+            if name in policies
+        }
+        self._used_ports: set[int] = set()
+        # Reapers of retiring replicas, referenced until done so they are not
+        # garbage collected before the port is freed.
+        self._reapers: set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _free_port(self) -> int:
+        port = self.base_port
+        while port in self._used_ports:
+            port += 1
+        self._used_ports.add(port)
+        return port
+
+    async def _spawn(self, stage: StageState):
+        port = self._free_port()
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(REPOSITORY_ROOT),
+            "PROMETHEUS_SERVER_PORT": str(port),
+        }
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "worker.py", cwd=stage.worker_dir, env=env
+        )
+        stage.processes[port] = process
+        self.logger.info(f"[{stage.name}] started replica on port {port}.")
+
+    async def _retire(self, stage: StageState):
+        # Workers stop popping on SIGTERM and exit after their in-flight claims.
+        port, process = max(stage.processes.items())
+        del stage.processes[port]
+        stage.completed.pop(port, None)
+        process.terminate()
+        reaper = asyncio.create_task(self._reap(port, process))
+        self._reapers.add(reaper)
+        reaper.add_done_callback(self._reapers.discard)
+        self.logger.info(f"[{stage.name}] retiring replica on port {port}.")
+
+    async def _reap(self, port: int, process: asyncio.subprocess.Process):
+        await process.wait()
+        self._used_ports.discard(port)
+
+    def _collect_exited(self, stage: StageState):
+        for port, process in list(stage.processes.items()):
+            if process.returncode is not None:
+                self.logger.warning(
+                    f"[{stage.name}] replica on port {port} exited with {process.returncode}."
+                )
+                del stage.processes[port]
+                stage.completed.pop(port, None)
+                self._used_ports.discard(port)
+
+    async def _completed_claims(self, stage: StageState) -> float:
+        # Sums the increase of stage_claims_total{outcome="success"} over the
+        # replicas of a stage since the previous observation.
+        increase = 0.0
+        for port in list(stage.processes):
+            try:
+                total = await asyncio.to_thread(_scrape_completed, port)
+            except OSError:
+                continue
+            increase += max(total - stage.completed.get(port, total), 0)
+            stage.completed[port] = total
+        return increase
+
+    async def _observe(self, stage: StageState, depth: int, oldest: float | None):
+        now = time.time()
+        completed = await self._completed_claims(stage)
+        elapsed = now - stage.last_sampled_at if stage.last_sampled_at else None
+
+        observation = StageObservation(
+            replicas=len(stage.processes),
+            depth=depth,
+            oldest_age_s=now - oldest if oldest is not None else None,
+            throughput=completed / elapsed if elapsed else None,
+            depth_rate=(
+                (depth - stage.last_depth) / elapsed
+                if elapsed and stage.last_depth is not None
+                else 0
+            ),
+        )
+        stage.last_depth = depth
+        stage.last_sampled_at = now
+        return observation
+
+    async def _scale(self, stage: StageState, observation: StageObservation):
+        now = time.monotonic()
+        replicas = len(stage.processes)
+        desired = desired_replicas(stage.policy, observation)
+
+        if replicas < stage.policy.min_replicas:
+            desired = stage.policy.min_replicas
+        elif desired > replicas:
+            if now - stage.last_scaled_at < stage.policy.scale_up_cooldown_s:
+                return
+        elif desired < replicas * (1 - stage.policy.scale_down_hysteresis):
+            if now - stage.last_scaled_at < stage.policy.scale_down_cooldown_s:
+                return
+            # Scale down one replica at a time.
+            desired = replicas - 1
+        else:
+            return
+
+        if desired == replicas:
+            return
+
+        self.logger.info(
+            f"[{stage.name}] scaling {replicas} -> {desired} replicas "
+            f"(depth={observation.depth}, throughput={observation.throughput})."
+        )
+        while len(stage.processes) < desired:
+            await self._spawn(stage)
+        while len(stage.processes) > desired:
+            await self._retire(stage)
+        stage.last_scaled_at = now
+
+    async def run(self):
+        # A stage's backlog is spread over its priority lanes.
+        stage_queues = {
+            name: lane_queues(stage.queue.value) for name, stage in self.stages.items()
+        }
+        queues = [queue for lanes in stage_queues.values() for queue in lanes]
+        try:
+            while not self._stopping.is_set():
+                try:
+                    depths = await self.queue_backend.depths(queues)
+                    oldest = await self.queue_backend.oldest_enqueued_at(queues)
+                except Exception as e:
+                    self.logger.warning(f"Sampling queues failed: {e!r}")
+                    depths, oldest = None, None
+
+                for name, stage in self.stages.items():
+                    self._collect_exited(stage)
+                    if depths is None:
+                        observation = None
+                    else:
+                        lane_oldest = [
+                            oldest[queue]
+                            for queue in stage_queues[name]
+                            if oldest[queue] is not None
+                        ]
+                        observation = await self._observe(
+                            stage,
+                            sum(depths[queue] for queue in stage_queues[name]),
+                            min(lane_oldest, default=None),
+                        )
+                    if observation is None:
+                        # Keep the minimum replicas alive even without queue data.
+                        while len(stage.processes) < stage.policy.min_replicas:
+                            await self._spawn(stage)
+                        continue
+                    await self._scale(stage, observation)
+
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.interval_s)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            processes = [
+                process
+                for stage in self.stages.values()
+                for process in stage.processes.values()
+            ]
+            for process in processes:
+                process.terminate()
+            # Replicas still retiring are waited for as well.
+            await asyncio.gather(
+                *(process.wait() for process in processes), *self._reapers
+            )
+
+
+def _scrape_completed(port: int) -> float:
+    with urllib.request.urlopen(f"http://localhost:{port}/metrics", timeout=2) as r:
+        text = r.read().decode()
+    total = 0.0
+    for family in text_string_to_metric_families(text):
+        if family.name != "stage_claims":
+            continue
+        for sample in family.samples:
+            if (
+                sample.name == "stage_claims_total"
+                and sample.labels.get("outcome") == "success"
+            ):
+                total += sample.value
+    return total
+
+
+def load_policies(config_path: str | None, stages: list[str]) -> dict:
+    # The optional JSON config holds a "default" policy and per stage overrides,
+    # e.g. {"default": {"max_replicas": 4}, "ocr": {"max_replicas": 12}}.
+    config = {}
+    if config_path:
+        with open(config_path, "r") as f:
+            config = json.load(f)
+
+    default = config.get("default", {})
+    return {
+        stage: ScalingPolicy(**{**default, **config.get(stage, {})}) for stage in stages
+    }
+
+
+async def main(args):
+    supervisor = Supervisor(
+        policies=load_policies(args.config, args.stages),
+        queue_backend=get_queue_backend(),
+        interval_s=args.interval,
+        base_port=args.base_port,
+    )
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, supervisor.stop)
+
+    await supervisor.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Spawn and retire local worker processes per stage based on queue depth, age and processing rate."
+    )
+
+    parser.add_argument(
+        "--config", type=str, default=None, help="JSON file with scaling policies."
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(STAGES),
+        default=list(STAGES),
+        help="Stages to supervise.",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=5, help="Seconds between scaling decisions."
+    )
+    parser.add_argument(
+        "--base_port",
+        type=int,
+        default=9100,
+        help="First Prometheus port handed to worker processes.",
+    )
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,69 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from common.cost_positions import CostPositionTable
+from common.plausibility import load_plausibility_rules
+from generate_dummy_invoice import random_invoice_fields
+
+
+def cents(amount: float) -> int:
+    return int(round(amount * 100))
+
+
+def random_table(rng: random.Random, tamper_rate: float) -> CostPositionTable:
+    # The cost positions of a random dummy invoice, as the table extraction
+    # worker would write them. A fraction gets an inflated line total.
+    fields = random_invoice_fields(rng)
+    positions = fields.cost_positions
+    total_cents = [cents(position.total) for position in positions]
+    if rng.random() < tamper_rate:
+        total_cents[rng.randrange(len(total_cents))] += 1000
+    return CostPositionTable(
+        description=np.array([position.description for position in positions]),
+        quantity=np.array([position.quantity for position in positions], np.int32),
+        unit_price_cents=np.array(
+            [cents(position.unit_price) for position in positions], np.int64
+        ),
+        total_cents=np.array(total_cents, np.int64),
+        totals={
+            "subtotal_cents": cents(fields.subtotal),
+            "vat_cents": cents(fields.vat),
+            "total_cents": cents(fields.total),
+        },
+    )
+
+
+def main(num_claims: int, batch_sizes: list[int], tamper_rate: float, seed: int):
+    rng = random.Random(seed)
+    tables = [random_table(rng, tamper_rate) for _ in range(num_claims)]
+    rules = load_plausibility_rules()
+
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        rejected = 0
+        for i in range(0, num_claims, batch_size):
+            rejected += sum(map(bool, rules.check(tables[i : i + batch_size])))
+        elapsed = time.perf_counter() - start
+        print(
+            f"batch size {batch_size:<5}: {num_claims / elapsed:10.0f} claims/s "
+            f"({elapsed:.2f}s, {rejected} rejected)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the plausibility rules per batch size."
+    )
+    parser.add_argument("--num_claims", type=int, default=20000)
+    parser.add_argument(
+        "--batch_sizes", type=int, nargs="+", default=[1, 16, 128, 1024]
+    )
+    parser.add_argument("--tamper_rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=42)
+
+    args = parser.parse_args()
+
+    main(args.num_claims, args.batch_sizes, args.tamper_rate, args.seed)
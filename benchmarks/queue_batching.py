@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import json
+import time
+
+from common.queues import (
+    get_local_redis,
+    get_redis,
+    RedisListQueue,
+    RedisStreamQueue,
+)
+
+SOURCE_QUEUE = "benchmark-source-queue"
+TARGET_QUEUE = "benchmark-target-queue"
+
+
+async def fill_source(r, num_messages: int):
+    await r.delete(SOURCE_QUEUE, TARGET_QUEUE)
+    pipe = r.pipeline(transaction=False)
+    for i in range(num_messages):
+        pipe.lpush(SOURCE_QUEUE, json.dumps({"claim_id": str(i), "status": "ingested"}))
+    await pipe.execute()
+
+
+async def run_serial(r, num_messages: int) -> float:
+    # The previous worker loop: one BRPOP and one LPUSH per claim.
+    await fill_source(r, num_messages)
+    start = time.perf_counter()
+    for _ in range(num_messages):
+        _, data = await r.brpop([SOURCE_QUEUE], timeout=10)
+        await r.lpush(TARGET_QUEUE, data)
+    return time.perf_counter() - start
+
+
+async def run_batched(
+    r, backend: str, num_messages: int, batch_size: int, linger_ms: float
+) -> float:
+    queue_class = RedisStreamQueue if backend == "stream" else RedisListQueue
+    queue = queue_class(r, batch_size=batch_size, linger_ms=linger_ms)
+
+    await r.delete(SOURCE_QUEUE, TARGET_QUEUE)
+    await asyncio.gather(
+        *(
+            queue.push(SOURCE_QUEUE, json.dumps({"claim_id": str(i)}))
+            for i in range(num_messages)
+        )
+    )
+
+    start = time.perf_counter()
+    moved = 0
+    while moved < num_messages:
+        messages = await queue.pop_batch(SOURCE_QUEUE, timeout=10)
+        await asyncio.gather(
+            *(queue.route(message, TARGET_QUEUE, message.data) for message in messages)
+        )
+        moved += len(messages)
+    return time.perf_counter() - start
+
+
+async def main(
+    backend: str, num_messages: int, batch_sizes: list[int], linger_ms: float
+):
+    # The local stand-in speaks the list commands, so it runs the list backend
+    # without any network round trips.
+    r = get_local_redis() if backend == "local" else get_redis()
+
+    elapsed = await run_serial(r, num_messages)
+    print(f"serial        : {num_messages / elapsed:10.0f} msg/s ({elapsed:.2f}s)")
+
+    for batch_size in batch_sizes:
+        elapsed = await run_batched(r, backend, num_messages, batch_size, linger_ms)
+        print(
+            f"batch size {batch_size:<3}: {num_messages / elapsed:10.0f} msg/s ({elapsed:.2f}s)"
+        )
+
+    await r.delete(SOURCE_QUEUE, TARGET_QUEUE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare per-message BRPOP/LPUSH against batched dequeue and pipelined enqueue."
+    )
+    parser.add_argument(
+        "--backend", choices=["list", "stream", "local"], default="list"
+    )
+    parser.add_argument("--num_messages", type=int, default=10000)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--linger_ms", type=float, default=5)
+
+    args = parser.parse_args()
+
+    asyncio.run(main(args.backend, args.num_messages, args.batch_sizes, args.linger_ms))
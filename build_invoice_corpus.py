@@ -0,0 +1,131 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+from generate_dummy_invoice import InvoiceFields, random_invoice_fields, render_invoice
+
+MANIFEST_FILE = "manifest.json"
+# The policies insuring the invoiced bicycles, for POLICY_INDEX_PATH.
+POLICIES_FILE = "policies.jsonl"
+POLICY_TERM = timedelta(days=4 * 365)
+# Share of policies that exclude partial damage.
+UNCOVERED_POLICY_RATE = 0.05
+
+
+def invoice_file_name(index: int) -> str:
+    return f"invoice_{index:06d}.pdf"
+
+
+def build_invoice(output_dir: str, seed: int, index: int) -> dict:
+    # Every invoice draws from its own generator, so its content only depends on
+    # the seed and its index, not on how invoices are spread over the pool.
+    fields = random_invoice_fields(random.Random(f"{seed}:{index}"))
+    pdf_bytes = render_invoice(fields)
+
+    file_name = invoice_file_name(index)
+    with open(Path(output_dir) / file_name, "wb") as f:
+        f.write(pdf_bytes)
+
+    return {
+        "file": file_name,
+        "content_hash": hashlib.sha256(pdf_bytes).hexdigest(),
+        "fields": fields.ground_truth(),
+    }
+
+
+def _build_invoice(task: tuple[str, int, int]) -> dict:
+    return build_invoice(*task)
+
+
+def build_corpus(
+    output_dir: str, num_invoices: int, seed: int, workers: int | None = None
+) -> dict:
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(output_dir, seed, index) for index in range(num_invoices)]
+    workers = workers or os.cpu_count() or 1
+
+    # Each pool process sets up the ReportLab styles once and then renders
+    # invoices in chunks, which keeps the inter-process overhead per invoice low.
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        invoices = list(
+            executor.map(
+                _build_invoice,
+                tasks,
+                chunksize=max(1, min(64, num_invoices // (workers * 4))),
+            )
+        )
+
+    manifest = {"seed": seed, "num_invoices": num_invoices, "invoices": invoices}
+    with open(Path(output_dir) / MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    write_policies(output_dir, seed, invoices)
+    return manifest
+
+
+def policy_record(fields: dict, covered: bool = True) -> dict:
+    # A policy that starts with the purchase of the bicycle, so incidents late
+    # in the life of a bicycle fall outside the coverage period.
+    valid_from = date.fromisoformat(fields["purchase_date"])
+    return {
+        "policy_number": fields["policy_number"],
+        "frame_number": fields["serial_number"],
+        "valid_from": valid_from.isoformat(),
+        "valid_to": (valid_from + POLICY_TERM).isoformat(),
+        "coverage": {"partial_damage": covered},
+    }
+
+
+def write_policies(output_dir: str, seed: int, invoices: list[dict]):
+    # The policy of the default dummy invoice is included, so claims sent by
+    # mock_claim_initiation.py are covered as well.
+    records = [
+        policy_record(
+            invoice["fields"],
+            random.Random(f"{seed}:{index}:policy").random() >= UNCOVERED_POLICY_RATE,
+        )
+        for index, invoice in enumerate(invoices)
+    ]
+    records.append(policy_record(InvoiceFields().ground_truth()))
+    with open(Path(output_dir) / POLICIES_FILE, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def load_manifest(corpus_dir: str) -> dict:
+    with open(Path(corpus_dir) / MANIFEST_FILE, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a corpus of randomised bicycle insurance invoices with a ground truth manifest."
+    )
+
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--num_invoices", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes rendering invoices, defaults to the number of CPUs.",
+    )
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    build_corpus(args.output_dir, args.num_invoices, args.seed, args.workers)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Generated {args.num_invoices} invoices in {elapsed:.1f}s "
+        f"({args.num_invoices / elapsed:.0f}/s) to {args.output_dir}."
+    )
@@ -0,0 +1,527 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import random
+import time
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass, field
+
+from dotenv import load_dotenv
+
+from common.latency import get_latency_store, summarize
+from common.retry import RetryPolicy
+from load_generator import arrival_offsets, parse_profile, Segment
+
+load_dotenv()
+
+
+# Outcomes a claim can reach; everything else in `routes` is a stage.
+OUTCOMES = ("accepted", "rejected")
+
+# Calibrated empirical distributions keep at most this many samples.
+MAX_EMPIRICAL_SAMPLES = 2000
+
+
+@dataclass
+class ServiceTime:
+    # constant [value], exponential [mean], lognormal [mu, sigma],
+    # uniform_int [low, high, scale] as in common/mock.py, or empirical [samples].
+    kind: str
+    params: list[float]
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "constant":
+            return self.params[0]
+        if self.kind == "exponential":
+            return rng.expovariate(1 / self.params[0])
+        if self.kind == "lognormal":
+            return rng.lognormvariate(*self.params)
+        if self.kind == "uniform_int":
+            low, high, scale = self.params
+            return rng.randint(int(low), int(high)) * scale
+        if self.kind == "empirical":
+            return rng.choice(self.params)
+        raise ValueError(f"Unknown service time distribution {self.kind!r}")
+
+    def mean(self) -> float:
+        if self.kind == "lognormal":
+            mu, sigma = self.params
+            return math.exp(mu + sigma**2 / 2)
+        if self.kind == "uniform_int":
+            low, high, scale = self.params
+            return (low + high) / 2 * scale
+        return sum(self.params) / len(self.params)
+
+
+@dataclass
+class StageModel:
+    service_time: ServiceTime
+    # Next stage or outcome with its probability after a successful attempt.
+    routes: dict[str, float]
+    replicas: int = 1
+    # Claims processed at a time per replica, WORKER_CONCURRENCY of the worker.
+    concurrency: int = 8
+    # Probability that an attempt fails and is retried or dead-lettered.
+    failure_rate: float = 0.0
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+
+    @property
+    def servers(self) -> int:
+        return self.replicas * self.concurrency
+
+
+@dataclass
+class PipelineModel:
+    entry: str
+    stages: dict[str, StageModel]
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), indent=2)
+
+    def validate(self):
+        # Every stage must lead somewhere: claims that finish a stage take one
+        # of its routes, so a stage without routes could never be left.
+        if self.entry not in self.stages:
+            raise ValueError(f"Entry stage {self.entry!r} is not in the model.")
+        for name, stage in self.stages.items():
+            if not stage.routes or sum(stage.routes.values()) <= 0:
+                raise ValueError(
+                    f"Stage {name!r} has no routes; every stage needs at least "
+                    f"one following stage or outcome ({', '.join(OUTCOMES)})."
+                )
+            unknown = set(stage.routes) - set(self.stages) - set(OUTCOMES)
+            if unknown:
+                raise ValueError(
+                    f"Stage {name!r} routes to unknown stages {sorted(unknown)}."
+                )
+
+    @classmethod
+    def from_json(cls, text: str) -> "PipelineModel":
+        data = json.loads(text)
+        model = cls(
+            entry=data["entry"],
+            stages={
+                name: StageModel(
+                    **{
+                        **stage,
+                        "service_time": ServiceTime(**stage["service_time"]),
+                        "retry_policy": RetryPolicy(**stage["retry_policy"]),
+                    }
+                )
+                for name, stage in data["stages"].items()
+            },
+        )
+        model.validate()
+        return model
+
+
+def default_model(latency_scale: float = 1) -> PipelineModel:
+    # The stage graph and the branch probabilities of the mock workers; stage
+    # names match the timeline entries written by common/worker.py.
+    mock_delay = ServiceTime("uniform_int", [1, 5, latency_scale])
+    return PipelineModel(
+        entry="email-ingestion",
+        stages={
+            "email-ingestion": StageModel(
+                ServiceTime("constant", [0.001]), {"ocr": 1.0}
+            ),
+            "ocr": StageModel(mock_delay, {"document-classifier": 1.0}),
+            "document-classifier": StageModel(
+                mock_delay, {"data-extraction": 0.8, "rejected": 0.2}
+            ),
+            "data-extraction": StageModel(mock_delay, {"policy-coverage-check": 1.0}),
+            "policy-coverage-check": StageModel(
+                mock_delay, {"cost-positions-extraction": 0.8, "rejected": 0.2}
+            ),
+            "cost-positions-extraction": StageModel(
+                mock_delay, {"case-plausibility-check": 1.0}
+            ),
+            "case-plausibility-check": StageModel(
+                mock_delay, {"accepted": 0.8, "rejected": 0.2}
+            ),
+        },
+    )
+
+
+def calibrate(
+    records: list[dict], model: PipelineModel, rng: random.Random
+) -> PipelineModel:
+    # Replaces the service times, failure rates and routes of every stage seen
+    # in the latency records with what was measured. Replicas, concurrency and
+    # retry policies are kept, since they are what capacity planning varies.
+    # Records only exist for claims that reached a final queue, so failure
+    # rates are underestimated by claims that ended in a dead-letter queue.
+    service_times = defaultdict(list)
+    attempts = defaultdict(int)
+    failures = defaultdict(int)
+    routes = defaultdict(lambda: defaultdict(int))
+
+    for record in records:
+        timeline = record["timeline"]
+        for index, entry in enumerate(timeline):
+            stage = entry["stage"]
+            attempts[stage] += 1
+            if entry.get("failed"):
+                failures[stage] += 1
+                continue
+            service_times[stage].append(entry["exit"] - entry["enter"])
+            following = (
+                timeline[index + 1]["stage"]
+                if index + 1 < len(timeline)
+                else record["outcome"]
+            )
+            routes[stage][following] += 1
+
+    stages = dict(model.stages)
+    for stage, samples in service_times.items():
+        if len(samples) > MAX_EMPIRICAL_SAMPLES:
+            samples = rng.sample(samples, MAX_EMPIRICAL_SAMPLES)
+        total = sum(routes[stage].values())
+        base = stages.get(stage) or StageModel(ServiceTime("constant", [0]), {})
+        stages[stage] = StageModel(
+            service_time=ServiceTime("empirical", samples),
+            routes={
+                following: count / total for following, count in routes[stage].items()
+            },
+            replicas=base.replicas,
+            concurrency=base.concurrency,
+            failure_rate=failures[stage] / attempts[stage],
+            retry_policy=base.retry_policy,
+        )
+    return PipelineModel(entry=model.entry, stages=stages)
+
+
+@dataclass
+class SimulatedClaim:
+    claim_id: int
+    ingested_at: float
+    timeline: list[dict] = field(default_factory=list)
+    retries: int = 0
+
+
+class StageState:
+    def __init__(self, model: StageModel):
+        self.model = model
+        self.waiting: deque[tuple[SimulatedClaim, float]] = deque()
+        self.busy = 0
+        # Time-weighted integrals for the mean queue depth and utilisation.
+        self.depth_area = 0.0
+        self.busy_area = 0.0
+        self.max_depth = 0
+        self.updated_at = 0.0
+
+    def advance(self, now: float):
+        elapsed = now - self.updated_at
+        self.depth_area += len(self.waiting) * elapsed
+        self.busy_area += self.busy * elapsed
+        self.updated_at = now
+
+
+class Simulation:
+    # Discrete-event simulation of the pipeline: every stage is a FIFO queue
+    # served by replicas x concurrency servers. Claims take a route by the
+    # stage's branch probabilities, failed attempts wait out the retry backoff
+    # and are dead-lettered after max_retries, as in common/worker.py.
+
+    def __init__(self, model: PipelineModel, seed: int | None = None):
+        model.validate()
+        self.model = model
+        self.rng = random.Random(seed)
+        self.stages = {name: StageState(stage) for name, stage in model.stages.items()}
+        self.events: list[tuple[float, int, str, str, SimulatedClaim]] = []
+        self._sequence = itertools.count()
+        self.now = 0.0
+        self.records: list[dict] = []
+        self.dead_lettered: dict[str, int] = defaultdict(int)
+
+    def _schedule(self, at: float, kind: str, stage: str, claim: SimulatedClaim):
+        heapq.heappush(self.events, (at, next(self._sequence), kind, stage, claim))
+
+    def _enqueue(self, stage: str, claim: SimulatedClaim):
+        state = self.stages[stage]
+        state.advance(self.now)
+        state.waiting.append((claim, self.now))
+        state.max_depth = max(state.max_depth, len(state.waiting))
+        self._start(stage)
+
+    def _start(self, stage: str):
+        state = self.stages[stage]
+        while state.waiting and state.busy < state.model.servers:
+            claim, enqueued_at = state.waiting.popleft()
+            state.busy += 1
+            claim.timeline.append(
+                {"stage": stage, "enqueued_at": enqueued_at, "enter": self.now}
+            )
+            service_time = state.model.service_time.sample(self.rng)
+            self._schedule(self.now + service_time, "done", stage, claim)
+
+    def _route(self, routes: dict[str, float]) -> str:
+        draw = self.rng.random() * sum(routes.values())
+        for following, probability in routes.items():
+            draw -= probability
+            if draw < 0:
+                return following
+        return following
+
+    def _finish(self, stage: str, claim: SimulatedClaim):
+        state = self.stages[stage]
+        state.advance(self.now)
+        state.busy -= 1
+        entry = claim.timeline[-1]
+        entry["exit"] = self.now
+
+        if self.rng.random() < state.model.failure_rate:
+            entry["failed"] = True
+            policy = state.model.retry_policy
+            if claim.retries < policy.max_retries:
+                claim.retries += 1
+                delay = policy.delay(claim.retries, self.rng)
+                self._schedule(self.now + delay, "arrive", stage, claim)
+            else:
+                self.dead_lettered[stage] += 1
+        else:
+            claim.retries = 0
+            following = self._route(state.model.routes)
+            if following in OUTCOMES:
+                self.records.append(
+                    {
+                        "claim_id": claim.claim_id,
+                        "outcome": following,
+                        "ingested_at": claim.ingested_at,
+                        "completed_at": self.now,
+                        "end_to_end": self.now - claim.ingested_at,
+                        "timeline": claim.timeline,
+                    }
+                )
+            else:
+                self._enqueue(following, claim)
+
+        self._start(stage)
+
+    def run(self, arrivals: list[float], warmup_s: float = 0) -> dict:
+        for claim_id, arrival in enumerate(arrivals):
+            self._schedule(
+                arrival,
+                "arrive",
+                self.model.entry,
+                SimulatedClaim(claim_id=claim_id, ingested_at=arrival),
+            )
+
+        end = arrivals[-1] if arrivals else 0
+        measured_from = None
+        while self.events:
+            at, _, kind, stage, claim = heapq.heappop(self.events)
+            if measured_from is None and at >= warmup_s:
+                # Queue statistics start after the warm-up.
+                for state in self.stages.values():
+                    state.advance(warmup_s)
+                    state.depth_area = state.busy_area = 0.0
+                    state.max_depth = len(state.waiting)
+                measured_from = warmup_s
+            self.now = at
+            if kind == "arrive":
+                self._enqueue(stage, claim)
+            else:
+                self._finish(stage, claim)
+
+        return self.report(arrivals, warmup_s, measured_from or 0, end)
+
+    def report(
+        self, arrivals: list[float], warmup_s: float, measured_from: float, end: float
+    ) -> dict:
+        # Only claims arriving after the warm-up count towards the latencies.
+        records = [r for r in self.records if r["ingested_at"] >= warmup_s]
+        drained_at = max(self.now, end)
+        completions = sorted(r["completed_at"] for r in records)
+        arrival_rate = len(arrivals) / end if end else 0
+        loads = offered_load(self.model, arrival_rate)
+
+        stages = {}
+        for name, state in self.stages.items():
+            state.advance(drained_at)
+            measured = max(drained_at - measured_from, 1e-9)
+            stages[name] = {
+                "servers": state.model.servers,
+                "offered_load": loads.get(name, 0),
+                "utilization": state.busy_area / (measured * state.model.servers),
+                "mean_queue_depth": state.depth_area / measured,
+                "max_queue_depth": state.max_depth,
+                "dead_lettered": self.dead_lettered.get(name, 0),
+            }
+
+        summary = summarize(records)
+        for name, stats in summary["stages"].items():
+            if name in stages:
+                stats.update(stages.pop(name))
+        summary["stages"].update(stages)
+
+        return {
+            "arrivals": len(arrivals),
+            "arrival_rate": arrival_rate,
+            "throughput": (
+                (len(completions) - 1) / (completions[-1] - completions[0])
+                if len(completions) > 1 and completions[-1] > completions[0]
+                else None
+            ),
+            "drain_time_s": drained_at - end,
+            "dead_lettered": sum(self.dead_lettered.values()),
+            **summary,
+        }
+
+
+def offered_load(model: PipelineModel, arrival_rate: float) -> dict[str, float]:
+    # Utilisation every stage would see in steady state, from the visit rate
+    # implied by the routes. Values of 1 or more mean the stage cannot keep up.
+    visits = defaultdict(float)
+    visits[model.entry] = 1.0
+    order = [model.entry]
+    for stage in order:
+        for following, probability in model.stages[stage].routes.items():
+            if following in model.stages and following not in order:
+                order.append(following)
+            if following in model.stages:
+                visits[following] += visits[stage] * probability
+
+    load = {}
+    for stage in order:
+        stage_model = model.stages[stage]
+        # Every failed attempt is served again.
+        attempts = 1 / max(1 - stage_model.failure_rate, 1e-9)
+        load[stage] = (
+            arrival_rate
+            * visits[stage]
+            * attempts
+            * stage_model.service_time.mean()
+            / stage_model.servers
+        )
+    return load
+
+
+def apply_overrides(model: PipelineModel, overrides: list[str], attribute: str):
+    # "STAGE=N" sets the attribute of one stage, a plain "N" of every stage.
+    for override in overrides:
+        stage, _, value = override.rpartition("=")
+        targets = [stage] if stage else list(model.stages)
+        for target in targets:
+            setattr(model.stages[target], attribute, int(value))
+
+
+def print_report(report: dict):
+    print(
+        f"{report['arrivals']} claims at {report['arrival_rate']:.2f}/s, "
+        f"throughput {report['throughput'] or 0:.2f}/s, {report['outcomes']}, "
+        f"{report['dead_lettered']} dead-lettered, drained {report['drain_time_s']:.0f}s after the last arrival"
+    )
+    end_to_end = report["end_to_end"]
+    if end_to_end["count"]:
+        print(
+            f"{'end-to-end':<28}{end_to_end['p50']:>10.2f}{end_to_end['p95']:>10.2f}{end_to_end['p99']:>10.2f}"
+        )
+    print(
+        f"{'stage':<28}{'servers':>8}{'load':>8}{'util':>8}{'depth':>8}{'max':>8}{'wait p95':>10}"
+    )
+    for stage, stats in report["stages"].items():
+        wait = stats.get("queue_wait", {})
+        print(
+            f"{stage:<28}{stats['servers']:>8}{stats['offered_load']:>8.2f}"
+            f"{stats['utilization']:>8.2f}{stats['mean_queue_depth']:>8.1f}"
+            f"{stats['max_queue_depth']:>8}{wait.get('p95', 0):>10.2f}"
+        )
+
+
+async def fetch_records(window_s: float) -> list[dict]:
+    until = time.time()
+    return await get_latency_store().fetch(until - window_s, until)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Simulate the claims pipeline to predict throughput, queue depths and latency percentiles for an arrival rate and replica counts."
+    )
+
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1,
+        help="Claims per second, used without --profile.",
+    )
+    parser.add_argument("--duration", type=float, default=3600)
+    parser.add_argument(
+        "--profile",
+        nargs="+",
+        default=None,
+        help="Rate segments RATE:SECONDS or RATE:SECONDS:ramp as for load_generator.py.",
+    )
+    parser.add_argument(
+        "--constant_arrivals",
+        action="store_true",
+        help="Evenly spaced instead of Poisson arrivals.",
+    )
+    parser.add_argument(
+        "--replicas",
+        nargs="+",
+        default=[],
+        help="Replicas per stage, e.g. ocr=4 data-extraction=2, or N for every stage.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        nargs="+",
+        default=[],
+        help="Claims in flight per replica, e.g. ocr=2, or N for every stage.",
+    )
+    parser.add_argument(
+        "--model", type=str, default=None, help="Model JSON written by --save_model."
+    )
+    parser.add_argument(
+        "--latency_scale",
+        type=float,
+        default=1,
+        help="MOCK_LATENCY_SCALE of the default model of the mock workers.",
+    )
+    parser.add_argument(
+        "--calibrate_window",
+        type=float,
+        default=None,
+        help="Calibrate service times, failure rates and routes from claims completed in the last N seconds.",
+    )
+    parser.add_argument("--save_model", type=str, default=None)
+    parser.add_argument(
+        "--warmup", type=float, default=0, help="Seconds excluded from the statistics."
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--json", action="store_true", help="Print the raw report as JSON."
+    )
+
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.model:
+        with open(args.model, "r") as f:
+            model = PipelineModel.from_json(f.read())
+    else:
+        model = default_model(args.latency_scale)
+    if args.calibrate_window:
+        model = calibrate(asyncio.run(fetch_records(args.calibrate_window)), model, rng)
+    apply_overrides(model, args.replicas, "replicas")
+    apply_overrides(model, args.concurrency, "concurrency")
+    if args.save_model:
+        with open(args.save_model, "w") as f:
+            f.write(model.to_json())
+
+    profile = (
+        parse_profile(args.profile)
+        if args.profile
+        else [Segment(rate=args.rate, duration_s=args.duration)]
+    )
+    arrivals = arrival_offsets(profile, None, not args.constant_arrivals, rng)
+
+    report = Simulation(model, args.seed).run(arrivals, args.warmup)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
@@ -1,79 +1,97 @@
 import asyncio
-import json
-import os
-import random
 
-import redis.asyncio as redis
 from dotenv import load_dotenv
 
+from common.batching import MicroBatcher
+from common.cost_positions import (
+    cost_positions_dir,
+    CostPositionTable,
+    load_cost_positions,
+)
+from common.mock import mock_batch_delay, mock_random
+from common.plausibility import load_plausibility_rules
 from common.storage import get_local_storage
 from common.utils import get_logger, Queues
+from common.worker import Route, StageWorker
 
 load_dotenv()
 
 
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", 6379))
-)
-
 logger = get_logger()
-MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
+
+# Loaded once per worker, see common/plausibility.py for the rule file format.
+plausibility_rules = load_plausibility_rules()
+
+
+async def check_plausibility(
+    claims: list[tuple[str, str | None, CostPositionTable]],
+) -> list[tuple[bool, list[str]]]:
+    # The cost positions of a batch of (claim id, content hash, cost positions)
+    # are checked against the plausibility rules in one pass, the judgement of
+    # the cases themselves is mocked as one model call.
+
+    fired_rules = plausibility_rules.check([table for _, _, table in claims])
+
+    rngs = [
+        mock_random("case_plausibility_check", content_hash or claim_id)
+        for claim_id, content_hash, _ in claims
+    ]
+    await mock_batch_delay("case_plausibility_check", rngs)
+
+    return [
+        (not fired and rng.choices([True, False], [0.8, 0.2], k=1)[0], fired)
+        for rng, fired in zip(rngs, fired_rules)
+    ]
 
 
-async def run_case_plausibility_check(claim_id: str) -> bool:
-    # This function mocks the plausibility check of the cost positions
+plausibility_batcher = MicroBatcher("case-plausibility-check", check_plausibility)
 
+
+async def run_case_plausibility_check(
+    claim_id: str, content_hash: str | None = None
+) -> tuple[bool, list[str]]:
     case_document_dir = get_local_storage().file_path(claim_id)
-    case_df_path = case_document_dir / f"{claim_id.lower()}.parquet"
-
-    # code to check plausibility
-
-    await asyncio.sleep(random.randint(1, 5))
-
-    result = random.choices([True, False], [0.8, 0.2], k=1)
-
-    return result[0]
-
-
-async def worker():
-    while True:
-        message = await r.brpop(
-            [Queues.CASE_PLAUSIBILITY_CHECK_QUEUE.value], timeout=10
-        )
-        if message:
-            queue_name, data = message
-            payload = json.loads(data)
-            claim_id = payload["claim_id"]
-            retries = payload.get("retries", 0)
-            try:
-                result = await run_case_plausibility_check(claim_id)
-                metadata = {
-                    "claim_id": claim_id,
-                    "status": f"case_plausibility_check_{str(result).lower()}",
-                }
-
-                if result:
-                    await r.lpush(
-                        Queues.CLAIM_ACCEPTANCE_QUEUE.value, json.dumps(metadata)
-                    )
-                else:
-                    logger.info(f"Rejected {claim_id=}.")
-                    await r.lpush(
-                        Queues.CLAIM_REJECTION_QUEUE.value, json.dumps(metadata)
-                    )
-                    # The claim was rejected. The claim can be added to a separate queue for rejection or human feedback
-            except Exception as e:
-                if retries < MAX_RETRIES:
-                    payload["retries"] = retries + 1
-                    await r.lpush(
-                        Queues.CASE_PLAUSIBILITY_CHECK_QUEUE.value, json.dumps(payload)
-                    )
-                else:
-                    await r.lpush(
-                        Queues.CASE_PLAUSIBILITY_CHECK_DLQ.value, json.dumps(payload)
-                    )
-                    logger.error(f"Added {claim_id=} to case plausibility check DLQ.")
+    table = load_cost_positions(cost_positions_dir(case_document_dir, claim_id))
+
+    # Claims checked at the same time share one pass over the rules.
+    result, fired_rules = await plausibility_batcher.submit(
+        (claim_id, content_hash, table)
+    )
+    if fired_rules:
+        logger.info(f"[{claim_id}] plausibility rules fired: {fired_rules}")
+
+    return result, fired_rules
+
+
+async def handle_claim(payload: dict) -> Route:
+    claim_id = payload["claim_id"]
+    result, fired_rules = await run_case_plausibility_check(
+        claim_id, payload.get("content_hash")
+    )
+    metadata = {
+        "claim_id": claim_id,
+        "status": f"case_plausibility_check_{str(result).lower()}",
+    }
+
+    if result:
+        return Queues.CLAIM_ACCEPTANCE_QUEUE, metadata
+
+    # The rules that fired tell a reviewer why, none if the mocked judgement
+    # rejected the claim.
+    metadata["fired_rules"] = fired_rules
+    logger.info(f"Rejected {claim_id=}.")
+    # The claim was rejected. The claim can be added to a separate queue for rejection or human feedback
+    return Queues.CLAIM_REJECTION_QUEUE, metadata
+
+
+def create_worker(**kwargs) -> StageWorker:
+    return StageWorker(
+        queue=Queues.CASE_PLAUSIBILITY_CHECK_QUEUE,
+        dlq=Queues.CASE_PLAUSIBILITY_CHECK_DLQ,
+        handler=handle_claim,
+        **kwargs,
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(worker())
+    asyncio.run(create_worker().run())
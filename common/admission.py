@@ -0,0 +1,307 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+from prometheus_client import Counter, Histogram
+
+from common.metrics import STAGE_LATENCY_BUCKETS
+from common.priority import lane_queue, PRIORITY_LANES
+from common.queue_depth import (
+    QueueDepthSampler,
+    QUEUE_DEPTH_SAMPLE_INTERVAL_S,
+    stage_queue_lanes,
+)
+from common.queues import Message, QueueBackend
+from common.utils import get_logger, Queues
+
+load_dotenv()
+
+
+# Claims waiting in the stage queues above which new claims are parked in the
+# spill queue, and above which they are rejected. 0 disables the limit.
+ADMISSION_SPILL_BACKLOG = int(os.getenv("ADMISSION_SPILL_BACKLOG", 2000))
+ADMISSION_MAX_BACKLOG = int(os.getenv("ADMISSION_MAX_BACKLOG", 10000))
+ADMISSION_RETRY_AFTER_S = float(os.getenv("ADMISSION_RETRY_AFTER_S", 30))
+
+# Sustained claims per second and burst allowed per sender. 0 disables the limit.
+SENDER_RATE_LIMIT = float(os.getenv("SENDER_RATE_LIMIT", 5))
+SENDER_BURST = int(os.getenv("SENDER_BURST", 50))
+# Senders with a bucket kept in memory; the least recently seen are dropped.
+SENDER_BUCKETS_MAX = int(os.getenv("SENDER_BUCKETS_MAX", 10000))
+
+SPILL_DRAIN_BATCH_SIZE = int(os.getenv("SPILL_DRAIN_BATCH_SIZE", 100))
+
+ADMISSION_DECISIONS_TOTAL = Counter(
+    "admission_decisions_total",
+    "Claims submitted to the ingestion endpoint, by decision (admitted, spilled, rejected) and reason.",
+    ["decision", "reason", "lane"],
+)
+
+SPILL_DELAY_SECONDS = Histogram(
+    "spill_delay_seconds",
+    "Time a claim was held in the spill queue before entering the pipeline in seconds.",
+    buckets=STAGE_LATENCY_BUCKETS,
+)
+
+
+def stage_queues() -> list[str]:
+    # The queues whose backlog admission control bounds: every lane of every
+    # stage queue, without the dead-letter, final and spill queues.
+    return [queue for lanes in stage_queue_lanes().values() for queue in lanes]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self, now: float) -> float:
+        # Returns 0 if a token was taken, otherwise the seconds until the next
+        # token is available.
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+@dataclass
+class Admission:
+    decision: str
+    reason: str | None = None
+    retry_after_s: float | None = None
+    sender: str | None = None
+    lane: str | None = None
+    # The queue depth sample the claim was counted against.
+    sampled_at: float | None = None
+
+
+class AdmissionController:
+    # Decides per submission whether a claim enters the pipeline, waits in the
+    # spill queue or is rejected with 429. The backlog comes from the latest
+    # queue depth sample plus the claims admitted since, so a burst between two
+    # samples cannot overshoot the limits. Claims in the highest lane are never
+    # spilled. The hard limit counts spilled claims too, so the spill queue is
+    # bounded as well.
+    #
+    # A claim that is not rejected reserves its sender token and its place in
+    # the backlog when admitted, so concurrent submissions see each other. The
+    # decision is counted with `confirm` once the claim is stored, and `cancel`
+    # returns the reservation of a claim that never entered the pipeline, e.g.
+    # an oversized attachment.
+    #
+    # Sender buckets live in the process, so with several ingestion replicas
+    # a sender gets the limit once per replica.
+
+    def __init__(
+        self,
+        sampler: QueueDepthSampler,
+        spill_backlog: int = ADMISSION_SPILL_BACKLOG,
+        max_backlog: int = ADMISSION_MAX_BACKLOG,
+        retry_after_s: float = ADMISSION_RETRY_AFTER_S,
+        sender_rate: float = SENDER_RATE_LIMIT,
+        sender_burst: int = SENDER_BURST,
+        max_senders: int = SENDER_BUCKETS_MAX,
+    ):
+        self.sampler = sampler
+        self.spill_backlog = spill_backlog
+        self.max_backlog = max_backlog
+        self.retry_after_s = retry_after_s
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.max_senders = max_senders
+        self.queues = stage_queues()
+        self.priority_lane = next(iter(PRIORITY_LANES))
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._sampled_at: float | None = None
+        self._admitted_since_sample = 0
+        self._spilled_since_sample = 0
+
+    def _refresh(self):
+        if self.sampler.sampled_at != self._sampled_at:
+            self._sampled_at = self.sampler.sampled_at
+            self._admitted_since_sample = 0
+            self._spilled_since_sample = 0
+
+    def backlog(self) -> int | None:
+        # None until the first sample, in which case every claim is admitted.
+        if self.sampler.sampled_at is None:
+            return None
+        self._refresh()
+        return self._admitted_since_sample + sum(
+            self.sampler.depths.get(queue, 0) for queue in self.queues
+        )
+
+    def spilled(self) -> int:
+        self._refresh()
+        return self._spilled_since_sample + self.sampler.depths.get(
+            Queues.CLAIM_SPILL_QUEUE.value, 0
+        )
+
+    def released(self, count: int):
+        # Spilled claims that moved into the pipeline since the last sample.
+        self._refresh()
+        self._admitted_since_sample += count
+        self._spilled_since_sample -= count
+
+    def spill_room(self) -> int:
+        # Claims that can move from the spill queue into the pipeline now.
+        backlog = self.backlog()
+        if backlog is None or self.spill_backlog <= 0:
+            return 0
+        return max(self.spill_backlog - backlog, 0)
+
+    def _sender_wait(self, sender: str) -> float:
+        if self.sender_rate <= 0:
+            return 0.0
+        key = self._sender_key(sender)
+        bucket = self._buckets.pop(key, None) or TokenBucket(
+            self.sender_rate, self.sender_burst
+        )
+        self._buckets[key] = bucket
+        if len(self._buckets) > self.max_senders:
+            self._buckets.popitem(last=False)
+        return bucket.take(time.monotonic())
+
+    @staticmethod
+    def _sender_key(sender: str) -> str:
+        return sender.strip().lower()
+
+    def admit(self, sender: str, lane: str) -> Admission:
+        wait = self._sender_wait(sender)
+        if wait > 0:
+            admission = Admission("rejected", "sender_rate", wait)
+        else:
+            backlog = self.backlog()
+            if backlog is None:
+                admission = Admission("admitted")
+            elif 0 < self.max_backlog <= backlog + self.spilled():
+                admission = Admission("rejected", "backlog", self.retry_after_s)
+            elif lane != self.priority_lane and (
+                0 < self.spill_backlog <= backlog
+                # Claims queue up behind those already spilled instead of
+                # overtaking them while the spill queue drains.
+                or self.spilled() > 0
+            ):
+                admission = Admission("spilled", "backlog")
+            else:
+                admission = Admission("admitted")
+
+        admission.sender, admission.lane = sender, lane
+        if admission.decision == "rejected":
+            self.confirm(admission)
+            return admission
+
+        self._refresh()
+        admission.sampled_at = self._sampled_at
+        if admission.decision == "admitted":
+            self._admitted_since_sample += 1
+        else:
+            self._spilled_since_sample += 1
+        return admission
+
+    def confirm(self, admission: Admission):
+        ADMISSION_DECISIONS_TOTAL.labels(
+            decision=admission.decision,
+            reason=admission.reason or "none",
+            lane=admission.lane,
+        ).inc()
+
+    def cancel(self, admission: Admission):
+        if admission.decision == "rejected":
+            return
+        if self.sender_rate > 0:
+            bucket = self._buckets.get(self._sender_key(admission.sender))
+            if bucket is not None:
+                bucket.give_back()
+        # A newer sample has reset the counts the claim was added to.
+        self._refresh()
+        if admission.sampled_at != self._sampled_at:
+            return
+        if admission.decision == "admitted":
+            self._admitted_since_sample -= 1
+        else:
+            self._spilled_since_sample -= 1
+
+
+class SpillDrainer:
+    # Moves spilled claims into their ingestion lane in arrival order whenever
+    # the backlog has fallen below the spill threshold.
+
+    def __init__(
+        self,
+        queue_backend: QueueBackend,
+        controller: AdmissionController,
+        interval: float = QUEUE_DEPTH_SAMPLE_INTERVAL_S,
+        batch_size: int = SPILL_DRAIN_BATCH_SIZE,
+    ):
+        self.queue_backend = queue_backend
+        self.controller = controller
+        self.interval = interval
+        self.batch_size = batch_size
+
+    async def drain(self) -> int:
+        room = self.controller.spill_room()
+        moved = 0
+        while moved < room:
+            messages = await self.queue_backend.try_pop(
+                Queues.CLAIM_SPILL_QUEUE.value, min(self.batch_size, room - moved)
+            )
+            if not messages:
+                break
+            # A batch taken off the spill queue is moved or put back as a
+            # whole; a shutdown waits for that instead of dropping the claims.
+            move = asyncio.ensure_future(self._move(messages))
+            try:
+                await asyncio.shield(move)
+            except asyncio.CancelledError:
+                await move
+                raise
+            moved += len(messages)
+        return moved
+
+    async def _move(self, messages: list[Message]):
+        for position, message in enumerate(messages):
+            payload = json.loads(message.data)
+            now = time.time()
+            payload["enqueued_at"] = now
+            try:
+                await self.queue_backend.route(
+                    message,
+                    lane_queue(Queues.EMAIL_INGESTION_QUEUE.value, payload.get("lane")),
+                    json.dumps(payload),
+                )
+            except Exception:
+                self.controller.released(position)
+                await self._put_back(messages[position:])
+                raise
+            SPILL_DELAY_SECONDS.observe(max(now - payload["spilled_at"], 0))
+        self.controller.released(len(messages))
+
+    async def _put_back(self, messages: list[Message]):
+        # Claims popped from a list are gone from the spill queue, so those
+        # that were not moved are pushed again and queue up behind the others.
+        # Stream entries stay pending until acknowledged and are reclaimed.
+        for message in messages:
+            if message.receipt is None:
+                await self.queue_backend.push(
+                    Queues.CLAIM_SPILL_QUEUE.value, message.data
+                )
+
+    async def run(self):
+        while True:
+            try:
+                await self.drain()
+            except Exception as e:
+                get_logger().warning(f"Draining the spill queue failed: {e!r}")
+            await asyncio.sleep(self.interval)
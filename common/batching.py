@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from dotenv import load_dotenv
+from prometheus_client import Histogram
+
+load_dotenv()
+
+
+# Claims in flight at the same time in a stage are collected into one call of a
+# batch-aware model function. A batch is dispatched once it holds
+# `max_batch_size` claims or its first claim has waited `max_wait_ms`, and every
+# claim resumes with its own result. Both settings can be overridden per stage,
+# e.g. DOCUMENT_CLASSIFIER_MICRO_BATCH_SIZE, and fall back to the global
+# MICRO_BATCH_SIZE or MICRO_BATCH_MAX_WAIT_MS. A batch size of 1 dispatches
+# every claim on its own without waiting.
+#
+# A stage never has more claims in flight than WORKER_CONCURRENCY, which
+# therefore bounds the batches that can form.
+
+MICRO_BATCH_SIZE = int(os.getenv("MICRO_BATCH_SIZE", 8))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", 20))
+
+MICRO_BATCH_SIZE_CLAIMS = Histogram(
+    "micro_batch_size_claims",
+    "Claims per micro-batch dispatched to a batch model call.",
+    ["stage"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+MICRO_BATCH_WAIT_SECONDS = Histogram(
+    "micro_batch_wait_seconds",
+    "Time a claim waited for its micro-batch to be dispatched in seconds.",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Receives the items of a batch and returns one result per item, in order. An
+# exception in place of a result fails only that item.
+BatchFunction = Callable[[list[T]], Awaitable[list[R | BaseException]]]
+
+
+class MicroBatcher(Generic[T, R]):
+    def __init__(
+        self,
+        stage: str,
+        batch_function: BatchFunction,
+        max_batch_size: int | None = None,
+        max_wait_ms: float | None = None,
+    ):
+        self.stage = stage
+        self.batch_function = batch_function
+        prefix = stage.upper().replace("-", "_")
+        self.max_batch_size = max_batch_size or int(
+            os.getenv(f"{prefix}_MICRO_BATCH_SIZE", MICRO_BATCH_SIZE)
+        )
+        if max_wait_ms is None:
+            max_wait_ms = float(
+                os.getenv(f"{prefix}_MICRO_BATCH_MAX_WAIT_MS", MICRO_BATCH_MAX_WAIT_MS)
+            )
+        self.max_wait = max_wait_ms / 1000
+        self._items: list[T] = []
+        self._futures: list[asyncio.Future] = []
+        self._submitted_at: list[float] = []
+        self._flush_timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item: T) -> R:
+        future = asyncio.get_running_loop().create_future()
+        self._items.append(item)
+        self._futures.append(future)
+        self._submitted_at.append(time.monotonic())
+
+        if len(self._items) >= self.max_batch_size:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self.max_wait, self.flush
+            )
+
+        return await future
+
+    def flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        items, self._items = self._items, []
+        futures, self._futures = self._futures, []
+        submitted_at, self._submitted_at = self._submitted_at, []
+        if not items:
+            return
+
+        dispatched_at = time.monotonic()
+        MICRO_BATCH_SIZE_CLAIMS.labels(stage=self.stage).observe(len(items))
+        for submitted in submitted_at:
+            MICRO_BATCH_WAIT_SECONDS.labels(stage=self.stage).observe(
+                dispatched_at - submitted
+            )
+        # The task is referenced until done, so it is not garbage collected
+        # while claims are waiting on it.
+        task = asyncio.create_task(self._run(items, futures))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, items: list[T], futures: list[asyncio.Future]):
+        try:
+            results = await self.batch_function(items)
+            if len(results) != len(items):
+                raise ValueError(
+                    f"Batch function of {self.stage} returned {len(results)} "
+                    f"results for {len(items)} items."
+                )
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for result, future in zip(results, futures):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,78 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+from anyio import to_thread
+
+from common.storage import get_local_storage, link_or_copy, LocalStorage
+
+
+# Stage outputs are cached in the content store under the SHA-256 of the claim
+# attachment, so a resent document reuses the work done for its first copy.
+# Results must be JSON serialisable and not None, which `get` uses for a miss.
+
+
+class StageResultCache:
+    def __init__(self, storage: LocalStorage):
+        self.storage = storage
+
+    def _result_path(self, content_hash: str, stage: str) -> Path:
+        return self.storage.content_path(content_hash) / f"{stage}.json"
+
+    async def get(self, content_hash: str | None, stage: str) -> Any | None:
+        if content_hash is None:
+            return None
+        path = self._result_path(content_hash, stage)
+        if not path.exists():
+            return None
+        return await to_thread.run_sync(_read_json, path)
+
+    async def put(self, content_hash: str | None, stage: str, result: Any):
+        if content_hash is None:
+            return
+        path = self._result_path(content_hash, stage)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        await to_thread.run_sync(_write_json, path, result)
+
+    async def get_files(
+        self, content_hash: str | None, stage: str, destinations: dict[str, Path]
+    ) -> bool:
+        # Links the cached files of a stage to `destinations`, keyed by file name
+        # in the cache. Returns False unless every file was cached.
+        if content_hash is None:
+            return False
+        cache_dir = self.storage.content_path(content_hash) / stage
+        if not all((cache_dir / name).exists() for name in destinations):
+            return False
+        for name, destination in destinations.items():
+            await to_thread.run_sync(link_or_copy, cache_dir / name, destination)
+        return True
+
+    async def put_files(
+        self, content_hash: str | None, stage: str, sources: dict[str, Path]
+    ):
+        if content_hash is None:
+            return
+        cache_dir = self.storage.content_path(content_hash) / stage
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for name, source in sources.items():
+            await to_thread.run_sync(link_or_copy, source, cache_dir / name)
+
+
+def _read_json(path: Path) -> Any:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_json(path: Path, result: Any):
+    partial_path = path.with_name(f".{uuid4()}.part")
+    with open(partial_path, "w") as f:
+        json.dump(result, f)
+    partial_path.replace(path)
+
+
+@lru_cache
+def get_stage_cache():
+    return StageResultCache(get_local_storage())
@@ -0,0 +1,71 @@
+import json
+from pathlib import Path
+from uuid import uuid4
+
+
+# The fields data extraction finds on a claim, written next to the claim
+# document for the later stages. Values are the strings as printed.
+
+# Labels of the invoice fields, printed before the value on the same line or on
+# the line before it, with the heading of the section they are printed in. None
+# for labels that occur once on the invoice.
+FIELD_LABELS = {
+    "claim_number": ("Claim ID:", None),
+    "policyholder_name": ("Name:", "Policyholder Information"),
+    "policy_number": ("Insurance Policy Number:", None),
+    "repair_shop_name": ("Name:", "Insurer / Repair Shop Information"),
+    "repair_shop_address": ("Address:", "Insurer / Repair Shop Information"),
+    "iban": ("IBAN:", "Insurer / Repair Shop Information"),
+    "bicycle_model": ("Manufacturer & Model:", None),
+    "serial_number": ("Serial Number:", None),
+    "purchase_date": ("Date of Purchase:", None),
+    "incident_date": ("Incident Date:", None),
+}
+
+# Section headings of the invoice, in the order they are printed.
+SECTION_HEADINGS = (
+    "Policyholder Information",
+    "Insurer / Repair Shop Information",
+    "Bicycle Details",
+    "Incident Description",
+    "Documentation Provided",
+)
+
+
+def claim_fields_path(claim_document_dir: Path, claim_id: str) -> Path:
+    return claim_document_dir / f"{claim_id.lower()}.fields.json"
+
+
+def fields_from_text(text: str) -> dict[str, str]:
+    # The first value following each label within its section; labels without
+    # a value are left out.
+    lines = [line.strip() for line in text.splitlines()] + [""]
+    fields = {}
+    section = None
+    for index, line in enumerate(lines[:-1]):
+        if line in SECTION_HEADINGS:
+            section = line
+            continue
+        for name, (label, label_section) in FIELD_LABELS.items():
+            if name in fields or not line.startswith(label):
+                continue
+            if label_section is not None and label_section != section:
+                continue
+            value = line.removeprefix(label).strip() or lines[index + 1]
+            if value:
+                fields[name] = value
+    return fields
+
+
+def write_claim_fields(path: Path, fields: dict):
+    partial_path = path.with_name(f".{uuid4()}.part")
+    with open(partial_path, "w") as f:
+        json.dump(fields, f, ensure_ascii=False)
+    partial_path.replace(path)
+
+
+def load_claim_fields(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
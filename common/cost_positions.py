@@ -0,0 +1,201 @@
+import json
+import os
+import re
+import shutil
+import uuid
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+import numpy as np
+import pymupdf
+
+
+# Line items are stored column by column, one .npy file per column, so
+# downstream checks memory-map exactly the columns they need instead of parsing
+# text. Amounts are integer cents, which keeps sums exact.
+#
+# PyMuPDF is not thread safe; `extract_cost_positions_to` runs in worker
+# processes of a ProcessPoolExecutor like the functions in common/pdf_text.py.
+
+INVOICE_TABLE_HEADER = ["Position", "Description", "Quantity", "Unit Price", "Total"]
+
+COLUMN_FILES = {
+    "description": "description.npy",
+    "quantity": "quantity.npy",
+    "unit_price_cents": "unit_price_cents.npy",
+    "total_cents": "total_cents.npy",
+}
+TOTALS_FILE = "totals.json"
+COST_POSITION_FILES = (*COLUMN_FILES.values(), TOTALS_FILE)
+
+# Labels of the totals block printed below the invoice table.
+TOTAL_LABELS = {
+    "subtotal_cents": re.compile(r"Subtotal\s+([\d.,]+)\s*€"),
+    "vat_cents": re.compile(r"VAT[^\n]*\s+([\d.,]+)\s*€"),
+    "total_cents": re.compile(r"Total \(Gross\)\s+([\d.,]+)\s*€"),
+}
+# Height below the last table row searched for the totals block, in points.
+TOTALS_SEARCH_HEIGHT = 120
+
+
+@dataclass
+class CostPositionTable:
+    description: np.ndarray
+    quantity: np.ndarray
+    unit_price_cents: np.ndarray
+    total_cents: np.ndarray
+    # subtotal_cents, vat_cents and total_cents as printed, None if missing.
+    totals: dict[str, int | None]
+
+    def __len__(self) -> int:
+        return len(self.quantity)
+
+
+def cost_positions_dir(claim_document_dir: Path, claim_id: str) -> Path:
+    return claim_document_dir / f"{claim_id.lower()}.cost_positions"
+
+
+def parse_cents(text: str | None) -> int | None:
+    if not text:
+        return None
+    try:
+        amount = Decimal(text.strip().rstrip("€").strip().replace(",", ""))
+    except InvalidOperation:
+        return None
+    return int(amount * 100)
+
+
+def _parse_row(row: list[str | None]) -> tuple | None:
+    # Rows whose quantity or amounts do not parse, e.g. a repeated header or an
+    # empty filler row, are skipped.
+    _, description, quantity, unit_price, total = row
+    unit_price_cents, total_cents = parse_cents(unit_price), parse_cents(total)
+    if not (quantity or "").strip().isdigit() or None in (
+        unit_price_cents,
+        total_cents,
+    ):
+        return None
+    return (
+        " ".join((description or "").split()),
+        int(quantity),
+        unit_price_cents,
+        total_cents,
+    )
+
+
+def extract_cost_positions(document_path: str) -> CostPositionTable:
+    # Table detection is expensive, so it only runs on pages that mention the
+    # invoice table header, and on the pages following the first hit, where
+    # the table continues without a header when it spills over.
+    rows = []
+    totals = dict.fromkeys(TOTAL_LABELS)
+    with pymupdf.open(document_path) as document:
+        in_table = False
+        for page in document:
+            if not in_table and not page.search_for(INVOICE_TABLE_HEADER[3]):
+                continue
+            tables = [
+                table
+                for table in page.find_tables().tables
+                if table.col_count == len(INVOICE_TABLE_HEADER)
+                and (in_table or table.header.names == INVOICE_TABLE_HEADER)
+            ]
+            if not tables and not in_table:
+                continue
+
+            if tables:
+                in_table = True
+                for table in tables:
+                    rows.extend(filter(None, map(_parse_row, table.extract())))
+                below = pymupdf.Rect(tables[-1].bbox)
+                clip = pymupdf.Rect(
+                    below.x0, below.y1, below.x1, below.y1 + TOTALS_SEARCH_HEIGHT
+                )
+            else:
+                # The table ended on the previous page; the totals block may
+                # still have been pushed onto this one.
+                clip = page.rect
+
+            text = page.get_text("text", clip=clip)
+            if not tables:
+                in_table = False
+            for key, pattern in TOTAL_LABELS.items():
+                if match := pattern.search(text):
+                    totals[key] = parse_cents(match.group(1))
+            if totals["total_cents"] is not None:
+                break
+
+    descriptions, quantities, unit_prices, line_totals = (
+        zip(*rows) if rows else [()] * 4
+    )
+    return CostPositionTable(
+        # Fixed-width unicode, sized to the longest description, so the column
+        # can be memory-mapped.
+        description=np.array(descriptions, dtype=np.str_),
+        quantity=np.array(quantities, dtype=np.int32),
+        unit_price_cents=np.array(unit_prices, dtype=np.int64),
+        total_cents=np.array(line_totals, dtype=np.int64),
+        totals=totals,
+    )
+
+
+def new_cost_positions_version(directory: Path) -> Path:
+    # An empty directory next to `directory` for the next version of its table.
+    version = directory.with_name(f"{directory.name}.{uuid.uuid4().hex}")
+    version.mkdir(parents=True)
+    return version
+
+
+def publish_cost_positions(directory: Path, version: Path):
+    # `directory` is a symlink to the current version of the table. It is
+    # switched to `version` with one rename, so readers find either the old or
+    # the new table at every moment, never a partial one or none at all.
+    previous = directory.resolve() if directory.is_symlink() else None
+    if directory.is_dir() and previous is None:
+        # A plain directory, e.g. left from before tables were versioned.
+        shutil.rmtree(directory)
+    link = version.with_name(version.name + ".link")
+    link.symlink_to(version.name)
+    os.replace(link, directory)
+    if previous is not None and previous != version.resolve():
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def write_cost_positions(directory: Path, table: CostPositionTable):
+    version = new_cost_positions_version(directory)
+    for column, file_name in COLUMN_FILES.items():
+        np.save(version / file_name, getattr(table, column))
+    with open(version / TOTALS_FILE, "w") as f:
+        json.dump({"rows": len(table), **table.totals}, f)
+    publish_cost_positions(directory, version)
+
+
+def extract_cost_positions_to(document_path: str, directory: str) -> int:
+    table = extract_cost_positions(document_path)
+    write_cost_positions(Path(directory), table)
+    return len(table)
+
+
+def load_cost_positions(directory: Path) -> CostPositionTable:
+    # Every file is opened from the same version of the table. A version that
+    # is replaced and removed while being opened is read again from the one
+    # that replaced it.
+    try:
+        return _load_cost_positions(directory.resolve())
+    except FileNotFoundError:
+        return _load_cost_positions(directory.resolve())
+
+
+def _load_cost_positions(version: Path) -> CostPositionTable:
+    # The columns are memory-mapped read-only; nothing is read until used.
+    with open(version / TOTALS_FILE, "r") as f:
+        totals = json.load(f)
+    totals.pop("rows", None)
+    return CostPositionTable(
+        **{
+            column: np.load(version / file_name, mmap_mode="r")
+            for column, file_name in COLUMN_FILES.items()
+        },
+        totals=totals,
+    )
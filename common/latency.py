@@ -0,0 +1,181 @@
+import json
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from functools import lru_cache
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+from prometheus_client import Histogram
+
+from common.metrics import STAGE_LATENCY_BUCKETS
+from common.priority import DEFAULT_LANE
+from common.queues import get_local_redis, get_redis, QUEUE_BACKEND
+
+load_dotenv()
+
+
+LATENCY_RECORDS_KEY = os.getenv("LATENCY_RECORDS_KEY", "claim-latency-records")
+LATENCY_RETENTION_S = float(os.getenv("LATENCY_RETENTION_S", 7 * 24 * 3600))
+
+CLAIM_END_TO_END_SECONDS = Histogram(
+    "claim_end_to_end_seconds",
+    "Time from ingestion until a claim reaches the acceptance or rejection queue in seconds.",
+    ["outcome", "lane"],
+    buckets=STAGE_LATENCY_BUCKETS,
+)
+
+PERCENTILES = (50, 95, 99)
+
+
+def build_latency_record(payload: dict, outcome: str, completed_at: float) -> dict:
+    # `payload` is the final metadata of a claim, carrying the stage timeline
+    # appended by every worker it passed through.
+    ingested_at = payload.get("ingested_at", completed_at)
+    return {
+        "claim_id": payload["claim_id"],
+        "outcome": outcome,
+        "lane": payload.get("lane", DEFAULT_LANE),
+        "ingested_at": ingested_at,
+        "completed_at": completed_at,
+        "end_to_end": completed_at - ingested_at,
+        "timeline": payload.get("timeline", []),
+    }
+
+
+class LatencyStore(ABC):
+    @abstractmethod
+    async def record(self, record: dict):
+        pass
+
+    @abstractmethod
+    async def fetch(self, since: float, until: float) -> list[dict]:
+        pass
+
+
+class RedisLatencyStore(LatencyStore):
+    # Completed claims are kept in a sorted set scored by completion time, so a
+    # time window is a single ZRANGEBYSCORE. Records older than the retention
+    # are trimmed in the same pipeline as every insert.
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        key: str = LATENCY_RECORDS_KEY,
+        retention_s: float = LATENCY_RETENTION_S,
+    ):
+        self.client = client
+        self.key = key
+        self.retention_s = retention_s
+
+    async def record(self, record: dict):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zadd(self.key, {json.dumps(record): record["completed_at"]})
+        pipe.zremrangebyscore(
+            self.key, "-inf", record["completed_at"] - self.retention_s
+        )
+        await pipe.execute()
+
+    async def fetch(self, since: float, until: float) -> list[dict]:
+        members = await self.client.zrangebyscore(self.key, since, until)
+        return [json.loads(member) for member in members]
+
+
+class InMemoryLatencyStore(LatencyStore):
+    # Records arrive in the order claims complete, so those older than the
+    # retention are dropped from the front on every insert, like the trim of
+    # RedisLatencyStore.
+
+    def __init__(self, retention_s: float = LATENCY_RETENTION_S):
+        self.retention_s = retention_s
+        self.records: deque[dict] = deque()
+
+    async def record(self, record: dict):
+        self.records.append(record)
+        expired_at = record["completed_at"] - self.retention_s
+        while self.records and self.records[0]["completed_at"] <= expired_at:
+            self.records.popleft()
+
+    async def fetch(self, since: float, until: float) -> list[dict]:
+        return [
+            record
+            for record in self.records
+            if since <= record["completed_at"] <= until
+        ]
+
+
+@lru_cache
+def get_latency_store() -> LatencyStore:
+    # Records stay next to the queues, see get_queue_backend.
+    if QUEUE_BACKEND == "memory":
+        return InMemoryLatencyStore()
+    if QUEUE_BACKEND == "local":
+        return RedisLatencyStore(get_local_redis())
+    return RedisLatencyStore(get_redis())
+
+
+def percentiles(values: list[float]) -> dict:
+    # Nearest-rank percentiles; good enough for an operational report.
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    summary = {"count": len(ordered), "mean": sum(ordered) / len(ordered)}
+    for percentile in PERCENTILES:
+        rank = max(math.ceil(percentile / 100 * len(ordered)) - 1, 0)
+        summary[f"p{percentile}"] = ordered[rank]
+    return summary
+
+
+def summarize(records: list[dict]) -> dict:
+    end_to_end = [record["end_to_end"] for record in records]
+    waits = defaultdict(list)
+    processing = defaultdict(list)
+
+    for record in records:
+        for entry in record["timeline"]:
+            stage = entry["stage"]
+            processing[stage].append(entry["exit"] - entry["enter"])
+            if entry.get("enqueued_at") is not None:
+                waits[stage].append(max(entry["enter"] - entry["enqueued_at"], 0))
+
+    total_end_to_end = sum(end_to_end) or 1
+    stages = {}
+    for stage in processing:
+        stage_total = sum(waits[stage]) + sum(processing[stage])
+        stages[stage] = {
+            "queue_wait": percentiles(waits[stage]),
+            "processing": percentiles(processing[stage]),
+            # Share of the summed end-to-end latency spent in this stage,
+            # waiting included. The largest shares form the critical path.
+            "share_of_end_to_end": stage_total / total_end_to_end,
+        }
+
+    outcomes = defaultdict(int)
+    lanes = defaultdict(list)
+    for record in records:
+        outcomes[record["outcome"]] += 1
+        lanes[record.get("lane", DEFAULT_LANE)].append(record["end_to_end"])
+
+    return {
+        "claims": len(records),
+        "outcomes": dict(outcomes),
+        "end_to_end": percentiles(end_to_end),
+        "lanes": {lane: percentiles(values) for lane, values in lanes.items()},
+        "stages": dict(
+            sorted(
+                stages.items(),
+                key=lambda item: item[1]["share_of_end_to_end"],
+                reverse=True,
+            )
+        ),
+    }
+
+
+async def latency_report(
+    window_s: float, until: float | None = None, store: LatencyStore | None = None
+) -> dict:
+    until = until or time.time()
+    records = await (store or get_latency_store()).fetch(until - window_s, until)
+    return {"window_s": window_s, "until": until, **summarize(records)}
@@ -0,0 +1,270 @@
+import asyncio
+import time
+from collections import deque
+
+
+# Deletes KEYS[1] only while it still holds ARGV[1], e.g. a lock only by the
+# holder of its token. LocalRedis runs it as its Python equivalent.
+COMPARE_AND_DELETE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    return str(value).encode()
+
+
+def _score(value) -> float:
+    if isinstance(value, bytes):
+        value = value.decode()
+    return float(value)
+
+
+class LocalRedis:
+    # In-process stand-in for the subset of `redis.asyncio.Redis` used by
+    # RedisListQueue and RedisLatencyStore: list, sorted set and string
+    # commands, the scripts defined above, and pipelines. Replies use the same
+    # types as redis-py without decode_responses, i.e. values come back as
+    # bytes.
+    #
+    # Commands run without yielding to the event loop, so every command and
+    # every pipeline executes atomically like on a single-threaded Redis.
+    # Blocking pops wait on a condition that is notified by every push.
+
+    def __init__(self):
+        self.lists: dict[bytes, deque] = {}
+        self.sorted_sets: dict[bytes, dict[bytes, float]] = {}
+        # Strings with their expiry as a monotonic time, or None.
+        self.strings: dict[bytes, tuple[bytes, float | None]] = {}
+        self._pushed = asyncio.Condition()
+
+    def pipeline(self, transaction: bool = True) -> "LocalPipeline":
+        return LocalPipeline(self)
+
+    async def lpush(self, key, *values) -> int:
+        depth = self._lpush(key, *values)
+        await self._notify()
+        return depth
+
+    async def llen(self, key) -> int:
+        return self._llen(key)
+
+    async def lindex(self, key, index: int) -> bytes | None:
+        return self._lindex(key, index)
+
+    async def blmpop(
+        self, timeout: float, numkeys: int, *keys, direction: str, count: int = 1
+    ):
+        # Returns [key, [values]] like Redis, or None once `timeout` seconds
+        # passed without any of `keys` holding an element. 0 blocks forever.
+        keys = keys[:numkeys]
+        return await self._wait_for(
+            lambda: self._lmpop(keys, direction, count), timeout
+        )
+
+    async def lmpop(self, numkeys: int, *keys, direction: str, count: int = 1):
+        return self._lmpop(keys[:numkeys], direction, count)
+
+    async def brpop(self, keys, timeout: float = 0):
+        if isinstance(keys, (str, bytes)):
+            keys = [keys]
+
+        def pop():
+            popped = self._lmpop(keys, "RIGHT", 1)
+            if popped is None:
+                return None
+            key, values = popped
+            return key, values[0]
+
+        return await self._wait_for(pop, timeout)
+
+    async def delete(self, *keys) -> int:
+        return self._delete(*keys)
+
+    async def zadd(self, key, mapping: dict) -> int:
+        return self._zadd(key, mapping)
+
+    async def zremrangebyscore(self, key, min, max) -> int:
+        return self._zremrangebyscore(key, min, max)
+
+    async def zrangebyscore(
+        self, key, min, max, start: int | None = None, num: int | None = None
+    ) -> list[bytes]:
+        return self._zrangebyscore(key, min, max, start, num)
+
+    async def zrem(self, key, *members) -> int:
+        return self._zrem(key, *members)
+
+    async def set(self, key, value, nx: bool = False, px: int | None = None):
+        return self._set(key, value, nx, px)
+
+    async def get(self, key) -> bytes | None:
+        return self._get(key)
+
+    async def eval(self, script: str, numkeys: int, *keys_and_args):
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        if script == COMPARE_AND_DELETE:
+            if self._get(keys[0]) != _encode(args[0]):
+                return 0
+            return self._delete(keys[0])
+        raise NotImplementedError("LocalRedis only runs the scripts it defines.")
+
+    async def aclose(self):
+        pass
+
+    async def _notify(self):
+        async with self._pushed:
+            self._pushed.notify_all()
+
+    async def _wait_for(self, pop, timeout: float):
+        # `pop` takes the elements when it finds any, so its first non-empty
+        # result is kept rather than calling it again.
+        popped = [pop()]
+        if popped[0] is not None:
+            return popped[0]
+
+        def ready() -> bool:
+            popped[0] = pop()
+            return popped[0] is not None
+
+        async with self._pushed:
+            try:
+                await asyncio.wait_for(self._pushed.wait_for(ready), timeout or None)
+            except asyncio.TimeoutError:
+                return None
+        return popped[0]
+
+    def _lpush(self, key, *values) -> int:
+        items = self.lists.setdefault(_encode(key), deque())
+        for value in values:
+            items.appendleft(_encode(value))
+        return len(items)
+
+    def _llen(self, key) -> int:
+        return len(self.lists.get(_encode(key), ()))
+
+    def _lindex(self, key, index: int) -> bytes | None:
+        items = self.lists.get(_encode(key))
+        if not items or not -len(items) <= index < len(items):
+            return None
+        return items[index]
+
+    def _lmpop(self, keys, direction: str, count: int):
+        for key in keys:
+            items = self.lists.get(_encode(key))
+            if not items:
+                continue
+            pop = items.pop if direction.upper() == "RIGHT" else items.popleft
+            values = [pop() for _ in range(min(count, len(items)))]
+            if not items:
+                del self.lists[_encode(key)]
+            return [_encode(key), values]
+        return None
+
+    def _delete(self, *keys) -> int:
+        deleted = 0
+        for key in map(_encode, keys):
+            for store in (self.lists, self.sorted_sets, self.strings):
+                if store.pop(key, None) is not None:
+                    deleted += 1
+        return deleted
+
+    def _zadd(self, key, mapping: dict) -> int:
+        members = self.sorted_sets.setdefault(_encode(key), {})
+        added = 0
+        for member, score in mapping.items():
+            member = _encode(member)
+            added += member not in members
+            members[member] = float(score)
+        return added
+
+    def _zremrangebyscore(self, key, min, max) -> int:
+        members = self.sorted_sets.get(_encode(key), {})
+        removed = [
+            member
+            for member, score in members.items()
+            if _score(min) <= score <= _score(max)
+        ]
+        for member in removed:
+            del members[member]
+        return len(removed)
+
+    def _zrangebyscore(
+        self, key, min, max, start: int | None = None, num: int | None = None
+    ) -> list[bytes]:
+        members = self.sorted_sets.get(_encode(key), {})
+        in_range = [
+            member
+            for member, score in sorted(members.items(), key=lambda item: item[1])
+            if _score(min) <= score <= _score(max)
+        ]
+        if start is not None and num is not None:
+            return in_range[start : start + num]
+        return in_range
+
+    def _zrem(self, key, *members) -> int:
+        sorted_set = self.sorted_sets.get(_encode(key), {})
+        return sum(
+            sorted_set.pop(_encode(member), None) is not None for member in members
+        )
+
+    def _set(self, key, value, nx: bool = False, px: int | None = None):
+        key = _encode(key)
+        if nx and self._get(key) is not None:
+            return None
+        expires_at = time.monotonic() + px / 1000 if px is not None else None
+        self.strings[key] = (_encode(value), expires_at)
+        return True
+
+    def _get(self, key) -> bytes | None:
+        key = _encode(key)
+        value, expires_at = self.strings.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.strings[key]
+            return None
+        return value
+
+
+class LocalPipeline:
+    # Buffers commands and runs them back to back on `execute`. Blocking
+    # commands are not available in pipelines, as in Redis.
+
+    def __init__(self, client: LocalRedis):
+        self.client = client
+        self.command_stack: list[tuple[str, tuple, dict]] = []
+
+    def _command(name: str):
+        def queue_command(self, *args, **kwargs) -> "LocalPipeline":
+            self.command_stack.append((name, args, kwargs))
+            return self
+
+        return queue_command
+
+    lpush = _command("lpush")
+    llen = _command("llen")
+    lindex = _command("lindex")
+    delete = _command("delete")
+    zadd = _command("zadd")
+    zremrangebyscore = _command("zremrangebyscore")
+    zrangebyscore = _command("zrangebyscore")
+    zrem = _command("zrem")
+    set = _command("set")
+    get = _command("get")
+    del _command
+
+    async def execute(self) -> list:
+        commands, self.command_stack = self.command_stack, []
+        replies = [
+            getattr(self.client, f"_{name}")(*args, **kwargs)
+            for name, args, kwargs in commands
+        ]
+        if any(name == "lpush" for name, _, _ in commands):
+            await self.client._notify()
+        return replies
@@ -0,0 +1,64 @@
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from prometheus_client import start_http_server, Counter, Gauge, Histogram
+
+from common.utils import get_logger
+
+load_dotenv()
+
+
+# Buckets cover everything from cached results to slow model calls and backlogs.
+STAGE_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+)
+
+STAGE_PROCESSING_SECONDS = Histogram(
+    "stage_processing_seconds",
+    "Time a pipeline stage spends processing a claim in seconds.",
+    ["stage"],
+    buckets=STAGE_LATENCY_BUCKETS,
+)
+
+STAGE_QUEUE_WAIT_SECONDS = Histogram(
+    "stage_queue_wait_seconds",
+    "Time a claim waited in the stage queue before being dequeued in seconds.",
+    ["stage", "lane"],
+    buckets=STAGE_LATENCY_BUCKETS,
+)
+
+STAGE_CLAIMS_TOTAL = Counter(
+    "stage_claims_total",
+    "Claims handled by a pipeline stage, by outcome (success, retry, dlq, dropped).",
+    ["stage", "outcome"],
+)
+
+STAGE_IN_FLIGHT = Gauge(
+    "stage_in_flight", "Claims currently being processed by a stage.", ["stage"]
+)
+
+
+@lru_cache
+def start_metrics_server():
+    # Safe to call from every worker in a process; the server starts only once.
+    prometheus_server_port = os.getenv("PROMETHEUS_SERVER_PORT")
+    if not prometheus_server_port:
+        return
+    start_http_server(int(prometheus_server_port))
+    get_logger().info(f"Prometheus metrics started on port {prometheus_server_port}")
@@ -0,0 +1,52 @@
+import asyncio
+import contextlib
+import os
+import random
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# With MOCK_SEED set, the simulated latencies and outcomes of the mock stages
+# depend only on the seed, the stage and the claim document, so a load test
+# replays identically regardless of how claims interleave across workers.
+MOCK_SEED = os.getenv("MOCK_SEED")
+# Multiplies every simulated stage latency, e.g. 0.01 for fast load tests.
+MOCK_LATENCY_SCALE = float(os.getenv("MOCK_LATENCY_SCALE", 1))
+# Model calls a mocked model serves at the same time per stage, like the
+# replicas of a model server. 0 serves every call at once.
+MOCK_MODEL_CONCURRENCY = int(os.getenv("MOCK_MODEL_CONCURRENCY", 0))
+
+_model_slots: dict[str, asyncio.Semaphore] = {}
+
+
+def mock_random(stage: str, key: str) -> random.Random:
+    # `key` identifies the claim, preferably by content hash, which unlike the
+    # claim id is the same across runs for the same document.
+    if MOCK_SEED is None:
+        return random.Random()
+    return random.Random(f"{MOCK_SEED}:{stage}:{key}")
+
+
+async def mock_delay(rng: random.Random, low: int = 1, high: int = 5):
+    await asyncio.sleep(rng.randint(low, high) * MOCK_LATENCY_SCALE)
+
+
+async def mock_batch_delay(
+    stage: str, rngs: list[random.Random], low: int = 1, high: int = 5
+):
+    # A batch is one model call, which takes as long as its slowest claim.
+    # Every claim draws its latency as in `mock_delay`, so its later draws and
+    # thereby its outcome are the same whether it is batched or not.
+    delays = [rng.randint(low, high) for rng in rngs]
+    async with _model_slot(stage):
+        await asyncio.sleep(max(delays, default=0) * MOCK_LATENCY_SCALE)
+
+
+def _model_slot(stage: str):
+    if MOCK_MODEL_CONCURRENCY <= 0:
+        return contextlib.nullcontext()
+    if stage not in _model_slots:
+        _model_slots[stage] = asyncio.Semaphore(MOCK_MODEL_CONCURRENCY)
+    return _model_slots[stage]
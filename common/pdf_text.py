@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+from typing import Iterable
+
+import pymupdf
+
+
+# `count_pages` and `extract_pages` run inside worker processes of a
+# ProcessPoolExecutor, so they live in an importable module and only take
+# picklable arguments.
+
+
+def count_pages(document_path: str) -> int:
+    with pymupdf.open(document_path) as document:
+        return document.page_count
+
+
+def extract_pages(document_path: str, start: int, stop: int) -> list[str]:
+    with pymupdf.open(document_path) as document:
+        return [document[i].get_text() for i in range(start, stop)]
+
+
+def page_index_path(text_path: Path) -> Path:
+    return text_path.with_suffix(".pages.json")
+
+
+def write_page_index(text_path: Path, offsets: list[tuple[int, int]]):
+    with open(page_index_path(text_path), "w") as f:
+        json.dump(
+            {
+                "page_count": len(offsets),
+                "pages": [
+                    {"page": page, "offset": offset, "length": length}
+                    for page, (offset, length) in enumerate(offsets)
+                ],
+            },
+            f,
+        )
+
+
+def read_pages(text_path: Path, pages: Iterable[int]) -> list[str]:
+    # Reads only the requested pages of an OCR text file using its page index.
+    # Pages beyond the last page of the document are skipped.
+    with open(page_index_path(text_path), "r") as f:
+        index = json.load(f)["pages"]
+
+    texts = []
+    with open(text_path, "rb") as f:
+        for page in pages:
+            if page >= len(index):
+                continue
+            f.seek(index[page]["offset"])
+            texts.append(f.read(index[page]["length"]).decode("utf-8"))
+    return texts
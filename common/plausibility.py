@@ -0,0 +1,349 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+
+import numpy as np
+from dotenv import load_dotenv
+from prometheus_client import Counter
+
+from common.cost_positions import CostPositionTable, TOTAL_LABELS
+
+load_dotenv()
+
+
+# The plausibility rules are declared as data: a JSON file with part categories
+# (keywords matched against the position description) and a list of rules, each
+# with a unique name, a type from RULE_TYPES and its parameters. Without
+# PLAUSIBILITY_RULES_PATH the defaults below apply, which fit the invoices of
+# generate_dummy_invoice.py.
+#
+# The rules comparing positions with printed totals only apply where both were
+# found; `no_cost_positions` and `missing_totals` fire for invoices where the
+# table or the totals were not, so those never pass unchecked.
+#
+# Rules are evaluated over a batch of claims at once: the cost positions of all
+# claims are concatenated into one set of columns and every rule is a handful
+# of array operations over those, reduced per claim. Nothing loops over rows or
+# claims in Python.
+
+PLAUSIBILITY_RULES_PATH = os.getenv("PLAUSIBILITY_RULES_PATH")
+
+# fmt: off
+DEFAULT_PLAUSIBILITY_RULES = {
+    "categories": {
+        "labor": ["labor", "labour"],
+        "wheel": ["wheel"],
+        "derailleur": ["derailleur"],
+        "drivetrain": ["chain", "cassette"],
+        "brake": ["brake"],
+        "handlebar": ["handlebar"],
+        "saddle": ["saddle"],
+        "tube": ["tube", "tyre", "tire"],
+    },
+    "rules": [
+        {"name": "no_cost_positions", "type": "no_cost_positions"},
+        {"name": "missing_totals", "type": "missing_totals"},
+        {"name": "line_total", "type": "line_total"},
+        {"name": "subtotal", "type": "subtotal"},
+        {"name": "gross_total", "type": "gross_total"},
+        {"name": "vat_rate", "type": "vat_rate", "rate": 0.19, "tolerance_cents": 1},
+        {"name": "quantity", "type": "quantity_cap", "max": 10},
+        {"name": "labor_hours", "type": "quantity_cap", "category": "labor", "max": 8},
+        {"name": "labor_rate", "type": "price_band", "category": "labor", "min_cents": 1500, "max_cents": 12000},
+        {"name": "wheel_price", "type": "price_band", "category": "wheel", "min_cents": 4000, "max_cents": 30000},
+        {"name": "derailleur_price", "type": "price_band", "category": "derailleur", "min_cents": 2000, "max_cents": 25000},
+        {"name": "drivetrain_price", "type": "price_band", "category": "drivetrain", "min_cents": 2000, "max_cents": 20000},
+        {"name": "brake_price", "type": "price_band", "category": "brake", "min_cents": 1000, "max_cents": 12000},
+        {"name": "handlebar_price", "type": "price_band", "category": "handlebar", "min_cents": 1500, "max_cents": 15000},
+        {"name": "saddle_price", "type": "price_band", "category": "saddle", "min_cents": 1000, "max_cents": 15000},
+        {"name": "tube_price", "type": "price_band", "category": "tube", "min_cents": 300, "max_cents": 6000},
+    ],
+}
+# fmt: on
+
+PLAUSIBILITY_RULES_FIRED_TOTAL = Counter(
+    "plausibility_rules_fired_total",
+    "Claims for which a plausibility rule fired, by rule.",
+    ["rule"],
+)
+
+
+@dataclass
+class CostPositionBatch:
+    # The cost positions of several claims, concatenated column by column.
+    # `starts` holds the first row and `rows` the number of rows of every
+    # claim. Printed totals are per claim, with `present` marking those found
+    # on the invoice.
+    description: np.ndarray
+    quantity: np.ndarray
+    unit_price_cents: np.ndarray
+    total_cents: np.ndarray
+    starts: np.ndarray
+    rows: np.ndarray
+    totals: dict[str, np.ndarray]
+    present: dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def from_tables(cls, tables: list[CostPositionTable]) -> "CostPositionBatch":
+        rows = np.array([len(table) for table in tables], dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(rows)[:-1])).astype(np.int64)
+        totals, present = {}, {}
+        for key in TOTAL_LABELS:
+            values = [table.totals.get(key) for table in tables]
+            present[key] = np.array([value is not None for value in values], bool)
+            totals[key] = np.array([value or 0 for value in values], np.int64)
+
+        def column(name: str, dtype) -> np.ndarray:
+            if not tables:
+                return np.empty(0, dtype)
+            return np.concatenate([getattr(table, name) for table in tables]).astype(
+                dtype, copy=False
+            )
+
+        return cls(
+            description=column("description", np.str_),
+            quantity=column("quantity", np.int64),
+            unit_price_cents=column("unit_price_cents", np.int64),
+            total_cents=column("total_cents", np.int64),
+            starts=starts,
+            rows=rows,
+            totals=totals,
+            present=present,
+        )
+
+    def sum_per_claim(self, values: np.ndarray) -> np.ndarray:
+        # Exact integer sums of a row column per claim, 0 for claims without rows.
+        cumulative = np.concatenate(([0], np.cumsum(values, dtype=np.int64)))
+        return cumulative[self.starts + self.rows] - cumulative[self.starts]
+
+    def any_per_claim(self, mask: np.ndarray) -> np.ndarray:
+        return self.sum_per_claim(mask) > 0
+
+
+def categorize(
+    descriptions: np.ndarray, categories: dict[str, list[str]]
+) -> dict[str, np.ndarray]:
+    # The positions of every category: those with one of its keywords in the
+    # description, unless an earlier category already matched.
+    lowered = np.strings.lower(descriptions)
+    unmatched = np.ones(len(descriptions), dtype=bool)
+    masks = {}
+    for name, keywords in categories.items():
+        matches = np.zeros(len(descriptions), dtype=bool)
+        for keyword in keywords:
+            matches |= np.strings.find(lowered, keyword.lower()) >= 0
+        masks[name] = matches & unmatched
+        unmatched &= ~matches
+    return masks
+
+
+@dataclass
+class Rule(ABC):
+    name: str
+
+    @abstractmethod
+    def fired(
+        self, batch: CostPositionBatch, categories: dict[str, np.ndarray]
+    ) -> np.ndarray:
+        pass
+
+
+@dataclass
+class NoCostPositionsRule(Rule):
+    # No cost position was found on the invoice, so none of the other rules
+    # has anything to check.
+    def fired(self, batch, categories):
+        return batch.rows == 0
+
+
+@dataclass
+class MissingTotalsRule(Rule):
+    # One of the printed totals was not found, so the positions cannot be
+    # checked against it.
+    totals: list[str] = field(default_factory=lambda: list(TOTAL_LABELS))
+
+    def fired(self, batch, categories):
+        missing = np.zeros(len(batch), dtype=bool)
+        for key in self.totals:
+            missing |= ~batch.present[key]
+        return missing
+
+
+@dataclass
+class LineTotalRule(Rule):
+    # A position's total is not its quantity times its unit price.
+    def fired(self, batch, categories):
+        return batch.any_per_claim(
+            batch.quantity * batch.unit_price_cents != batch.total_cents
+        )
+
+
+@dataclass
+class SubtotalRule(Rule):
+    # The printed subtotal is not the sum of the position totals.
+    def fired(self, batch, categories):
+        subtotal = batch.sum_per_claim(batch.total_cents)
+        return (
+            (batch.rows > 0)
+            & batch.present["subtotal_cents"]
+            & (batch.totals["subtotal_cents"] != subtotal)
+        )
+
+
+@dataclass
+class GrossTotalRule(Rule):
+    # The printed gross total is not the sum of the positions plus the VAT.
+    def fired(self, batch, categories):
+        subtotal = batch.sum_per_claim(batch.total_cents)
+        return (
+            (batch.rows > 0)
+            & batch.present["vat_cents"]
+            & batch.present["total_cents"]
+            & (batch.totals["total_cents"] != subtotal + batch.totals["vat_cents"])
+        )
+
+
+@dataclass
+class VatRateRule(Rule):
+    # The printed VAT is not `rate` of the sum of the positions.
+    rate: float = 0.19
+    tolerance_cents: int = 1
+
+    def fired(self, batch, categories):
+        subtotal = batch.sum_per_claim(batch.total_cents)
+        expected = np.rint(subtotal * self.rate).astype(np.int64)
+        return (
+            (batch.rows > 0)
+            & batch.present["vat_cents"]
+            & (np.abs(batch.totals["vat_cents"] - expected) > self.tolerance_cents)
+        )
+
+
+@dataclass
+class CategoryRule(Rule):
+    # None applies the rule to every position.
+    category: str | None = None
+
+    def positions(
+        self, batch: CostPositionBatch, categories: dict[str, np.ndarray]
+    ) -> np.ndarray:
+        if self.category is None:
+            return np.ones(len(batch.quantity), dtype=bool)
+        return categories[self.category]
+
+
+@dataclass
+class PriceBandRule(CategoryRule):
+    # A position's unit price lies outside the band of its category.
+    min_cents: int = 0
+    max_cents: int | None = None
+
+    def fired(self, batch, categories):
+        unit_price = batch.unit_price_cents
+        outside = unit_price < self.min_cents
+        if self.max_cents is not None:
+            outside |= unit_price > self.max_cents
+        return batch.any_per_claim(self.positions(batch, categories) & outside)
+
+
+@dataclass
+class QuantityCapRule(CategoryRule):
+    # The positions of a category add up to more than `max` units, e.g. more
+    # labour hours than a repair of the claimed parts takes.
+    max: int = 0
+
+    def fired(self, batch, categories):
+        quantity = np.where(self.positions(batch, categories), batch.quantity, 0)
+        return batch.sum_per_claim(quantity) > self.max
+
+
+RULE_TYPES: dict[str, type[Rule]] = {
+    "no_cost_positions": NoCostPositionsRule,
+    "missing_totals": MissingTotalsRule,
+    "line_total": LineTotalRule,
+    "subtotal": SubtotalRule,
+    "gross_total": GrossTotalRule,
+    "vat_rate": VatRateRule,
+    "price_band": PriceBandRule,
+    "quantity_cap": QuantityCapRule,
+}
+
+
+@dataclass
+class PlausibilityResult:
+    rule_names: list[str]
+    # One row per claim, one column per rule.
+    fired: np.ndarray
+
+    @property
+    def passed(self) -> np.ndarray:
+        return ~self.fired.any(axis=1)
+
+    def fired_rules(self, claim: int) -> list[str]:
+        return [self.rule_names[i] for i in np.flatnonzero(self.fired[claim])]
+
+
+@dataclass
+class PlausibilityRules:
+    categories: dict[str, list[str]]
+    rules: list[Rule] = field(default_factory=list)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "PlausibilityRules":
+        categories = config.get("categories", {})
+        rules = []
+        for rule_config in config["rules"]:
+            settings = dict(rule_config)
+            rule_type = settings.pop("type")
+            if rule_type not in RULE_TYPES:
+                raise ValueError(f"Unknown plausibility rule type {rule_type!r}.")
+            rule = RULE_TYPES[rule_type](**settings)
+            if isinstance(rule, CategoryRule) and rule.category not in (
+                None,
+                *categories,
+            ):
+                raise ValueError(
+                    f"Plausibility rule {rule.name!r} refers to the unknown "
+                    f"category {rule.category!r}."
+                )
+            if isinstance(rule, MissingTotalsRule) and set(rule.totals) - set(
+                TOTAL_LABELS
+            ):
+                raise ValueError(
+                    f"Plausibility rule {rule.name!r} refers to unknown totals "
+                    f"{sorted(set(rule.totals) - set(TOTAL_LABELS))}."
+                )
+            rules.append(rule)
+
+        names = [rule.name for rule in rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Plausibility rule names must be unique.")
+        return cls(categories, rules)
+
+    def evaluate(self, batch: CostPositionBatch) -> PlausibilityResult:
+        categories = categorize(batch.description, self.categories)
+        fired = np.zeros((len(batch), len(self.rules)), dtype=bool)
+        for index, rule in enumerate(self.rules):
+            fired[:, index] = rule.fired(batch, categories)
+        return PlausibilityResult([rule.name for rule in self.rules], fired)
+
+    def check(self, tables: list[CostPositionTable]) -> list[list[str]]:
+        # The names of the rules fired per claim, an empty list if it passed.
+        result = self.evaluate(CostPositionBatch.from_tables(tables))
+        for name, count in zip(result.rule_names, result.fired.sum(axis=0)):
+            if count:
+                PLAUSIBILITY_RULES_FIRED_TOTAL.labels(rule=name).inc(int(count))
+        return [result.fired_rules(claim) for claim in range(len(tables))]
+
+
+def load_plausibility_rules(
+    path: str | None = PLAUSIBILITY_RULES_PATH,
+) -> PlausibilityRules:
+    if not path:
+        return PlausibilityRules.from_config(DEFAULT_PLAUSIBILITY_RULES)
+    with open(path, "r") as f:
+        return PlausibilityRules.from_config(json.load(f))
@@ -0,0 +1,393 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter as Tally
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge
+
+from common.utils import get_logger
+
+load_dotenv()
+
+
+# An in-memory index of the insurance policies, loaded once per worker from a
+# JSON lines file with one policy per line:
+#
+#   {"policy_number": "BIKE-3421987", "frame_number": "CUBE9876543",
+#    "valid_from": "2023-04-01", "valid_to": "2027-03-31",
+#    "coverage": {"partial_damage": true}}
+#
+# Policy and frame numbers are looked up by exact hash first. OCR-noisy numbers
+# fall back to a character n-gram index, which narrows the policies down to a
+# capped number of candidates before they are ranked by edit distance. The
+# file is reloaded when its modification time changes.
+
+POLICY_INDEX_PATH = os.getenv("POLICY_INDEX_PATH")
+POLICY_INDEX_RELOAD_INTERVAL_S = float(os.getenv("POLICY_INDEX_RELOAD_INTERVAL_S", 5))
+# Candidates from the n-gram index that are ranked by edit distance.
+POLICY_FUZZY_MAX_CANDIDATES = int(os.getenv("POLICY_FUZZY_MAX_CANDIDATES", 20))
+# Edit distance up to which a fuzzy match is accepted.
+POLICY_FUZZY_MAX_DISTANCE = int(os.getenv("POLICY_FUZZY_MAX_DISTANCE", 2))
+
+NGRAM_SIZE = 4
+# N-grams found in more than this share of the numbers, like those of a common
+# prefix, say little about which number is meant and cost the most to count.
+# They are skipped while other n-grams match, unless they are this rare anyway.
+NGRAM_MAX_POSTINGS_SHARE = 0.02
+NGRAM_MIN_POSTINGS = 100
+
+POLICY_LOOKUPS_TOTAL = Counter(
+    "policy_lookups_total",
+    "Policy lookups, by how the policy was found (exact, fuzzy, frame, none).",
+    ["match"],
+)
+
+POLICY_INDEX_SIZE = Gauge(
+    "policy_index_size", "Number of policies in the loaded policy index."
+)
+
+# Characters OCR commonly confuses, folded onto one of them, so that both the
+# index and the query compare equal despite the confusion.
+OCR_CONFUSIONS = str.maketrans(
+    {"O": "0", "Q": "0", "I": "1", "L": "1", "S": "5", "Z": "2"}
+)
+
+
+def normalize_number(number: str) -> str:
+    # Policy and frame numbers compare case-insensitively, without separators
+    # or whitespace.
+    return re.sub(r"[^0-9A-Z]", "", number.upper())
+
+
+def fold_number(number: str) -> str:
+    return normalize_number(number).translate(OCR_CONFUSIONS)
+
+
+def parse_date(value: str | None) -> date | None:
+    # ISO dates as in the policy file and dd.mm.yyyy as printed on invoices.
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    # Levenshtein distance, capped at max_distance + 1, with the bit-parallel
+    # algorithm of Myers: one column of the distance table is kept as bit
+    # vectors over the characters of `a`, so each character of `b` costs a
+    # few integer operations instead of a row of the table.
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance or not a or not b:
+        return min(max(len(a), len(b)), max_distance + 1)
+
+    peq: dict[str, int] = {}
+    for i, char in enumerate(a):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    mask = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    pv, mv, score = mask, 0, len(a)
+    for char in b:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    return min(score, max_distance + 1)
+
+
+def ngrams(key: str) -> set[str]:
+    # Padded, so the start and end of short numbers weigh in as well.
+    padded = f"^{key}$"
+    return {padded[i : i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+
+@dataclass
+class Policy:
+    policy_number: str
+    frame_number: str | None = None
+    valid_from: date | None = None
+    valid_to: date | None = None
+    coverage: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, record: dict) -> "Policy":
+        return cls(
+            policy_number=record["policy_number"],
+            frame_number=record.get("frame_number"),
+            valid_from=parse_date(record.get("valid_from")),
+            valid_to=parse_date(record.get("valid_to")),
+            coverage=record.get("coverage", {}),
+        )
+
+
+class NGramIndex:
+    # Maps the n-grams of folded numbers to the numbers containing them.
+
+    def __init__(self):
+        self.postings: dict[str, list[str]] = {}
+        self.size = 0
+
+    def add(self, key: str):
+        self.size += 1
+        for gram in ngrams(key):
+            self.postings.setdefault(gram, []).append(key)
+
+    def candidates(self, key: str, limit: int) -> list[tuple[str, int]]:
+        # The `limit` keys sharing the most n-grams with `key`, with an upper
+        # bound of the n-grams they share, most shared first.
+        grams = ngrams(key)
+        postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        max_postings = max(NGRAM_MIN_POSTINGS, self.size * NGRAM_MAX_POSTINGS_SHARE)
+        selective = [keys for keys in postings if len(keys) <= max_postings]
+        if not selective:
+            selective = postings
+        shared = Tally()
+        for keys in selective:
+            shared.update(keys)
+        # Skipped n-grams are assumed to be shared.
+        skipped = len(grams) - len(selective)
+        return [
+            (candidate, count + skipped)
+            for candidate, count in shared.most_common(limit)
+        ]
+
+
+@dataclass
+class PolicyMatch:
+    policy: Policy | None
+    # exact, fuzzy or frame, none if no policy was found.
+    match: str = "none"
+    distance: int = 0
+
+
+@dataclass
+class CoverageDecision:
+    covered: bool
+    reason: str
+    policy_number: str | None = None
+    match: str = "none"
+
+
+class PolicyIndex:
+    def __init__(
+        self,
+        policies: list[Policy],
+        max_candidates: int = POLICY_FUZZY_MAX_CANDIDATES,
+        max_distance: int = POLICY_FUZZY_MAX_DISTANCE,
+    ):
+        self.max_candidates = max_candidates
+        self.max_distance = max_distance
+        self.by_number: dict[str, Policy] = {}
+        self.by_folded: dict[str, list[Policy]] = {}
+        self.by_frame: dict[str, list[Policy]] = {}
+        self.ngrams = NGramIndex()
+        for policy in policies:
+            self.by_number[normalize_number(policy.policy_number)] = policy
+            folded = fold_number(policy.policy_number)
+            if folded not in self.by_folded:
+                self.ngrams.add(folded)
+            self.by_folded.setdefault(folded, []).append(policy)
+            if policy.frame_number:
+                self.by_frame.setdefault(fold_number(policy.frame_number), []).append(
+                    policy
+                )
+
+    def __len__(self) -> int:
+        return len(self.by_number)
+
+    @classmethod
+    def from_file(cls, path: Path, **kwargs) -> "PolicyIndex":
+        with open(path, "r") as f:
+            policies = [
+                Policy.from_dict(json.loads(line)) for line in f if line.strip()
+            ]
+        return cls(policies, **kwargs)
+
+    def _rerank(
+        self, policies: list[Policy], frame_number: str | None
+    ) -> Policy | None:
+        # Of several policies equally close to the number, the one insuring
+        # the claimed frame, otherwise none, as the match is ambiguous.
+        if len(policies) == 1:
+            return policies[0]
+        if frame_number:
+            frame = fold_number(frame_number)
+            matching = [
+                policy
+                for policy in policies
+                if policy.frame_number and fold_number(policy.frame_number) == frame
+            ]
+            if len(matching) == 1:
+                return matching[0]
+        return None
+
+    def _fuzzy(self, policy_number: str, frame_number: str | None) -> PolicyMatch:
+        folded = fold_number(policy_number)
+        if folded in self.by_folded:
+            policy = self._rerank(self.by_folded[folded], frame_number)
+            if policy is not None:
+                return PolicyMatch(policy, "fuzzy", 0)
+
+        # Edit distances are only computed for the capped candidates, bounded
+        # by the closest match so far.
+        best_distance, best = self.max_distance + 1, []
+        grams = len(ngrams(folded))
+        for candidate, shared in self.ngrams.candidates(folded, self.max_candidates):
+            bound = min(best_distance, self.max_distance)
+            # Every edit changes at most NGRAM_SIZE n-grams, so the remaining
+            # candidates, sharing fewer n-grams, are all further away.
+            if shared < grams - NGRAM_SIZE * bound:
+                break
+            distance = edit_distance(folded, candidate, bound)
+            if distance < best_distance:
+                best_distance, best = distance, list(self.by_folded[candidate])
+            elif distance == best_distance:
+                best.extend(self.by_folded[candidate])
+        if best_distance <= self.max_distance:
+            policy = self._rerank(best, frame_number)
+            if policy is not None:
+                return PolicyMatch(policy, "fuzzy", best_distance)
+        return PolicyMatch(None)
+
+    def lookup(
+        self, policy_number: str | None, frame_number: str | None = None
+    ) -> PolicyMatch:
+        if policy_number:
+            policy = self.by_number.get(normalize_number(policy_number))
+            if policy is not None:
+                result = PolicyMatch(policy, "exact")
+            else:
+                result = self._fuzzy(policy_number, frame_number)
+        else:
+            result = PolicyMatch(None)
+
+        # Without a readable policy number, the frame number identifies the
+        # policy if exactly one policy insures that frame.
+        if result.policy is None and frame_number:
+            policies = self.by_frame.get(fold_number(frame_number), [])
+            if len(policies) == 1:
+                result = PolicyMatch(policies[0], "frame")
+
+        POLICY_LOOKUPS_TOTAL.labels(match=result.match).inc()
+        return result
+
+    def check_coverage(
+        self,
+        policy_number: str | None,
+        frame_number: str | None = None,
+        incident_date: date | None = None,
+        coverage: str = "partial_damage",
+    ) -> CoverageDecision:
+        result = self.lookup(policy_number, frame_number)
+        policy = result.policy
+        if policy is None:
+            return CoverageDecision(False, "unknown_policy")
+
+        def decision(covered: bool, reason: str) -> CoverageDecision:
+            return CoverageDecision(covered, reason, policy.policy_number, result.match)
+
+        if (
+            frame_number
+            and policy.frame_number
+            and edit_distance(
+                fold_number(frame_number),
+                fold_number(policy.frame_number),
+                self.max_distance,
+            )
+            > self.max_distance
+        ):
+            return decision(False, "frame_mismatch")
+        if incident_date is None:
+            return decision(False, "missing_incident_date")
+        if (policy.valid_from and incident_date < policy.valid_from) or (
+            policy.valid_to and incident_date > policy.valid_to
+        ):
+            return decision(False, "outside_coverage_period")
+        if not policy.coverage.get(coverage, False):
+            return decision(False, "not_covered")
+        return decision(True, "covered")
+
+
+class ReloadingPolicyIndex:
+    # Keeps a PolicyIndex in sync with its file. The modification time is
+    # checked at most every `interval` seconds. A changed file is loaded in a
+    # background thread while lookups keep using the previous index, which also
+    # stays in place if the file fails to load.
+
+    def __init__(
+        self, path: str | Path, interval: float = POLICY_INDEX_RELOAD_INTERVAL_S
+    ):
+        self.path = Path(path)
+        self.interval = interval
+        self.index: PolicyIndex | None = None
+        self._mtime: float | None = None
+        self._checked_at = time.monotonic()
+        self._loading = False
+        self.reload()
+
+    def _changed_mtime(self) -> float | None:
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError as e:
+            get_logger().warning(f"Policy index {self.path} is not available: {e!r}")
+            return None
+        return mtime if mtime != self._mtime else None
+
+    def reload(self):
+        mtime = self._changed_mtime()
+        if mtime is None:
+            return
+        # Remembered before loading, so a broken file is not retried until
+        # it changes again.
+        self._mtime = mtime
+        try:
+            index = PolicyIndex.from_file(self.path)
+        except (OSError, ValueError, KeyError) as e:
+            get_logger().warning(f"Loading the policy index {self.path} failed: {e!r}")
+            return
+        self.index = index
+        POLICY_INDEX_SIZE.set(len(index))
+        get_logger().info(f"Loaded {len(index)} policies from {self.path}.")
+
+    def _reload_in_background(self):
+        try:
+            self.reload()
+        finally:
+            self._loading = False
+
+    def get(self) -> PolicyIndex | None:
+        now = time.monotonic()
+        if now - self._checked_at >= self.interval and not self._loading:
+            self._checked_at = now
+            if self._changed_mtime() is not None:
+                self._loading = True
+                threading.Thread(target=self._reload_in_background, daemon=True).start()
+        return self.index
+
+
+def load_policy_index(
+    path: str | None = POLICY_INDEX_PATH,
+) -> ReloadingPolicyIndex | None:
+    return ReloadingPolicyIndex(path) if path else None
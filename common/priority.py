@@ -0,0 +1,106 @@
+import os
+
+from dotenv import load_dotenv
+
+from common.queues import Message, QueueBackend
+
+load_dotenv()
+
+
+def _parse_lanes(spec: str) -> dict[str, int]:
+    lanes = {}
+    for item in spec.split(","):
+        lane, weight = item.strip().split(":")
+        lanes[lane.strip()] = int(weight)
+    return lanes
+
+
+# Lanes from highest to lowest priority with their scheduling weights. With the
+# defaults, a worker busy on all lanes serves six expedited, three standard
+# and one bulk claim in every ten.
+PRIORITY_LANES = _parse_lanes(
+    os.getenv("PRIORITY_LANES", "expedited:6,standard:3,bulk:1")
+)
+DEFAULT_LANE = os.getenv("DEFAULT_LANE", "standard")
+
+# Comma separated sender addresses or @domains routed to a lane at ingestion.
+EXPEDITED_SENDERS = os.getenv("EXPEDITED_SENDERS", "")
+BULK_SENDERS = os.getenv("BULK_SENDERS", "")
+
+
+def lane_queue(queue: str, lane: str | None) -> str:
+    # The default lane keeps the plain queue name, so claims and tools that
+    # know nothing about lanes keep working against it.
+    if lane is None or lane == DEFAULT_LANE or lane not in PRIORITY_LANES:
+        return queue
+    return f"{queue}:{lane}"
+
+
+def lane_queues(queue: str) -> list[str]:
+    return [lane_queue(queue, lane) for lane in PRIORITY_LANES]
+
+
+def _matches(sender: str, patterns: str) -> bool:
+    sender = sender.strip().lower()
+    for pattern in filter(None, (p.strip().lower() for p in patterns.split(","))):
+        if sender == pattern or (pattern.startswith("@") and sender.endswith(pattern)):
+            return True
+    return False
+
+
+def choose_lane(sender: str, priority: str | None = None) -> str:
+    # An explicit priority on the submission wins over the sender rules.
+    if priority in PRIORITY_LANES:
+        return priority
+    if _matches(sender, EXPEDITED_SENDERS) and "expedited" in PRIORITY_LANES:
+        return "expedited"
+    if _matches(sender, BULK_SENDERS) and "bulk" in PRIORITY_LANES:
+        return "bulk"
+    return DEFAULT_LANE
+
+
+class WeightedLanes:
+    # Deficit round robin over the lanes of one stage queue. Every pop hands
+    # each lane credit for its weighted share of the free slots; lanes are
+    # served up to their credit, and a lane that runs empty forfeits what is
+    # left, so an idle lane cannot save up credit for a later burst. Slots that
+    # remain free go to the highest lanes with claims waiting, which keeps the
+    # worker busy whenever any lane has work and lower lanes make progress
+    # whenever higher lanes are busy.
+
+    def __init__(self, queue: str, lanes: dict[str, int] = PRIORITY_LANES):
+        self.queue = queue
+        self.lanes = {lane_queue(queue, lane): weight for lane, weight in lanes.items()}
+        self.total_weight = sum(self.lanes.values())
+        self.deficit = {queue: 0.0 for queue in self.lanes}
+
+    async def pop_batch(
+        self, queue_backend: QueueBackend, count: int, timeout: float
+    ) -> list[Message]:
+        if len(self.lanes) == 1:
+            return await queue_backend.pop_batch(self.queue, count, timeout)
+
+        messages = []
+        for queue, weight in self.lanes.items():
+            self.deficit[queue] += count * weight / self.total_weight
+
+        for queue in sorted(self.lanes, key=self.deficit.get, reverse=True):
+            share = min(int(self.deficit[queue]), count - len(messages))
+            if share <= 0:
+                continue
+            popped = await queue_backend.try_pop(queue, share)
+            messages.extend(popped)
+            self.deficit[queue] -= len(popped)
+            if len(popped) < share:
+                self.deficit[queue] = 0
+
+        for queue in self.lanes:
+            if len(messages) >= count:
+                break
+            messages.extend(await queue_backend.try_pop(queue, count - len(messages)))
+
+        if messages:
+            return messages
+
+        # All lanes are empty; block until the first claim arrives on any.
+        return await queue_backend.wait_any(list(self.lanes), count, timeout)
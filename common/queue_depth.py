@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+from prometheus_client import Gauge
+
+from common.priority import lane_queues
+from common.queues import QueueBackend
+from common.utils import get_logger, Queues
+
+load_dotenv()
+
+
+QUEUE_DEPTH_SAMPLE_INTERVAL_S = float(os.getenv("QUEUE_DEPTH_SAMPLE_INTERVAL_S", 2))
+
+QUEUE_DEPTH = Gauge(
+    "queue_depth", "Number of claims waiting in a pipeline queue.", ["queue"]
+)
+
+
+# Queues shared by all lanes besides the dead-letter queues.
+SHARED_QUEUES = {
+    Queues.CLAIM_SPILL_QUEUE,
+    Queues.CLAIM_ACCEPTANCE_QUEUE,
+    Queues.CLAIM_REJECTION_QUEUE,
+}
+
+
+def is_shared_queue(queue: Queues) -> bool:
+    return queue in SHARED_QUEUES or queue.value.endswith("-dlq")
+
+
+def stage_queue_lanes() -> dict[str, list[str]]:
+    # Every stage queue with the priority lanes it is split into.
+    return {
+        queue.value: lane_queues(queue.value)
+        for queue in Queues
+        if not is_shared_queue(queue)
+    }
+
+
+def pipeline_queues() -> list[str]:
+    # Stage queues are split into priority lanes; dead-letter, spill and final
+    # queues are shared by all lanes.
+    queues = []
+    for queue in Queues:
+        if is_shared_queue(queue):
+            queues.append(queue.value)
+        else:
+            queues.extend(lane_queues(queue.value))
+    return queues
+
+
+class QueueDepthSampler:
+    # Periodically reads the depth of every queue in one pipelined round trip.
+    # The latest sample is kept in `depths` for callers that need it in process.
+
+    def __init__(
+        self,
+        queue_backend: QueueBackend,
+        queues: list[str] | None = None,
+        interval: float = QUEUE_DEPTH_SAMPLE_INTERVAL_S,
+    ):
+        self.queue_backend = queue_backend
+        self.queues = queues or pipeline_queues()
+        self.interval = interval
+        self.depths: dict[str, int] = {}
+        self.sampled_at: float | None = None
+
+    async def sample(self) -> dict[str, int]:
+        self.depths = await self.queue_backend.depths(self.queues)
+        self.sampled_at = time.monotonic()
+        for queue, depth in self.depths.items():
+            QUEUE_DEPTH.labels(queue=queue).set(depth)
+        return self.depths
+
+    async def run(self):
+        while True:
+            try:
+                await self.sample()
+            except Exception as e:
+                get_logger().warning(f"Sampling queue depths failed: {e!r}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,671 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import socket
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from functools import lru_cache
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+from redis.exceptions import ResponseError
+
+from common.local_redis import COMPARE_AND_DELETE, LocalRedis
+
+load_dotenv()
+
+
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "list")
+QUEUE_BATCH_SIZE = int(os.getenv("QUEUE_BATCH_SIZE", 16))
+QUEUE_BATCH_LINGER_MS = float(os.getenv("QUEUE_BATCH_LINGER_MS", 5))
+
+STREAM_CONSUMER_GROUP = os.getenv("STREAM_CONSUMER_GROUP", "claims-handler")
+STREAM_CLAIM_MIN_IDLE_MS = int(os.getenv("STREAM_CLAIM_MIN_IDLE_MS", 60000))
+STREAM_CLAIM_INTERVAL_S = float(os.getenv("STREAM_CLAIM_INTERVAL_S", 30))
+
+RETRY_SET_KEY = os.getenv("RETRY_SET_KEY", "claim-retry-set")
+RETRY_LOCK_TTL_MS = int(os.getenv("RETRY_LOCK_TTL_MS", 10000))
+
+
+@lru_cache
+def get_redis():
+    return redis.Redis(
+        host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", 6379))
+    )
+
+
+@lru_cache
+def get_local_redis() -> LocalRedis:
+    # Shared by every queue and store of the process, like a Redis server.
+    return LocalRedis()
+
+
+@dataclass
+class Message:
+    queue: str
+    data: bytes
+    # Backend specific handle used to acknowledge the message, e.g. a stream entry id.
+    receipt: str | None = None
+
+
+class QueueBackend(ABC):
+    # Seconds between refreshes of the messages a consumer is processing, for
+    # backends that hand unacknowledged messages to other consumers after a
+    # while; None if messages never go back.
+    refresh_interval: float | None = None
+
+    def __init__(self, batch_size: int, linger_ms: float):
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000
+
+    async def pop_batch(
+        self, queue: str, count: int | None = None, timeout: float = 10
+    ) -> list[Message]:
+        # One blocking read waits for the first messages and returns up to
+        # `count` of them in the same round trip. If the batch is not full, keep
+        # collecting for at most `linger` seconds before handing it out.
+        count = count or self.batch_size
+        messages = await self._read(queue, count, timeout)
+        if not messages:
+            return []
+
+        deadline = time.monotonic() + self.linger
+        while len(messages) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            more = await self._read(queue, count - len(messages), remaining)
+            if not more:
+                break
+            messages.extend(more)
+
+        return messages
+
+    @abstractmethod
+    async def _read(self, queue: str, count: int, timeout: float) -> list[Message]:
+        pass
+
+    @abstractmethod
+    async def try_pop(self, queue: str, count: int) -> list[Message]:
+        """Return up to `count` messages of `queue` without waiting."""
+        pass
+
+    @abstractmethod
+    async def wait_any(
+        self, queues: list[str], count: int, timeout: float
+    ) -> list[Message]:
+        """Wait up to `timeout` seconds for messages on any of `queues` and
+        return those of the first queue that has some."""
+        pass
+
+    @abstractmethod
+    async def push(self, queue: str, data: str) -> int:
+        """Enqueue `data` and return the depth of `queue` after the push."""
+        pass
+
+    @abstractmethod
+    async def route(self, message: Message, queue: str, data: str):
+        """Enqueue `data` on `queue` and acknowledge `message` in one step."""
+        pass
+
+    @abstractmethod
+    async def ack(self, message: Message):
+        pass
+
+    async def refresh(self, messages: list[Message]):
+        """Keep `messages` with this consumer while they are being processed."""
+        pass
+
+    async def close(self):
+        """Wait until every buffered command has been sent."""
+        pass
+
+    @abstractmethod
+    async def depths(self, queues: list[str]) -> dict[str, int]:
+        """Return the number of outstanding messages of each queue."""
+        pass
+
+    @abstractmethod
+    async def oldest_enqueued_at(self, queues: list[str]) -> dict[str, float | None]:
+        """Return the enqueue time of the oldest outstanding message of each
+        queue, or None for an empty queue."""
+        pass
+
+    @abstractmethod
+    async def schedule(self, message: Message, queue: str, data: str, due_at: float):
+        """Acknowledge `message` and park `data` until `due_at`, after which
+        `release_due` puts it on `queue`."""
+        pass
+
+    @abstractmethod
+    async def release_due(self, limit: int) -> int:
+        """Move up to `limit` parked messages that are due onto their queues
+        and return how many were moved."""
+        pass
+
+
+class RedisQueueBackend(QueueBackend):
+    # Pushes and acknowledgements issued while a flush is pending are coalesced
+    # into one pipeline. Callers resume only once their commands were executed.
+
+    transaction = False
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        batch_size: int = QUEUE_BATCH_SIZE,
+        linger_ms: float = QUEUE_BATCH_LINGER_MS,
+        retry_key: str = RETRY_SET_KEY,
+    ):
+        super().__init__(batch_size, linger_ms)
+        self.client = client
+        self.retry_key = retry_key
+        self._outbox: list[tuple[str | None, str | None, Message | None]] = []
+        self._futures: list[asyncio.Future] = []
+        self._flush_timer: asyncio.TimerHandle | None = None
+        # The event loop only keeps weak references to tasks.
+        self._sends: set[asyncio.Task] = set()
+
+    async def push(self, queue: str, data: str) -> int:
+        return await self._enqueue(queue, data, None)
+
+    async def route(self, message: Message, queue: str, data: str):
+        await self._enqueue(queue, data, message)
+
+    async def ack(self, message: Message):
+        await self._enqueue(None, None, message)
+
+    async def _enqueue(self, queue: str | None, data: str | None, message):
+        future = asyncio.get_running_loop().create_future()
+        self._outbox.append((queue, data, message))
+        self._futures.append(future)
+
+        if len(self._outbox) >= self.batch_size:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self.linger, self.flush
+            )
+
+        return await future
+
+    def flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        batch, self._outbox = self._outbox, []
+        futures, self._futures = self._futures, []
+        if batch:
+            task = asyncio.create_task(self._send(batch, futures))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def close(self):
+        self.flush()
+        if self._sends:
+            await asyncio.gather(*self._sends, return_exceptions=True)
+
+    async def _send(self, batch, futures: list[asyncio.Future]):
+        try:
+            pipe = self.client.pipeline(transaction=self.transaction)
+            depth_index = self._queue_commands(pipe, batch)
+            replies = await pipe.execute()
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (queue, _, _), future in zip(batch, futures):
+                if not future.done():
+                    future.set_result(
+                        replies[depth_index[queue]] if queue is not None else None
+                    )
+
+    async def schedule(self, message: Message, queue: str, data: str, due_at: float):
+        # Parked claims live in one sorted set scored by due time. The
+        # acknowledgement and the insert are sent in one pipeline, with the
+        # same transaction semantics as a route.
+        if isinstance(data, bytes):
+            data = data.decode()
+        pipe = self.client.pipeline(transaction=self.transaction)
+        self._queue_commands(pipe, [(None, None, message)])
+        pipe.zadd(self.retry_key, {json.dumps({"queue": queue, "data": data}): due_at})
+        await pipe.execute()
+
+    async def release_due(self, limit: int) -> int:
+        # Only the holder of a short lived lock releases claims, and it pushes
+        # them and removes them from the retry set in one MULTI/EXEC. A due claim
+        # is therefore released exactly once, however many workers poll.
+        lock_key = f"{self.retry_key}:lock"
+        token = uuid.uuid4().hex
+        if not await self.client.set(lock_key, token, nx=True, px=RETRY_LOCK_TTL_MS):
+            return 0
+
+        try:
+            members = await self.client.zrangebyscore(
+                self.retry_key, "-inf", time.time(), start=0, num=limit
+            )
+            if not members:
+                return 0
+
+            batch = []
+            for member in members:
+                entry = json.loads(member)
+                batch.append((entry["queue"], entry["data"], None))
+
+            pipe = self.client.pipeline(transaction=True)
+            self._queue_commands(pipe, batch)
+            pipe.zrem(self.retry_key, *members)
+            await pipe.execute()
+            return len(members)
+        finally:
+            # Compared and deleted in one step, so a lock that expired and was
+            # taken by another worker in the meantime is left alone.
+            await self.client.eval(COMPARE_AND_DELETE, 1, lock_key, token)
+
+    @abstractmethod
+    def _queue_commands(self, pipe, batch) -> dict[str, int]:
+        """Add the batch to `pipe` and map each pushed queue to the index of
+        the reply holding its depth."""
+        pass
+
+
+class RedisListQueue(RedisQueueBackend):
+    # Plain Redis lists. A popped message is gone from Redis, so `ack` is a no-op.
+
+    async def depths(self, queues: list[str]) -> dict[str, int]:
+        pipe = self.client.pipeline(transaction=False)
+        for queue in queues:
+            pipe.llen(queue)
+        return dict(zip(queues, await pipe.execute()))
+
+    async def oldest_enqueued_at(self, queues: list[str]) -> dict[str, float | None]:
+        # The oldest message sits at the tail of the list, where workers pop.
+        pipe = self.client.pipeline(transaction=False)
+        for queue in queues:
+            pipe.lindex(queue, -1)
+        oldest = {}
+        for queue, data in zip(queues, await pipe.execute()):
+            oldest[queue] = json.loads(data).get("enqueued_at") if data else None
+        return oldest
+
+    async def _read(self, queue: str, count: int, timeout: float) -> list[Message]:
+        return await self.wait_any([queue], count, timeout)
+
+    async def try_pop(self, queue: str, count: int) -> list[Message]:
+        return self._to_messages(
+            await self.client.lmpop(1, queue, direction="RIGHT", count=count)
+        )
+
+    async def wait_any(
+        self, queues: list[str], count: int, timeout: float
+    ) -> list[Message]:
+        # BLMPOP pops from the first of the keys that is not empty.
+        return self._to_messages(
+            await self.client.blmpop(
+                timeout, len(queues), *queues, direction="RIGHT", count=count
+            )
+        )
+
+    @staticmethod
+    def _to_messages(result) -> list[Message]:
+        if not result:
+            return []
+        queue, messages = result
+        if isinstance(queue, bytes):
+            queue = queue.decode()
+        return [Message(queue=queue, data=data) for data in messages]
+
+    def _queue_commands(self, pipe, batch) -> dict[str, int]:
+        # LPUSH accepts several values, so messages for the same queue share one
+        # command. Values are pushed in arrival order, keeping the list FIFO.
+        values = defaultdict(list)
+        for queue, data, _ in batch:
+            if queue is not None:
+                values[queue].append(data)
+
+        depth_index = {}
+        for i, (queue, queue_values) in enumerate(values.items()):
+            pipe.lpush(queue, *queue_values)
+            depth_index[queue] = i
+        return depth_index
+
+
+class RedisStreamQueue(RedisQueueBackend):
+    # Redis Streams with one consumer group per queue. A message stays in the
+    # group's pending entries list until it is acknowledged, so a claim held by a
+    # crashed consumer is reclaimed with XAUTOCLAIM once it has been idle for
+    # STREAM_CLAIM_MIN_IDLE_MS. Acknowledged entries are deleted right away,
+    # which keeps XLEN equal to the number of outstanding claims.
+    #
+    # Workers reset the idle time of the claims they are processing every third
+    # of STREAM_CLAIM_MIN_IDLE_MS, so only claims of consumers that stopped
+    # refreshing are reclaimed, however long a stage takes.
+
+    # Forwarding a claim and acknowledging it happen in one MULTI/EXEC, so a
+    # claim is never acknowledged without being forwarded or the other way round.
+    transaction = True
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        batch_size: int = QUEUE_BATCH_SIZE,
+        linger_ms: float = QUEUE_BATCH_LINGER_MS,
+        group: str = STREAM_CONSUMER_GROUP,
+        consumer: str | None = None,
+        claim_min_idle_ms: int = STREAM_CLAIM_MIN_IDLE_MS,
+        claim_interval_s: float = STREAM_CLAIM_INTERVAL_S,
+        retry_key: str = RETRY_SET_KEY,
+    ):
+        super().__init__(client, batch_size, linger_ms, retry_key)
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.claim_min_idle_ms = claim_min_idle_ms
+        self.claim_interval_s = claim_interval_s
+        self.refresh_interval = claim_min_idle_ms / 3000
+        self._groups: set[str] = set()
+        self._last_claim: dict[str, float] = {}
+        # Entries read beyond the requested count. They stay pending with this
+        # consumer and are handed out by its next reads.
+        self._held: dict[str, deque[Message]] = defaultdict(deque)
+
+    async def _ensure_group(self, queue: str):
+        if queue in self._groups:
+            return
+        try:
+            await self.client.xgroup_create(queue, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._groups.add(queue)
+
+    async def depths(self, queues: list[str]) -> dict[str, int]:
+        pipe = self.client.pipeline(transaction=False)
+        for queue in queues:
+            pipe.xlen(queue)
+        return dict(zip(queues, await pipe.execute()))
+
+    async def oldest_enqueued_at(self, queues: list[str]) -> dict[str, float | None]:
+        # Acknowledged entries are deleted, so the first entry is the oldest
+        # outstanding one and its id carries the enqueue time in milliseconds.
+        pipe = self.client.pipeline(transaction=False)
+        for queue in queues:
+            pipe.xrange(queue, count=1)
+        oldest = {}
+        for queue, entries in zip(queues, await pipe.execute()):
+            if entries:
+                entry_id = entries[0][0]
+                if isinstance(entry_id, bytes):
+                    entry_id = entry_id.decode()
+                oldest[queue] = int(entry_id.split("-")[0]) / 1000
+            else:
+                oldest[queue] = None
+        return oldest
+
+    async def pop_batch(
+        self, queue: str, count: int | None = None, timeout: float = 10
+    ) -> list[Message]:
+        await self._ensure_group(queue)
+
+        # Stalled entries of other consumers are handed out as a batch of their own.
+        reclaimed = await self._reclaim(queue, count or self.batch_size)
+        if reclaimed:
+            return reclaimed
+
+        return await super().pop_batch(queue, count, timeout)
+
+    async def _read(self, queue: str, count: int, timeout: float) -> list[Message]:
+        return await self.wait_any([queue], count, timeout)
+
+    async def try_pop(self, queue: str, count: int) -> list[Message]:
+        held = self._take_held([queue], count)
+        if held:
+            return held
+        await self._ensure_group(queue)
+        reclaimed = await self._reclaim(queue, count)
+        if reclaimed:
+            return reclaimed
+        return await self._read_streams([queue], count, block=None)
+
+    async def wait_any(
+        self, queues: list[str], count: int, timeout: float
+    ) -> list[Message]:
+        held = self._take_held(queues, count)
+        if held:
+            return held
+        for queue in queues:
+            await self._ensure_group(queue)
+        # COUNT applies per stream, so one read returns up to `count` entries of
+        # every queue. Only `count` are handed out, which keeps callers within
+        # their bound on claims in flight; the rest are held for the next read.
+        messages = await self._read_streams(
+            queues, count, block=max(int(timeout * 1000), 1)
+        )
+        for message in messages[count:]:
+            self._held[message.queue].append(message)
+        return messages[:count]
+
+    def _take_held(self, queues: list[str], count: int) -> list[Message]:
+        messages = []
+        for queue in queues:
+            held = self._held.get(queue)
+            while held and len(messages) < count:
+                messages.append(held.popleft())
+        return messages
+
+    async def refresh(self, messages: list[Message]):
+        # XCLAIM to the consumer that already owns the entries resets their idle
+        # time; JUSTID leaves their delivery count as it is.
+        receipts = defaultdict(list)
+        for message in itertools.chain(messages, *self._held.values()):
+            if message.receipt is not None:
+                receipts[message.queue].append(message.receipt)
+        if not receipts:
+            return
+
+        pipe = self.client.pipeline(transaction=False)
+        for queue, queue_receipts in receipts.items():
+            pipe.xclaim(
+                queue, self.group, self.consumer, 0, queue_receipts, justid=True
+            )
+        await pipe.execute()
+
+    async def _read_streams(
+        self, queues: list[str], count: int, block: int | None
+    ) -> list[Message]:
+        result = await self.client.xreadgroup(
+            self.group,
+            self.consumer,
+            {queue: ">" for queue in queues},
+            count=count,
+            block=block,
+        )
+        messages = []
+        for queue, entries in result or []:
+            if isinstance(queue, bytes):
+                queue = queue.decode()
+            messages.extend(self._to_messages(queue, entries))
+        return messages
+
+    async def _reclaim(self, queue: str, count: int) -> list[Message]:
+        now = time.monotonic()
+        if now - self._last_claim.get(queue, 0) < self.claim_interval_s:
+            return []
+        self._last_claim[queue] = now
+
+        _, entries, *_ = await self.client.xautoclaim(
+            queue,
+            self.group,
+            self.consumer,
+            min_idle_time=self.claim_min_idle_ms,
+            start_id="0-0",
+            count=count,
+        )
+        return self._to_messages(queue, entries)
+
+    @staticmethod
+    def _to_messages(queue: str, entries) -> list[Message]:
+        # Entries deleted while pending are returned without fields; skip them.
+        return [
+            Message(queue=queue, data=fields[b"data"], receipt=entry_id)
+            for entry_id, fields in entries
+            if fields
+        ]
+
+    def _queue_commands(self, pipe, batch) -> dict[str, int]:
+        acks = defaultdict(list)
+        pushed = []
+        for queue, data, message in batch:
+            if queue is not None:
+                pipe.xadd(queue, {"data": data})
+                if queue not in pushed:
+                    pushed.append(queue)
+            if message is not None and message.receipt is not None:
+                acks[message.queue].append(message.receipt)
+
+        for queue, receipts in acks.items():
+            pipe.xack(queue, self.group, *receipts)
+            pipe.xdel(queue, *receipts)
+
+        depth_index = {}
+        offset = len(pipe.command_stack)
+        for i, queue in enumerate(pushed):
+            pipe.xlen(queue)
+            depth_index[queue] = offset + i
+        return depth_index
+
+
+class InMemoryQueue:
+    # All queues of a backend share one condition, so a consumer can wait for
+    # any of several queues.
+
+    def __init__(self, changed: asyncio.Condition, maxsize: int = 0):
+        self.maxsize = maxsize
+        self.items: deque = deque()
+        self._changed = changed
+
+    def _has_room(self) -> bool:
+        return self.maxsize <= 0 or len(self.items) < self.maxsize
+
+    async def put(self, item):
+        async with self._changed:
+            await self._changed.wait_for(self._has_room)
+            self.items.append(item)
+            self._changed.notify_all()
+
+    def take(self, count: int) -> list:
+        # Callers hold the condition and notify waiting producers.
+        return [self.items.popleft() for _ in range(min(count, len(self.items)))]
+
+
+class InMemoryQueueBackend(QueueBackend):
+    # Bounded asyncio queues in the current process, for running the whole
+    # pipeline in one event loop. A push to a full queue waits for room, which
+    # propagates backpressure upstream. Queues in `unbounded` never block.
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        unbounded: list[str] | None = None,
+        batch_size: int = QUEUE_BATCH_SIZE,
+        linger_ms: float = 0,
+    ):
+        super().__init__(batch_size, linger_ms)
+        self.maxsize = maxsize
+        self.unbounded = set(unbounded or [])
+        self.queues: dict[str, InMemoryQueue] = {}
+        self._changed = asyncio.Condition()
+        # Heap of (due_at, sequence, queue, data) for parked retries.
+        self._scheduled: list[tuple[float, int, str, str]] = []
+        self._sequence = itertools.count()
+
+    def _queue(self, queue: str) -> InMemoryQueue:
+        if queue not in self.queues:
+            maxsize = 0 if queue in self.unbounded else self.maxsize
+            self.queues[queue] = InMemoryQueue(self._changed, maxsize)
+        return self.queues[queue]
+
+    async def _read(self, queue: str, count: int, timeout: float) -> list[Message]:
+        return await self.wait_any([queue], count, timeout)
+
+    async def try_pop(self, queue: str, count: int) -> list[Message]:
+        async with self._changed:
+            items = self._queue(queue).take(count)
+            if items:
+                self._changed.notify_all()
+        return [Message(queue=queue, data=data) for data in items]
+
+    async def wait_any(
+        self, queues: list[str], count: int, timeout: float
+    ) -> list[Message]:
+        in_memory_queues = [self._queue(queue) for queue in queues]
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(
+                        lambda: any(q.items for q in in_memory_queues)
+                    ),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                return []
+            for queue, in_memory_queue in zip(queues, in_memory_queues):
+                if in_memory_queue.items:
+                    items = in_memory_queue.take(count)
+                    self._changed.notify_all()
+                    return [Message(queue=queue, data=data) for data in items]
+        return []
+
+    async def push(self, queue: str, data: str) -> int:
+        in_memory_queue = self._queue(queue)
+        await in_memory_queue.put(data)
+        return len(in_memory_queue.items)
+
+    async def route(self, message: Message, queue: str, data: str):
+        await self.push(queue, data)
+
+    async def ack(self, message: Message):
+        pass
+
+    async def depths(self, queues: list[str]) -> dict[str, int]:
+        return {queue: len(self._queue(queue).items) for queue in queues}
+
+    async def oldest_enqueued_at(self, queues: list[str]) -> dict[str, float | None]:
+        oldest = {}
+        for queue in queues:
+            items = self._queue(queue).items
+            oldest[queue] = json.loads(items[0]).get("enqueued_at") if items else None
+        return oldest
+
+    async def schedule(self, message: Message, queue: str, data: str, due_at: float):
+        heapq.heappush(self._scheduled, (due_at, next(self._sequence), queue, data))
+
+    async def release_due(self, limit: int) -> int:
+        now = time.time()
+        due = []
+        while self._scheduled and self._scheduled[0][0] <= now and len(due) < limit:
+            due.append(heapq.heappop(self._scheduled))
+        for _, _, queue, data in due:
+            await self.push(queue, data)
+        return len(due)
+
+
+@lru_cache
+def get_queue_backend() -> QueueBackend:
+    # "memory" and "local" keep all queues inside the current process and are
+    # meant for single-process runs, benchmarks and tests without Redis.
+    if QUEUE_BACKEND == "memory":
+        return InMemoryQueueBackend()
+    if QUEUE_BACKEND == "local":
+        return RedisListQueue(get_local_redis())
+    if QUEUE_BACKEND == "stream":
+        return RedisStreamQueue(get_redis())
+    if QUEUE_BACKEND == "list":
+        return RedisListQueue(get_redis())
+    raise ValueError(f"Unknown QUEUE_BACKEND {QUEUE_BACKEND!r}")
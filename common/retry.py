@@ -0,0 +1,84 @@
+import asyncio
+import os
+import random
+from dataclasses import dataclass, fields
+
+from dotenv import load_dotenv
+
+from common.queues import QueueBackend
+from common.utils import get_logger
+
+load_dotenv()
+
+
+RETRY_POLL_INTERVAL_S = float(os.getenv("RETRY_POLL_INTERVAL_S", 1))
+RETRY_RELEASE_BATCH_SIZE = int(os.getenv("RETRY_RELEASE_BATCH_SIZE", 100))
+
+
+@dataclass
+class RetryPolicy:
+    max_retries: int = 3
+    base_delay_s: float = 2
+    max_delay_s: float = 300
+    multiplier: float = 2
+    # Fraction of the delay that is randomised, so claims that failed together
+    # do not all come back at the same moment.
+    jitter: float = 0.5
+
+    def delay(self, retry: int, rng: random.Random | None = None) -> float:
+        # `retry` counts from 1 for the first retry.
+        delay = min(
+            self.base_delay_s * self.multiplier ** (retry - 1), self.max_delay_s
+        )
+        return delay * (1 - self.jitter * (rng or random).random())
+
+    @classmethod
+    def from_env(cls, stage: str) -> "RetryPolicy":
+        # Every setting can be overridden per stage, e.g. OCR_RETRY_BASE_DELAY_S
+        # or OCR_MAX_RETRIES, and falls back to the global RETRY_BASE_DELAY_S
+        # or MAX_RETRIES.
+        prefix = stage.upper().replace("-", "_")
+        settings = {}
+        for field in fields(cls):
+            name = (
+                field.name.upper()
+                if field.name == "max_retries"
+                else f"RETRY_{field.name.upper()}"
+            )
+            value = os.getenv(f"{prefix}_{name}", os.getenv(name))
+            if value is not None:
+                settings[field.name] = field.type(value)
+        return cls(**settings)
+
+
+class RetryScheduler:
+    # Moves claims whose backoff has expired from the retry set back onto their
+    # queues. Every worker runs one; the backend ensures that a claim is
+    # released only once when several schedulers poll at the same time.
+
+    def __init__(
+        self,
+        queue_backend: QueueBackend,
+        interval: float = RETRY_POLL_INTERVAL_S,
+        batch_size: int = RETRY_RELEASE_BATCH_SIZE,
+    ):
+        self.queue_backend = queue_backend
+        self.interval = interval
+        self.batch_size = batch_size
+        self.logger = get_logger()
+
+    async def release(self) -> int:
+        released = 0
+        while True:
+            count = await self.queue_backend.release_due(self.batch_size)
+            released += count
+            if count < self.batch_size:
+                return released
+
+    async def run(self):
+        while True:
+            try:
+                await self.release()
+            except Exception as e:
+                self.logger.warning(f"Releasing due retries failed: {e!r}")
+            await asyncio.sleep(self.interval)
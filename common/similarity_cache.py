@@ -0,0 +1,166 @@
+import os
+import re
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge
+
+load_dotenv()
+
+
+# A cache of stage results keyed by document similarity instead of identity.
+# Documents are reduced to MinHash signatures of their word shingles, whose
+# share of equal values estimates the Jaccard similarity of the shingle sets.
+# Locality sensitive hashing over bands of the signature finds the documents
+# likely to be similar without comparing against every entry; the candidates
+# are then checked against the threshold on their estimated similarity.
+#
+# Entries live in the process, so every worker replica builds its own cache.
+
+MINHASH_NUM_PERM = int(os.getenv("MINHASH_NUM_PERM", 128))
+# Words per shingle.
+MINHASH_SHINGLE_SIZE = int(os.getenv("MINHASH_SHINGLE_SIZE", 3))
+
+# Mersenne prime above the 32 bit shingle hashes, for the permutations.
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+SIMILARITY_CACHE_LOOKUPS_TOTAL = Counter(
+    "similarity_cache_lookups_total",
+    "Lookups in a near-duplicate cache, by result (hit, miss).",
+    ["cache", "result"],
+)
+
+SIMILARITY_CACHE_ENTRIES = Gauge(
+    "similarity_cache_entries", "Entries in a near-duplicate cache.", ["cache"]
+)
+
+
+def shingles(text: str, size: int = MINHASH_SHINGLE_SIZE) -> set[str]:
+    # Word shingles of the lower-cased text. Digits are masked, so documents
+    # that differ only in amounts, dates or numbers share their shingles.
+    words = re.sub(r"\d", "0", text.lower()).split()
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def lsh_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    # Bands and rows per band whose LSH threshold (1 / bands) ** (1 / rows),
+    # the similarity at which a pair becomes a candidate with probability of
+    # about one half, lies closest below `threshold`. Pairs at the threshold
+    # are then found with high probability; false candidates are filtered
+    # on their estimated similarity.
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = MINHASH_NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode()) for shingle in shingles(text)),
+            dtype=np.uint64,
+        )
+        if not hashes.size:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        # One row per permutation, one column per shingle. The products wrap
+        # around in 64 bits like in other MinHash implementations, which
+        # keeps the permutations independent enough for estimation.
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME
+        return (permuted & MAX_HASH).min(axis=1)
+
+
+@dataclass
+class SimilarityMatch:
+    value: Any
+    similarity: float
+
+
+class SimilarityCache:
+    # Maps documents to a value, e.g. the label of their classification, and
+    # finds the value of a near-duplicate whose estimated similarity reaches
+    # `threshold`. Holds at most `max_entries`, evicting the least recently
+    # used; 0 disables the cache.
+
+    def __init__(
+        self,
+        name: str,
+        threshold: float,
+        max_entries: int,
+        hasher: MinHasher | None = None,
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hasher = hasher or MinHasher()
+        self.bands, self.rows = lsh_bands(self.hasher.num_perm, threshold)
+        self._entries: OrderedDict[int, tuple[np.ndarray, Any]] = OrderedDict()
+        self._buckets: list[dict[bytes, set[int]]] = [{} for _ in range(self.bands)]
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def lookup(self, signature: np.ndarray) -> SimilarityMatch | None:
+        if self.max_entries <= 0:
+            return None
+
+        candidates = set()
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(buckets.get(key, ()))
+
+        best = None
+        for entry_id in candidates:
+            entry_signature, value = self._entries[entry_id]
+            similarity = float(np.mean(entry_signature == signature))
+            if similarity >= self.threshold and (
+                best is None or similarity > best[1].similarity
+            ):
+                best = (entry_id, SimilarityMatch(value, similarity))
+
+        SIMILARITY_CACHE_LOOKUPS_TOTAL.labels(
+            cache=self.name, result="miss" if best is None else "hit"
+        ).inc()
+        if best is None:
+            return None
+        self._entries.move_to_end(best[0])
+        return best[1]
+
+    def add(self, signature: np.ndarray, value: Any):
+        if self.max_entries <= 0:
+            return
+        entry_id, self._next_id = self._next_id, self._next_id + 1
+        self._entries[entry_id] = (signature, value)
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(key, set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            evicted_id, (evicted, _) = self._entries.popitem(last=False)
+            for buckets, key in zip(self._buckets, self._band_keys(evicted)):
+                bucket = buckets[key]
+                bucket.discard(evicted_id)
+                if not bucket:
+                    del buckets[key]
+        SIMILARITY_CACHE_ENTRIES.labels(cache=self.name).set(len(self._entries))
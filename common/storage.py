@@ -1,7 +1,10 @@
+import hashlib
 import os
+import shutil
 from abc import ABC, abstractmethod
 from anyio import to_thread
 from pathlib import Path
+from typing import AsyncIterator
 from uuid import uuid4
 from functools import lru_cache
 from dotenv import load_dotenv
@@ -10,9 +13,25 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", 1 << 20))
+
+
+class AttachmentTooLargeError(Exception):
+    pass
+
+
 class StorageBackend(ABC):
     @abstractmethod
-    def store(self, file_bytes: bytes, extension: str) -> str:
+    def store(self, file_bytes: bytes, extension: str) -> tuple[str, str]:
+        pass
+
+    @abstractmethod
+    def store_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        extension: str,
+        max_size: int | None = None,
+    ) -> tuple[str, str]:
         pass
 
 
@@ -27,22 +46,78 @@ class LocalStorage(StorageBackend):
         generated_path = self.storage_dir.joinpath(*sub_folders) / claim_id
         return generated_path
 
-    def _write_file(self, file_path: Path, file_bytes: bytes):
-        with open(file_path, "wb") as f:
-            f.write(file_bytes)
+    def content_path(self, content_hash: str) -> Path:
+        # Content addressed store shared by all claims with identical attachments.
+        # The directory of a hash holds the attachment and cached stage outputs.
+        return self.storage_dir / "_content" / content_hash[:2] / content_hash
+
+    def _write_chunk(self, file, sha256, chunk: bytes):
+        sha256.update(chunk)
+        file.write(chunk)
+
+    async def store(self, file_bytes: bytes, extension: str) -> tuple[str, str]:
+        async def chunks():
+            view = memoryview(file_bytes)
+            for start in range(0, len(view), ATTACHMENT_CHUNK_SIZE):
+                yield view[start : start + ATTACHMENT_CHUNK_SIZE]
 
-    async def store(self, file_bytes: bytes, extension: str) -> str:
+        return await self.store_stream(chunks(), extension)
+
+    async def store_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        extension: str,
+        max_size: int | None = None,
+    ) -> tuple[str, str]:
+        # The attachment is written to a temporary file chunk by chunk while its
+        # hash and size are computed, so memory stays bounded by the chunk size.
         claim_id = str(uuid4()).lower()
-        file_name = f"{claim_id}.{extension}"
-        file_path_base = self.file_path(claim_id)
+        incoming_dir = self.storage_dir / "_content" / ".incoming"
+        incoming_dir.mkdir(parents=True, exist_ok=True)
+        partial_file = incoming_dir / f"{claim_id}.part"
+
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with open(partial_file, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise AttachmentTooLargeError(
+                            f"Attachment exceeds the limit of {max_size} bytes."
+                        )
+                    await to_thread.run_sync(self._write_chunk, f, sha256, chunk)
+
+            content_hash = sha256.hexdigest()
+            content_file = self.content_path(content_hash) / f"attachment.{extension}"
 
+            # A resent attachment is linked from the content store instead of
+            # being kept twice.
+            if content_file.exists():
+                partial_file.unlink()
+            else:
+                content_file.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(partial_file, content_file)
+        except BaseException:
+            partial_file.unlink(missing_ok=True)
+            raise
+
+        file_path_base = self.file_path(claim_id)
         file_path_base.mkdir(parents=True, exist_ok=True)
+        file_path = file_path_base / f"{claim_id}.{extension}"
 
-        file_path = file_path_base / file_name
+        await to_thread.run_sync(link_or_copy, content_file, file_path)
 
-        await to_thread.run_sync(self._write_file, file_path, file_bytes)
+        return claim_id, content_hash
 
-        return claim_id
+
+def link_or_copy(source: Path, destination: Path):
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(source, destination)
 
 
 @lru_cache
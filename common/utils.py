@@ -39,5 +39,7 @@ class Queues(Enum):
     CASE_PLAUSIBILITY_CHECK_QUEUE = "case-plausibility-check-queue"
     CASE_PLAUSIBILITY_CHECK_DLQ = "case-plausibility-check-dlq"
 
+    CLAIM_SPILL_QUEUE = "claim-spill-queue"
+
     CLAIM_ACCEPTANCE_QUEUE = "claim-acceptance-queue"
     CLAIM_REJECTION_QUEUE = "claim-rejection-queue"
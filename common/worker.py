@@ -0,0 +1,246 @@
+import asyncio
+import json
+import os
+import signal
+import time
+from dataclasses import replace
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+
+from common.latency import (
+    build_latency_record,
+    get_latency_store,
+    CLAIM_END_TO_END_SECONDS,
+    LatencyStore,
+)
+from common.metrics import (
+    start_metrics_server,
+    STAGE_CLAIMS_TOTAL,
+    STAGE_IN_FLIGHT,
+    STAGE_PROCESSING_SECONDS,
+    STAGE_QUEUE_WAIT_SECONDS,
+)
+from common.priority import DEFAULT_LANE, lane_queue, WeightedLanes
+from common.queues import get_queue_backend, Message, QueueBackend
+from common.retry import RetryPolicy, RetryScheduler
+from common.utils import get_logger, Queues
+
+load_dotenv()
+
+
+# A stage handler receives the dequeued payload and returns the queue the claim
+# is routed to next together with the metadata to place on that queue.
+Route = tuple[Queues, dict]
+Handler = Callable[[dict], Awaitable[Route]]
+
+# Upper bound on how long a stopping worker keeps waiting for new claims.
+POLL_TIMEOUT_S = float(os.getenv("WORKER_POLL_TIMEOUT_S", 5))
+
+# Payload fields forwarded unchanged from one stage to the next.
+CARRIED_FIELDS = ("content_hash", "ingested_at", "lane")
+
+# Queues at the end of the pipeline; reaching one completes the claim.
+TERMINAL_QUEUES = {
+    Queues.CLAIM_ACCEPTANCE_QUEUE: "accepted",
+    Queues.CLAIM_REJECTION_QUEUE: "rejected",
+}
+
+
+class StageWorker:
+    def __init__(
+        self,
+        queue: Queues,
+        handler: Handler,
+        dlq: Queues | None = None,
+        max_retries: int | None = None,
+        concurrency: int | None = None,
+        queue_backend: QueueBackend | None = None,
+        latency_store: LatencyStore | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ):
+        self.queue = queue
+        self.stage = queue.value.removesuffix("-queue")
+        self.dlq = dlq
+        self.handler = handler
+        self.retry_policy = retry_policy or RetryPolicy.from_env(self.stage)
+        if max_retries is not None:
+            self.retry_policy = replace(self.retry_policy, max_retries=max_retries)
+        self.max_retries = self.retry_policy.max_retries
+        self.concurrency = concurrency or int(os.getenv("WORKER_CONCURRENCY", 8))
+        self.queue_backend = queue_backend or get_queue_backend()
+        self.lanes = WeightedLanes(queue.value)
+        self.latency_store = latency_store or get_latency_store()
+        self.logger = get_logger()
+        # Claims in flight by the task processing them.
+        self._tasks: dict[asyncio.Task, Message] = {}
+        self._capacity = asyncio.Event()
+        self._stopping = False
+
+    def stop(self):
+        # Stops popping new claims; `run` returns once the in-flight claims are done.
+        self._stopping = True
+        self._capacity.set()
+
+    async def run(self, handle_signals: bool = True):
+        # Bounds the number of claims in flight; only as many messages as there
+        # are free slots are popped, so no claim sits dequeued waiting for capacity.
+        capacity = self._capacity
+        capacity.set()
+
+        def _release(task: asyncio.Task):
+            self._tasks.pop(task, None)
+            capacity.set()
+
+        if handle_signals:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.stop)
+
+        start_metrics_server()
+        self.logger.info(
+            f"Worker for {self.queue.value} started with concurrency {self.concurrency}."
+        )
+        background_tasks = [
+            asyncio.create_task(RetryScheduler(self.queue_backend).run())
+        ]
+        if self.queue_backend.refresh_interval is not None:
+            background_tasks.append(asyncio.create_task(self._refresh_in_flight()))
+        try:
+            while not self._stopping:
+                free_slots = self.concurrency - len(self._tasks)
+                if free_slots <= 0:
+                    capacity.clear()
+                    await capacity.wait()
+                    continue
+
+                messages = await self.lanes.pop_batch(
+                    self.queue_backend, count=free_slots, timeout=POLL_TIMEOUT_S
+                )
+                for message in messages:
+                    task = asyncio.create_task(self._process(message))
+                    self._tasks[task] = message
+                    task.add_done_callback(_release)
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            # Waits for the scheduler and the refresher to unwind, so shutdown
+            # never ends halfway through a release of due claims.
+            for task in background_tasks:
+                task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+            await self.queue_backend.close()
+
+    async def _refresh_in_flight(self):
+        # A claim that is still being processed, e.g. one waiting for a slot in
+        # the OCR pool, must not be handed to another consumer as stalled.
+        while True:
+            await asyncio.sleep(self.queue_backend.refresh_interval)
+            try:
+                await self.queue_backend.refresh(list(self._tasks.values()))
+            except Exception as e:
+                self.logger.warning(f"Refreshing claims in flight failed: {e!r}")
+
+    def _timeline_entry(self, payload: dict, entered_at: float, **extra) -> list:
+        # Every attempt of a stage appends its enter/exit timestamps to the
+        # claim's timeline, which travels with the claim to the final queue.
+        entry = {
+            "stage": self.stage,
+            "enqueued_at": payload.get("enqueued_at"),
+            "enter": entered_at,
+            "exit": time.time(),
+            **extra,
+        }
+        return payload.get("timeline", []) + [entry]
+
+    async def _process(self, message: Message):
+        payload = json.loads(message.data)
+        entered_at = time.time()
+        lane = payload.get("lane", DEFAULT_LANE)
+        if "enqueued_at" in payload:
+            STAGE_QUEUE_WAIT_SECONDS.labels(stage=self.stage, lane=lane).observe(
+                max(entered_at - payload["enqueued_at"], 0)
+            )
+
+        with STAGE_IN_FLIGHT.labels(stage=self.stage).track_inprogress():
+            try:
+                with STAGE_PROCESSING_SECONDS.labels(stage=self.stage).time():
+                    next_queue, metadata = await self.handler(payload)
+                metadata = {
+                    **{key: payload[key] for key in CARRIED_FIELDS if key in payload},
+                    **metadata,
+                    "timeline": self._timeline_entry(payload, entered_at),
+                    "enqueued_at": time.time(),
+                }
+                # Claims stay in their lane through every stage; the final
+                # queues are shared by all lanes.
+                await self.queue_backend.route(
+                    message,
+                    (
+                        next_queue.value
+                        if next_queue in TERMINAL_QUEUES
+                        else lane_queue(next_queue.value, lane)
+                    ),
+                    json.dumps(metadata),
+                )
+                STAGE_CLAIMS_TOTAL.labels(stage=self.stage, outcome="success").inc()
+            except Exception as e:
+                await self._handle_failure(message, payload, entered_at, e)
+                return
+
+        if next_queue in TERMINAL_QUEUES:
+            await self._record_completion(metadata, TERMINAL_QUEUES[next_queue])
+
+    async def _record_completion(self, metadata: dict, outcome: str):
+        record = build_latency_record(metadata, outcome, metadata["enqueued_at"])
+        CLAIM_END_TO_END_SECONDS.labels(outcome=outcome, lane=record["lane"]).observe(
+            record["end_to_end"]
+        )
+        try:
+            await self.latency_store.record(record)
+        except Exception as e:
+            self.logger.warning(
+                f"[{record['claim_id']}] latency record could not be stored: {e!r}"
+            )
+
+    async def _handle_failure(
+        self, message: Message, payload: dict, entered_at: float, error: Exception
+    ):
+        claim_id = payload.get("claim_id")
+        retries = payload.get("retries", 0)
+        payload["timeline"] = self._timeline_entry(payload, entered_at, failed=True)
+        payload["last_error"] = {
+            "stage": self.stage,
+            "type": type(error).__name__,
+            "message": str(error),
+            "failed_at": time.time(),
+        }
+
+        if retries < self.max_retries:
+            # The claim is parked until its backoff expires instead of going
+            # straight back onto the queue, so a failing dependency does not
+            # turn into a hot retry loop that starves healthy claims.
+            delay = self.retry_policy.delay(retries + 1)
+            self.logger.warning(
+                f"[{claim_id}] failed in {self.queue.value} ({error!r}), retry {retries + 1}/{self.max_retries} in {delay:.1f}s."
+            )
+            payload["retries"] = retries + 1
+            # The claim becomes available again at the next attempt, which is
+            # where its queue wait starts.
+            payload["enqueued_at"] = payload["next_attempt_at"] = time.time() + delay
+            await self.queue_backend.schedule(
+                message,
+                message.queue,
+                json.dumps(payload),
+                payload["next_attempt_at"],
+            )
+            STAGE_CLAIMS_TOTAL.labels(stage=self.stage, outcome="retry").inc()
+        elif self.dlq is not None:
+            payload["enqueued_at"] = time.time()
+            await self.queue_backend.route(message, self.dlq.value, json.dumps(payload))
+            STAGE_CLAIMS_TOTAL.labels(stage=self.stage, outcome="dlq").inc()
+            self.logger.error(f"Added {claim_id=} to {self.dlq.value}.")
+        else:
+            await self.queue_backend.ack(message)
+            STAGE_CLAIMS_TOTAL.labels(stage=self.stage, outcome="dropped").inc()
+            self.logger.error(
+                f"[{claim_id}] dropped from {self.queue.value} after {retries} retries: {error!r}"
+            )
@@ -1,75 +1,138 @@
 import asyncio
-import json
+import multiprocessing
 import os
-import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 
-import redis.asyncio as redis
+from anyio import to_thread
 from dotenv import load_dotenv
 
+from common.batching import MicroBatcher
+from common.cache import get_stage_cache
+from common.cost_positions import (
+    cost_positions_dir,
+    COST_POSITION_FILES,
+    extract_cost_positions_to,
+    new_cost_positions_version,
+    publish_cost_positions,
+)
+from common.mock import mock_batch_delay, mock_random
 from common.storage import get_local_storage
 from common.utils import get_logger, Queues
+from common.worker import Route, StageWorker
 
 load_dotenv()
 
 
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", 6379))
-)
-
 logger = get_logger()
-MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
 
+COST_POSITIONS_PROCESS_POOL_SIZE = int(os.getenv("COST_POSITIONS_PROCESS_POOL_SIZE", 2))
+
+
+@lru_cache
+def get_table_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=COST_POSITIONS_PROCESS_POOL_SIZE,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+async def extract_cost_positions_batch(
+    documents: list[tuple[str, str | None, Path, Path]],
+) -> list[int | BaseException]:
+    # Extracts the invoice tables of a batch of (claim id, content hash,
+    # document path, output directory) and returns the rows found per document.
+    # The invoice table of machine generated PDFs is found with PyMuPDF's table
+    # detection. Scanned invoices would need a model instead, called once per batch,
+    # eg. Donut, LLMs, Table Transformer, Amazon Tesseract, Azure Document Intelligence
+
+    # The line items are written as one memory-mappable file per column, which
+    # the plausibility check reads without parsing the document again.
+    loop = asyncio.get_running_loop()
+    rows = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                get_table_pool(),
+                extract_cost_positions_to,
+                str(document_path),
+                str(output_dir),
+            )
+            for _, _, document_path, output_dir in documents
+        ),
+        return_exceptions=True,
+    )
+
+    await mock_batch_delay(
+        "cost_positions_extraction",
+        [
+            mock_random("cost_positions_extraction", content_hash or claim_id)
+            for claim_id, content_hash, _, _ in documents
+        ],
+    )
+
+    return rows
+
+
+extraction_batcher = MicroBatcher(
+    "cost-positions-extraction", extract_cost_positions_batch
+)
 
-async def run_cost_position_extraction(claim_id: str):
-    # This function mocks the cost position extraction step
-    # eg. Donut, LLMs, Table Transformer, Amazon Tesseract, Azure Document Intelligence,
-    # Docling, pdfplumber (work well for machine generated pdf)
 
+async def run_cost_position_extraction(
+    claim_id: str, content_hash: str | None = None
+) -> Path:
     claim_document_dir = get_local_storage().file_path(claim_id)
     document_path = claim_document_dir / f"{claim_id.lower()}.pdf"
-    dummy_ocr_file = claim_document_dir / f"{claim_id.lower()}.txt"
-
-    with open(dummy_ocr_file, "r") as file:
-        ocr = file.read().rstrip()
-
-    # Use the PDF and OCR to extract cost positions using one of the mentioned methods
-    # The cost positions will ideally be saved in a database
-
-    await asyncio.sleep(random.randint(1, 5))
-
-
-async def worker():
-    while True:
-        message = await r.brpop(
-            [Queues.COST_POSITIONS_EXTRACTION_QUEUE.value], timeout=10
-        )
-        if message:
-            queue_name, data = message
-            payload = json.loads(data)
-            claim_id = payload["claim_id"]
-            retries = payload.get("retries", 0)
-            try:
-                _ = await run_cost_position_extraction(claim_id)
-                metadata = {
-                    "claim_id": claim_id,
-                    "status": "cost_positions_extraction_completed",
-                }
-                await r.lpush(
-                    Queues.CASE_PLAUSIBILITY_CHECK_QUEUE.value, json.dumps(metadata)
-                )
-            except Exception as e:
-                if retries < MAX_RETRIES:
-                    payload["retries"] = retries + 1
-                    await r.lpush(
-                        Queues.COST_POSITIONS_EXTRACTION_QUEUE.value,
-                        json.dumps(payload),
-                    )
-                else:
-                    await r.lpush(
-                        Queues.COST_POSITIONS_EXTRACTION_DLQ.value, json.dumps(payload)
-                    )
-                    logger.error(f"Added {claim_id=} to cost positions extraction DLQ.")
+    output_dir = cost_positions_dir(claim_document_dir, claim_id)
+
+    # Cached tables are linked into a version of their own, which is published
+    # like an extracted one.
+    version = await to_thread.run_sync(new_cost_positions_version, output_dir)
+    if await get_stage_cache().get_files(
+        content_hash,
+        "cost_positions",
+        {name: version / name for name in COST_POSITION_FILES},
+    ):
+        await to_thread.run_sync(publish_cost_positions, output_dir, version)
+        logger.info(f"[{claim_id}] reused cost positions of an identical attachment.")
+        return output_dir
+    await to_thread.run_sync(shutil.rmtree, version)
+
+    # Claims extracted at the same time share one model call.
+    rows = await extraction_batcher.submit(
+        (claim_id, content_hash, document_path, output_dir)
+    )
+    logger.info(f"[{claim_id}] extracted {rows} cost positions.")
+    await get_stage_cache().put_files(
+        content_hash,
+        "cost_positions",
+        {name: output_dir / name for name in COST_POSITION_FILES},
+    )
+
+    return output_dir
+
+
+async def handle_claim(payload: dict) -> Route:
+    claim_id = payload["claim_id"]
+    _ = await run_cost_position_extraction(claim_id, payload.get("content_hash"))
+    metadata = {
+        "claim_id": claim_id,
+        "status": "cost_positions_extraction_completed",
+    }
+
+    return Queues.CASE_PLAUSIBILITY_CHECK_QUEUE, metadata
+
+
+def create_worker(**kwargs) -> StageWorker:
+    return StageWorker(
+        queue=Queues.COST_POSITIONS_EXTRACTION_QUEUE,
+        dlq=Queues.COST_POSITIONS_EXTRACTION_DLQ,
+        handler=handle_claim,
+        **kwargs,
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(worker())
+    asyncio.run(create_worker().run())
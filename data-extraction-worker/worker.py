@@ -1,69 +1,145 @@
 import asyncio
-import json
+import multiprocessing
 import os
-import random
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 
-import redis.asyncio as redis
 from dotenv import load_dotenv
 
+from common.batching import MicroBatcher
+from common.cache import get_stage_cache
+from common.claim_fields import claim_fields_path, fields_from_text, write_claim_fields
+from common.invoice_templates import (
+    match_template,
+    read_first_page_spans,
+    TEMPLATE_EXTRACTIONS_TOTAL,
+    TEMPLATE_MIN_CONFIDENCE,
+)
+from common.mock import mock_batch_delay, mock_random
 from common.storage import get_local_storage
 from common.utils import get_logger, Queues
+from common.worker import Route, StageWorker
 
 load_dotenv()
 
 
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", 6379))
+logger = get_logger()
+
+DATA_EXTRACTION_PROCESS_POOL_SIZE = int(
+    os.getenv("DATA_EXTRACTION_PROCESS_POOL_SIZE", 2)
 )
 
-logger = get_logger()
-MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
+
+@lru_cache
+def get_layout_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=DATA_EXTRACTION_PROCESS_POOL_SIZE,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
 
 
-async def run_data_extraction(claim_id: str):
-    # This function mocks the data extraction step
+async def extract_fields(documents: list[tuple[str, str | None, str]]) -> list[dict]:
+    # This function mocks the data extraction model, which extracts the fields
+    # of a batch of (claim id, content hash, OCR text) in one call.
     # Models like Custom NER model, LLM, Donut can be used
 
+    # LLM call to extract structured information from the dummy ocr texts
+
+    await mock_batch_delay(
+        "data_extraction",
+        [
+            mock_random("data_extraction", content_hash or claim_id)
+            for claim_id, content_hash, _ in documents
+        ],
+    )
+
+    # Placeholder for the structured output of the model: the labelled fields
+    # of the invoice as printed.
+    return [fields_from_text(ocr) for _, _, ocr in documents]
+
+
+extraction_batcher = MicroBatcher("data-extraction", extract_fields)
+
+
+async def extract_with_template(claim_id: str, document_path: Path) -> dict | None:
+    # Fields of an invoice in a registered layout, read from the positions of
+    # its text. None if the layout is unknown or the template is not confident
+    # in its result.
+    spans = await asyncio.get_running_loop().run_in_executor(
+        get_layout_pool(), read_first_page_spans, str(document_path)
+    )
+    extraction = match_template(spans)
+    if extraction is None:
+        TEMPLATE_EXTRACTIONS_TOTAL.labels(
+            template="unknown", result="unknown_layout"
+        ).inc()
+        return None
+
+    if extraction.confidence < TEMPLATE_MIN_CONFIDENCE:
+        TEMPLATE_EXTRACTIONS_TOTAL.labels(
+            template=extraction.template, result="low_confidence"
+        ).inc()
+        logger.info(
+            f"[{claim_id}] {extraction.template} template found "
+            f"{extraction.confidence:.0%} of the fields."
+        )
+        return None
+
+    TEMPLATE_EXTRACTIONS_TOTAL.labels(template=extraction.template, result="hit").inc()
+    return extraction.fields
+
+
+async def run_data_extraction(claim_id: str, content_hash: str | None = None):
+    # The extracted fields are saved in the claim storage, where the policy
+    # coverage check reads them.
+
     claim_document_dir = get_local_storage().file_path(claim_id)
-    dummy_ocr_file = claim_document_dir / f"{claim_id.lower()}.txt"
+    fields_path = claim_fields_path(claim_document_dir, claim_id)
+
+    cached_fields = await get_stage_cache().get(content_hash, "data_extraction")
+    if cached_fields is not None:
+        write_claim_fields(fields_path, cached_fields)
+        return cached_fields
+
+    # Invoices of a known layout skip the model, the others and uncertain
+    # template results are sent to it.
+    document_path = claim_document_dir / f"{claim_id.lower()}.pdf"
+    extracted_fields = await extract_with_template(claim_id, document_path)
+    if extracted_fields is None:
+        dummy_ocr_file = claim_document_dir / f"{claim_id.lower()}.txt"
+
+        with open(dummy_ocr_file, "r") as file:
+            ocr = file.read().rstrip()
 
-    with open(dummy_ocr_file, "r") as file:
-        ocr = file.read().rstrip()
+        # Claims extracted at the same time share one model call.
+        extracted_fields = await extraction_batcher.submit(
+            (claim_id, content_hash, ocr)
+        )
+    write_claim_fields(fields_path, extracted_fields)
+    await get_stage_cache().put(content_hash, "data_extraction", extracted_fields)
 
-    # LLM call to extract structured information from the dummy ocr text
-    # Output can be saved in a parquet file in the claim storage dir
+    return extracted_fields
 
-    await asyncio.sleep(random.randint(1, 5))
 
+async def handle_claim(payload: dict) -> Route:
+    claim_id = payload["claim_id"]
+    _ = await run_data_extraction(claim_id, payload.get("content_hash"))
 
-async def worker():
-    while True:
-        message = await r.brpop([Queues.DATA_EXTRACTION_QUEUE.value], timeout=10)
-        if message:
-            queue_name, data = message
-            payload = json.loads(data)
-            claim_id = payload["claim_id"]
-            retries = payload.get("retries", 0)
-            try:
-                _ = await run_data_extraction(claim_id)
+    metadata = {"claim_id": claim_id, "status": "data_extraction_performed"}
+    logger.info(f"[{claim_id}] data extraction completed.")
 
-                metadata = {"claim_id": claim_id, "status": "data_extraction_performed"}
+    return Queues.POLICY_COVERAGE_CHECK_QUEUE, metadata
 
-                await r.lpush(
-                    Queues.POLICY_COVERAGE_CHECK_QUEUE.value, json.dumps(metadata)
-                )
-                logger.info(f"[{claim_id}] data extraction completed.")
 
-            except Exception as e:
-                if retries < MAX_RETRIES:
-                    payload["retries"] = retries + 1
-                    await r.lpush(
-                        Queues.DATA_EXTRACTION_QUEUE.value, json.dumps(payload)
-                    )
-                else:
-                    await r.lpush(Queues.DATA_EXTRACTION_DLQ.value, json.dumps(payload))
-                    logger.error(f"Added {claim_id=} to data extraction DLQ.")
+def create_worker(**kwargs) -> StageWorker:
+    return StageWorker(
+        queue=Queues.DATA_EXTRACTION_QUEUE,
+        dlq=Queues.DATA_EXTRACTION_DLQ,
+        handler=handle_claim,
+        **kwargs,
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(worker())
+    asyncio.run(create_worker().run())
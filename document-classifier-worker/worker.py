@@ -1,87 +1,133 @@
 import asyncio
-import json
 import os
-import random
 from typing import Literal
 
-import redis.asyncio as redis
+from anyio import to_thread
 from dotenv import load_dotenv
 
+from common.batching import MicroBatcher
+from common.cache import get_stage_cache
+from common.mock import mock_batch_delay, mock_random
+from common.pdf_text import read_pages
+from common.similarity_cache import SimilarityCache
 from common.storage import get_local_storage
 from common.utils import get_logger, Queues
+from common.worker import Route, StageWorker
 
 load_dotenv()
 
 
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", 6379))
+logger = get_logger()
+
+# Documents whose OCR text is at least this similar to a classified document
+# take over its label without a model call. Invoices of the same template score
+# 0.5 to 0.8 with their differing names and items, unrelated documents near 0.
+CLASSIFICATION_SIMILARITY_THRESHOLD = float(
+    os.getenv("CLASSIFICATION_SIMILARITY_THRESHOLD", 0.5)
+)
+CLASSIFICATION_SIMILARITY_CACHE_SIZE = int(
+    os.getenv("CLASSIFICATION_SIMILARITY_CACHE_SIZE", 1024)
 )
 
-logger = get_logger()
-MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
+# The type of a document shows on its first pages; the rest of a long document
+# is not read.
+CLASSIFICATION_PAGES = int(os.getenv("CLASSIFICATION_PAGES", 2))
 
+DocumentType = Literal["partial", "total_loss", "other"]
 
-async def classify_document(claim_id: str) -> Literal["partial", "total_loss", "other"]:
-    # This function mocks the document classification step
 
-    claim_document_dir = get_local_storage().file_path(claim_id)
-    dummy_ocr_file = claim_document_dir / f"{claim_id.lower()}.txt"
+async def classify_documents(
+    documents: list[tuple[str, str | None, str]],
+) -> list[DocumentType]:
+    # This function mocks the document classification model, which classifies
+    # a batch of (claim id, content hash, OCR text) in one call.
 
-    with open(dummy_ocr_file, "r") as file:
-        ocr = file.read().rstrip()
+    # LLM call to classify the document types
 
-    # LLM call to classify the document type
+    rngs = [
+        mock_random("classification", content_hash or claim_id)
+        for claim_id, content_hash, _ in documents
+    ]
+    await mock_batch_delay("classification", rngs)
 
-    await asyncio.sleep(random.randint(1, 5))
+    return [
+        rng.choices(["partial", "total_loss", "other"], [0.8, 0.1, 0.1], k=1)[0]
+        for rng in rngs
+    ]
 
-    document_type = random.choices(
-        ["partial", "total_loss", "other"], [0.8, 0.1, 0.1], k=1
-    )
 
-    return document_type[0]
-
-
-async def worker():
-    while True:
-        message = await r.brpop([Queues.DOCUMENT_CLASSIFIER_QUEUE.value], timeout=10)
-        if message:
-            queue_name, data = message
-            payload = json.loads(data)
-            claim_id = payload["claim_id"]
-            retries = payload.get("retries", 0)
-            try:
-                document_type = await classify_document(claim_id)
-                metadata = {
-                    "claim_id": claim_id,
-                    "status": f"document_type_{document_type}",
-                }
-
-                if document_type == "partial":
-                    await r.lpush(
-                        Queues.DATA_EXTRACTION_QUEUE.value, json.dumps(metadata)
-                    )
-                    logger.info(f"[{claim_id}] classified as {document_type=}.")
-                else:
-                    logger.error(
-                        f"[{claim_id}] is of {document_type=}. Can not be processed further."
-                    )
-                    await r.lpush(
-                        Queues.CLAIM_REJECTION_QUEUE.value, json.dumps(metadata)
-                    )
-                    # the logic to reject claim/ handover to the user/ send automated reply back to the sender, goes here.
-                    # The claim can be added to a separate queue for human intervention
-            except Exception as e:
-                if retries < MAX_RETRIES:
-                    payload["retries"] = retries + 1
-                    await r.lpush(
-                        Queues.DOCUMENT_CLASSIFIER_QUEUE.value, json.dumps(payload)
-                    )
-                else:
-                    await r.lpush(
-                        Queues.DOCUMENT_CLASSIFIER_DLQ.value, json.dumps(payload)
-                    )
-                    logger.error(f"Added {claim_id=} to document classifier DLQ.")
+classification_batcher = MicroBatcher("document-classifier", classify_documents)
+
+similarity_cache = SimilarityCache(
+    "classification",
+    CLASSIFICATION_SIMILARITY_THRESHOLD,
+    CLASSIFICATION_SIMILARITY_CACHE_SIZE,
+)
+
+
+async def classify_document(
+    claim_id: str, content_hash: str | None = None
+) -> DocumentType:
+    cached_document_type = await get_stage_cache().get(content_hash, "classification")
+    if cached_document_type is not None:
+        return cached_document_type
+
+    claim_document_dir = get_local_storage().file_path(claim_id)
+    dummy_ocr_file = claim_document_dir / f"{claim_id.lower()}.txt"
+
+    pages = await to_thread.run_sync(
+        read_pages, dummy_ocr_file, range(CLASSIFICATION_PAGES)
+    )
+    ocr = "\n".join(pages).rstrip()
+
+    # Documents of a known layout reuse the label of their nearest duplicate,
+    # only new layouts are sent to the model.
+    signature = similarity_cache.hasher.signature(ocr)
+    match = similarity_cache.lookup(signature)
+    if match is not None:
+        document_type = match.value
+        logger.info(
+            f"[{claim_id}] reused the label of a document with "
+            f"{match.similarity:.2f} similarity."
+        )
+    else:
+        # Claims classified at the same time share one model call.
+        document_type = await classification_batcher.submit(
+            (claim_id, content_hash, ocr)
+        )
+        similarity_cache.add(signature, document_type)
+
+    await get_stage_cache().put(content_hash, "classification", document_type)
+
+    return document_type
+
+
+async def handle_claim(payload: dict) -> Route:
+    claim_id = payload["claim_id"]
+    document_type = await classify_document(claim_id, payload.get("content_hash"))
+    metadata = {
+        "claim_id": claim_id,
+        "status": f"document_type_{document_type}",
+    }
+
+    if document_type == "partial":
+        logger.info(f"[{claim_id}] classified as {document_type=}.")
+        return Queues.DATA_EXTRACTION_QUEUE, metadata
+
+    logger.error(f"[{claim_id}] is of {document_type=}. Can not be processed further.")
+    # the logic to reject claim/ handover to the user/ send automated reply back to the sender, goes here.
+    # The claim can be added to a separate queue for human intervention
+    return Queues.CLAIM_REJECTION_QUEUE, metadata
+
+
+def create_worker(**kwargs) -> StageWorker:
+    return StageWorker(
+        queue=Queues.DOCUMENT_CLASSIFIER_QUEUE,
+        dlq=Queues.DOCUMENT_CLASSIFIER_DLQ,
+        handler=handle_claim,
+        **kwargs,
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(worker())
+    asyncio.run(create_worker().run())
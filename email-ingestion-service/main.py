@@ -1,22 +1,39 @@
 import asyncio
 import json
+import math
 import os
-import random
 import time
 from contextlib import asynccontextmanager
 
-import redis.asyncio as redis
 from dotenv import load_dotenv
-from fastapi import FastAPI, Form, UploadFile, File
+from fastapi import FastAPI, Form, HTTPException, Request, UploadFile, File
 from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from prometheus_client import start_http_server, Counter, Histogram, Gauge
 
-from common.storage import get_local_storage, LocalStorage
+from common.admission import AdmissionController, SpillDrainer
+from common.latency import latency_report
+from common.mock import mock_delay, mock_random
+from common.priority import choose_lane, lane_queue, lane_queues
+from common.queue_depth import QueueDepthSampler
+from common.queues import get_queue_backend
+from common.storage import (
+    ATTACHMENT_CHUNK_SIZE,
+    AttachmentTooLargeError,
+    get_local_storage,
+    LocalStorage,
+)
 from common.utils import get_logger, Queues
 
 load_dotenv()
 
 
+MAX_ATTACHMENT_SIZE = int(os.getenv("MAX_ATTACHMENT_SIZE_MB", 25)) * (1 << 20)
+# Allowance for the form fields and multipart framing around the attachment.
+MAX_FORM_OVERHEAD = 1 << 20
+
+
 EMAILS_INGESTED_TOTAL = Counter(
     "emails_ingested_total", "The total number of emails ingested."
 )
@@ -36,13 +53,103 @@ async def lifespan(app: FastAPI):
     start_http_server(int(prometheus_server_port))
     get_logger().info(f"Prometheus metrics started on port  {prometheus_server_port}")
 
+    sampler_task = asyncio.create_task(queue_depth_sampler.run())
+    spill_task = asyncio.create_task(spill_drainer.run())
+
     yield
 
+    sampler_task.cancel()
+    spill_task.cancel()
+    await asyncio.gather(sampler_task, spill_task, return_exceptions=True)
+    await get_queue_backend().close()
+
+
+class IngestionQueueDepthSampler(QueueDepthSampler):
+    async def sample(self) -> dict[str, int]:
+        depths = await super().sample()
+        INGESTION_QUEUE_LENGTH.set(
+            sum(
+                depths[queue]
+                for queue in lane_queues(Queues.EMAIL_INGESTION_QUEUE.value)
+            )
+        )
+        return depths
+
+
+queue_depth_sampler = IngestionQueueDepthSampler(get_queue_backend())
+admission_controller = AdmissionController(queue_depth_sampler)
+spill_drainer = SpillDrainer(get_queue_backend(), admission_controller)
 
 app = FastAPI(lifespan=lifespan)
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", 6379))
-)
+
+
+def attachment_too_large_response() -> JSONResponse:
+    return JSONResponse(
+        status_code=413,
+        content={
+            "message": f"Attachment exceeds the limit of {MAX_ATTACHMENT_SIZE} bytes."
+        },
+    )
+
+
+def overloaded_response(retry_after_s: float, reason: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(max(math.ceil(retry_after_s), 1))},
+        content={"message": f"Claim not accepted ({reason}), retry later."},
+    )
+
+
+class RequestSizeLimit:
+    # Rejects oversized uploads before the body is parsed, which spools the
+    # whole attachment to disk: from the Content-Length header right away, and
+    # for chunked uploads without one as soon as the bytes received pass the
+    # limit, without receiving the rest.
+
+    def __init__(self, app: ASGIApp, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if (
+            content_length is not None
+            and content_length.isdigit()
+            and int(content_length) > self.max_size
+        ):
+            await attachment_too_large_response()(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_within_limit() -> Message:
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            if received > self.max_size:
+                # Raised while the form is parsed and answered by
+                # `request_too_large`.
+                raise HTTPException(status_code=413)
+            return message
+
+        await self.app(scope, receive_within_limit, send)
+
+
+app.add_middleware(RequestSizeLimit, max_size=MAX_ATTACHMENT_SIZE + MAX_FORM_OVERHEAD)
+
+
+@app.exception_handler(413)
+async def request_too_large(request: Request, exc: HTTPException) -> JSONResponse:
+    return attachment_too_large_response()
+
+
+async def read_chunks(attachment: UploadFile):
+    while chunk := await attachment.read(ATTACHMENT_CHUNK_SIZE):
+        yield chunk
 
 
 @app.post("/ingest-email")
@@ -51,26 +158,82 @@ async def ingest_email(
     subject: str = Form(...),
     body: str = Form(...),
     attachment: UploadFile = File(...),
+    priority: str | None = Form(None),
 ):
     with EMAILS_INGESTION_LATENCY.time():
+        received_at = time.time()
         logger = get_logger()
 
         logger.info(f"INGESTION PIPELINE [EMAIL RECEIVED]: {sender} {subject}")
 
         local_storage: LocalStorage = get_local_storage()
-        pdf_contents = await attachment.read()
-
-        await asyncio.sleep(random.randint(1, 5))
-
-        claim_id = await local_storage.store(file_bytes=pdf_contents, extension="pdf")
-
-        metadata = {"claim_id": claim_id, "status": "ingested"}
 
-        await r.lpush(Queues.EMAIL_INGESTION_QUEUE.value, json.dumps(metadata))
-        logger.info(f"Email ingested and added to queue with ID {claim_id}")
+        if attachment.size is not None and attachment.size > MAX_ATTACHMENT_SIZE:
+            return attachment_too_large_response()
+
+        # The lane decides how urgently every stage picks the claim up.
+        lane = choose_lane(sender, priority)
+        # Overloaded submissions are turned away before anything is stored.
+        admission = admission_controller.admit(sender, lane)
+        if admission.decision == "rejected":
+            logger.warning(f"Rejected email from {sender} ({admission.reason}).")
+            return overloaded_response(admission.retry_after_s, admission.reason)
+
+        # The attachment is streamed to storage in chunks instead of being read
+        # into memory as a whole. A claim that is not stored gives its admission
+        # back, so it counts neither against the sender nor the backlog.
+        try:
+            await mock_delay(mock_random("email_ingestion", f"{sender}:{subject}"))
+            claim_id, content_hash = await local_storage.store_stream(
+                read_chunks(attachment), extension="pdf", max_size=MAX_ATTACHMENT_SIZE
+            )
+        except AttachmentTooLargeError:
+            admission_controller.cancel(admission)
+            return attachment_too_large_response()
+        except BaseException:
+            admission_controller.cancel(admission)
+            raise
+        admission_controller.confirm(admission)
+
+        metadata = {
+            "claim_id": claim_id,
+            "status": "ingested",
+            "lane": lane,
+            "content_hash": content_hash,
+            "ingested_at": received_at,
+            "enqueued_at": time.time(),
+        }
+
+        if admission.decision == "spilled":
+            # Accepted, but held back until the pipeline has room again.
+            metadata["spilled_at"] = metadata["enqueued_at"]
+            await get_queue_backend().push(
+                Queues.CLAIM_SPILL_QUEUE.value, json.dumps(metadata)
+            )
+            logger.info(f"Email ingested and spilled with ID {claim_id}")
+        else:
+            await get_queue_backend().push(
+                lane_queue(Queues.EMAIL_INGESTION_QUEUE.value, lane),
+                json.dumps(metadata),
+            )
+            logger.info(
+                f"Email ingested and added to the {lane} lane with ID {claim_id}"
+            )
 
         EMAILS_INGESTED_TOTAL.inc()
-        queue_length = await r.llen(Queues.EMAIL_INGESTION_QUEUE.value)
-        INGESTION_QUEUE_LENGTH.set(queue_length)
 
-        return JSONResponse(content={"message": "Email ingested", "claim_id": claim_id})
+        return JSONResponse(
+            status_code=202 if admission.decision == "spilled" else 200,
+            content={
+                "message": "Email ingested",
+                "claim_id": claim_id,
+                "status": admission.decision,
+            },
+        )
+
+
+@app.get("/latency-report")
+async def get_latency_report(window_s: float = 3600):
+    # p50/p95/p99 of end-to-end and per stage latency for claims completed in
+    # the last `window_s` seconds.
+    return JSONResponse(content=await latency_report(window_s))
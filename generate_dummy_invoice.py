@@ -1,52 +1,312 @@
-from datetime import datetime
+import random
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from functools import lru_cache
 from io import BytesIO
 
 from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer
 
+VAT_RATE = 0.19
 
-def generate_bicycle_insurance_invoice() -> BytesIO:
-    # Create the PDF document
+# Styles and table layouts do not depend on the invoice content, so they are
+# built once per process instead of on every invoice.
 
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=2 * cm, bottomMargin=2 * cm)
+FIELD_TABLE_STYLE = TableStyle(
+    [
+        ("FONTNAME", (0, 0), (0, -1), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 10),
+        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+    ]
+)
+
+HEADER_TABLE_STYLE = TableStyle(
+    [
+        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+        ("FONTNAME", (0, 0), (0, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (0, 0), 16),
+        ("FONTNAME", (0, 1), (0, 1), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 1), (0, 1), 12),
+        ("TEXTCOLOR", (0, 0), (0, 1), colors.darkblue),
+        ("ALIGN", (2, 0), (2, -1), "RIGHT"),
+        ("FONTSIZE", (2, 0), (2, -1), 10),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ]
+)
+
+INVOICE_TABLE_STYLE = TableStyle(
+    [
+        # Header styling
+        ("BACKGROUND", (0, 0), (-1, 0), colors.darkblue),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, 0), 10),
+        ("ALIGN", (0, 0), (-1, 0), "CENTER"),
+        # Data styling
+        ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+        ("FONTSIZE", (0, 1), (-1, -1), 10),
+        ("ALIGN", (0, 1), (0, -1), "CENTER"),  # Position column
+        ("ALIGN", (1, 1), (1, -1), "LEFT"),  # Description column
+        ("ALIGN", (2, 1), (-1, -1), "CENTER"),  # Quantity, Unit Price, Total
+        # Grid
+        ("GRID", (0, 0), (-1, -1), 1, colors.black),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+        ("TOPPADDING", (0, 0), (-1, -1), 6),
+    ]
+)
+
+TOTALS_TABLE_STYLE = TableStyle(
+    [
+        ("FONTNAME", (3, 0), (-1, -1), "Helvetica-Bold"),
+        ("FONTSIZE", (3, 0), (-1, -1), 10),
+        ("ALIGN", (3, 0), (-1, -1), "CENTER"),
+        ("LINEBELOW", (3, 0), (-1, 0), 1, colors.black),
+        ("LINEBELOW", (3, 1), (-1, 1), 1, colors.black),
+        ("LINEBELOW", (3, 2), (-1, 2), 2, colors.black),
+        ("BACKGROUND", (3, 2), (-1, 2), colors.lightgrey),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+        ("TOPPADDING", (0, 0), (-1, -1), 6),
+    ]
+)
+
+FOOTER_TABLE_STYLE = TableStyle(
+    [
+        ("FONTNAME", (0, 0), (0, 0), "Helvetica-Bold"),
+        ("FONTNAME", (2, 0), (2, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 10),
+        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+        ("VALIGN", (0, 0), (-1, -1), "BOTTOM"),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+    ]
+)
 
-    # Get sample styles and create custom styles
-    styles = getSampleStyleSheet()
+FIELD_COLUMN_WIDTHS = [5 * cm, 10 * cm]
+INVOICE_COLUMN_WIDTHS = [2 * cm, 6 * cm, 2 * cm, 3 * cm, 3 * cm]
 
-    # Custom styles
-    title_style = ParagraphStyle(
-        "CustomTitle",
-        parent=styles["Heading1"],
-        fontSize=18,
-        textColor=colors.darkblue,
-        spaceAfter=20,
-        alignment=TA_CENTER,
-    )
 
-    subtitle_style = ParagraphStyle(
-        "CustomSubtitle",
-        parent=styles["Heading2"],
-        fontSize=14,
-        textColor=colors.darkblue,
-        spaceAfter=12,
-        spaceBefore=15,
+@lru_cache
+def get_styles() -> dict[str, ParagraphStyle]:
+    styles = getSampleStyleSheet()
+    return {
+        "subtitle": ParagraphStyle(
+            "CustomSubtitle",
+            parent=styles["Heading2"],
+            fontSize=14,
+            textColor=colors.darkblue,
+            spaceAfter=12,
+            spaceBefore=15,
+        ),
+        "normal": ParagraphStyle(
+            "CustomNormal", parent=styles["Normal"], fontSize=10, spaceAfter=6
+        ),
+        "bold": ParagraphStyle(
+            "CustomBold",
+            parent=styles["Normal"],
+            fontSize=10,
+            spaceAfter=6,
+            fontName="Helvetica-Bold",
+        ),
+    }
+
+
+@dataclass
+class CostPosition:
+    description: str
+    quantity: int
+    unit_price: float
+
+    @property
+    def total(self) -> float:
+        return round(self.quantity * self.unit_price, 2)
+
+
+@dataclass
+class InvoiceFields:
+    # Defaults reproduce the original dummy invoice.
+    claim_id: str = "PDC-2024-0622-AB"
+    claim_date: date = field(default_factory=date.today)
+    policyholder_name: str = "Anna Becker"
+    policyholder_address: str = "Uhlandstraße 20, 80336 München"
+    policy_number: str = "BIKE-3421987"
+    repair_shop_name: str = "Fahrrad Wagner GmbH"
+    repair_shop_address: str = "Musterstraße 12, 10115 Berlin"
+    iban: str = "DE40 7001 1111 3456 7890 00"
+    bicycle_model: str = "Cube Nature Pro 2023"
+    serial_number: str = "CUBE9876543"
+    purchase_date: date = date(2023, 4, 1)
+    incident_date: date = date(2024, 6, 22)
+    damage_circumstances: str = (
+        "While parked outside work, a car reversed into my bike, bending the rear "
+        "wheel and breaking the rear derailleur. The frame and main mechanicals are "
+        "otherwise undamaged."
+    )
+    cost_positions: list[CostPosition] = field(
+        default_factory=lambda: [
+            CostPosition("Rear wheel replacement", 1, 110.00),
+            CostPosition("Rear derailleur, Shimano", 1, 65.00),
+            CostPosition("Labor (wheel install)", 1, 25.00),
+        ]
     )
 
-    normal_style = ParagraphStyle(
-        "CustomNormal", parent=styles["Normal"], fontSize=10, spaceAfter=6
+    @property
+    def subtotal(self) -> float:
+        return round(sum(position.total for position in self.cost_positions), 2)
+
+    @property
+    def vat(self) -> float:
+        return round(self.subtotal * VAT_RATE, 2)
+
+    @property
+    def total(self) -> float:
+        return round(self.subtotal + self.vat, 2)
+
+    def ground_truth(self) -> dict:
+        return {
+            "claim_id": self.claim_id,
+            "claim_date": self.claim_date.isoformat(),
+            "policyholder_name": self.policyholder_name,
+            "policyholder_address": self.policyholder_address,
+            "policy_number": self.policy_number,
+            "repair_shop_name": self.repair_shop_name,
+            "repair_shop_address": self.repair_shop_address,
+            "iban": self.iban,
+            "bicycle_model": self.bicycle_model,
+            "serial_number": self.serial_number,
+            "purchase_date": self.purchase_date.isoformat(),
+            "incident_date": self.incident_date.isoformat(),
+            "cost_positions": [
+                {
+                    "description": position.description,
+                    "quantity": position.quantity,
+                    "unit_price": position.unit_price,
+                    "total": position.total,
+                }
+                for position in self.cost_positions
+            ],
+            "subtotal": self.subtotal,
+            "vat": self.vat,
+            "total": self.total,
+        }
+
+
+FIRST_NAMES = ["Anna", "Lukas", "Mia", "Jonas", "Lea", "Felix", "Emma", "Paul"]
+LAST_NAMES = ["Becker", "Müller", "Schmidt", "Fischer", "Weber", "Wagner", "Hoffmann"]
+STREETS = ["Uhlandstraße", "Hauptstraße", "Bahnhofstraße", "Gartenweg", "Lindenallee"]
+CITIES = [
+    "80336 München",
+    "10115 Berlin",
+    "20095 Hamburg",
+    "50667 Köln",
+    "60311 Frankfurt am Main",
+    "70173 Stuttgart",
+]
+REPAIR_SHOPS = [
+    "Fahrrad Wagner GmbH",
+    "Radhaus Schulz",
+    "Velo Werkstatt Krause",
+    "Bike Service Neumann",
+]
+BICYCLES = [
+    ("Cube", "Nature Pro"),
+    ("Canyon", "Roadlite 6"),
+    ("Riese & Müller", "Charger4"),
+    ("Gazelle", "Ultimate C380"),
+    ("Specialized", "Sirrus X 4.0"),
+]
+PARTS = [
+    ("Rear wheel replacement", 80, 180),
+    ("Front wheel replacement", 70, 160),
+    ("Rear derailleur, Shimano", 45, 120),
+    ("Brake disc", 20, 60),
+    ("Chain and cassette", 40, 110),
+    ("Handlebar", 30, 90),
+    ("Saddle", 25, 80),
+    ("Inner tube", 5, 15),
+]
+DAMAGE_CIRCUMSTANCES = [
+    "While parked outside work, a car reversed into my bike, damaging several parts. The frame is otherwise undamaged.",
+    "I fell on a wet road surface and the bike hit the curb. The listed parts were damaged in the fall.",
+    "The bike was knocked over by a delivery van while locked at a bike stand.",
+]
+
+
+def random_invoice_fields(rng: random.Random) -> InvoiceFields:
+    incident_date = date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+    purchase_date = incident_date - timedelta(days=rng.randrange(30, 1500))
+    manufacturer, model = rng.choice(BICYCLES)
+
+    cost_positions = [
+        CostPosition(
+            description,
+            rng.randint(1, 2),
+            round(rng.uniform(low, high), 2),
+        )
+        for description, low, high in rng.sample(PARTS, rng.randint(1, 4))
+    ]
+    cost_positions.append(CostPosition("Labor", 1, float(rng.choice([25, 35, 45, 60]))))
+
+    return InvoiceFields(
+        claim_id=(
+            f"PDC-{incident_date:%Y-%m%d}-"
+            f"{rng.choice('ABCDEFGHJKLMNPRSTUVWXYZ')}{rng.choice('ABCDEFGHJKLMNPRSTUVWXYZ')}"
+        ),
+        claim_date=incident_date + timedelta(days=rng.randrange(1, 30)),
+        policyholder_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        policyholder_address=(
+            f"{rng.choice(STREETS)} {rng.randint(1, 120)}, {rng.choice(CITIES)}"
+        ),
+        policy_number=f"BIKE-{rng.randrange(10**7):07d}",
+        repair_shop_name=rng.choice(REPAIR_SHOPS),
+        repair_shop_address=(
+            f"{rng.choice(STREETS)} {rng.randint(1, 120)}, {rng.choice(CITIES)}"
+        ),
+        iban=(
+            f"DE{rng.randrange(100):02d} "
+            + " ".join(f"{rng.randrange(10**4):04d}" for _ in range(4))
+            + f" {rng.randrange(100):02d}"
+        ),
+        bicycle_model=f"{manufacturer} {model} {purchase_date.year}",
+        serial_number=(
+            f"{manufacturer.split()[0].upper()[:4]}{rng.randrange(10**7):07d}"
+        ),
+        purchase_date=purchase_date,
+        incident_date=incident_date,
+        damage_circumstances=rng.choice(DAMAGE_CIRCUMSTANCES),
+        cost_positions=cost_positions,
     )
 
-    bold_style = ParagraphStyle(
-        "CustomBold",
-        parent=styles["Normal"],
-        fontSize=10,
-        spaceAfter=6,
-        fontName="Helvetica-Bold",
+
+def _euro(amount: float) -> str:
+    return f"{amount:.2f}€"
+
+
+def _field_table(rows: list[list]) -> Table:
+    table = Table(rows, colWidths=FIELD_COLUMN_WIDTHS)
+    table.setStyle(FIELD_TABLE_STYLE)
+    return table
+
+
+def render_invoice(fields: InvoiceFields) -> bytes:
+    styles = get_styles()
+    subtitle_style = styles["subtitle"]
+    normal_style = styles["normal"]
+    bold_style = styles["bold"]
+
+    # `invariant` leaves out the creation time and random document id, so the
+    # same fields always render to the same bytes and content hash.
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        topMargin=2 * cm,
+        bottomMargin=2 * cm,
+        invariant=True,
     )
 
     # Story elements
@@ -57,27 +317,13 @@ def generate_bicycle_insurance_invoice() -> BytesIO:
         [
             "BICYCLE INSURANCE CLAIM",
             "",
-            "Claim Date: " + datetime.now().strftime("%d.%m.%Y"),
+            "Claim Date: " + fields.claim_date.strftime("%d.%m.%Y"),
         ],
-        ["Partial Damage Claim Invoice", "", "Claim ID: PDC-2024-0622-AB"],
+        ["Partial Damage Claim Invoice", "", f"Claim ID: {fields.claim_id}"],
     ]
 
     header_table = Table(header_data, colWidths=[8 * cm, 4 * cm, 6 * cm])
-    header_table.setStyle(
-        TableStyle(
-            [
-                ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                ("FONTNAME", (0, 0), (0, 0), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (0, 0), 16),
-                ("FONTNAME", (0, 1), (0, 1), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 1), (0, 1), 12),
-                ("TEXTCOLOR", (0, 0), (0, 1), colors.darkblue),
-                ("ALIGN", (2, 0), (2, -1), "RIGHT"),
-                ("FONTSIZE", (2, 0), (2, -1), 10),
-                ("VALIGN", (0, 0), (-1, -1), "TOP"),
-            ]
-        )
-    )
+    header_table.setStyle(HEADER_TABLE_STYLE)
 
     story.append(header_table)
     story.append(Spacer(1, 20))
@@ -93,124 +339,73 @@ def generate_bicycle_insurance_invoice() -> BytesIO:
 
     # 1 - Policyholder Information
     story.append(Paragraph("Policyholder Information", subtitle_style))
-
-    policyholder_data = [
-        ["Name:", "Anna Becker"],
-        ["Address:", "Uhlandstraße 20, 80336 München"],
-        ["Insurance Policy Number:", "BIKE-3421987"],
-    ]
-
-    policyholder_table = Table(policyholder_data, colWidths=[5 * cm, 10 * cm])
-    policyholder_table.setStyle(
-        TableStyle(
+    story.append(
+        _field_table(
             [
-                ("FONTNAME", (0, 0), (0, -1), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, -1), 10),
-                ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                ("VALIGN", (0, 0), (-1, -1), "TOP"),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+                ["Name:", fields.policyholder_name],
+                ["Address:", fields.policyholder_address],
+                ["Insurance Policy Number:", fields.policy_number],
             ]
         )
     )
-
-    story.append(policyholder_table)
     story.append(Spacer(1, 15))
 
     # 2 - Insurer Information
     story.append(Paragraph("Insurer / Repair Shop Information", subtitle_style))
-
-    insurer_data = [
-        ["Name:", "Fahrrad Wagner GmbH"],
-        ["Address:", "Musterstraße 12, 10115 Berlin"],
-        ["IBAN:", "DE40 7001 1111 3456 7890 00"],
-    ]
-
-    insurer_table = Table(insurer_data, colWidths=[5 * cm, 10 * cm])
-    insurer_table.setStyle(
-        TableStyle(
+    story.append(
+        _field_table(
             [
-                ("FONTNAME", (0, 0), (0, -1), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, -1), 10),
-                ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                ("VALIGN", (0, 0), (-1, -1), "TOP"),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+                ["Name:", fields.repair_shop_name],
+                ["Address:", fields.repair_shop_address],
+                ["IBAN:", fields.iban],
             ]
         )
     )
-
-    story.append(insurer_table)
     story.append(Spacer(1, 15))
 
     # 3 - Bicycle Details
     story.append(Paragraph("Bicycle Details", subtitle_style))
-
-    bicycle_data = [
-        ["Manufacturer & Model:", "Cube Nature Pro 2023"],
-        ["Serial Number:", "CUBE9876543"],
-        ["Date of Purchase:", "01.04.2023"],
-    ]
-
-    bicycle_table = Table(bicycle_data, colWidths=[5 * cm, 10 * cm])
-    bicycle_table.setStyle(
-        TableStyle(
+    story.append(
+        _field_table(
             [
-                ("FONTNAME", (0, 0), (0, -1), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, -1), 10),
-                ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                ("VALIGN", (0, 0), (-1, -1), "TOP"),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+                ["Manufacturer & Model:", fields.bicycle_model],
+                ["Serial Number:", fields.serial_number],
+                ["Date of Purchase:", fields.purchase_date.strftime("%d.%m.%Y")],
             ]
         )
     )
-
-    story.append(bicycle_table)
     story.append(Spacer(1, 15))
 
     # 4 - Incident Description
     story.append(Paragraph("Incident Description", subtitle_style))
-
-    incident_date_label = Paragraph("<b>Incident Date:</b>", normal_style)
-    incident_date_value = Paragraph("22.06.2024", normal_style)
-
-    damage_circumstances_label = Paragraph("<b>Damage Circumstances:</b>", normal_style)
-    damage_circumstances_value = Paragraph(
-        "While parked outside work, a car reversed into my bike, bending the rear wheel and breaking the rear derailleur. The frame and main mechanicals are otherwise undamaged.",
-        normal_style,
-    )
-
-    police_report_label = Paragraph("<b>Police Report:</b>", normal_style)
-    police_report_value = Paragraph(
-        "Not required, as this was accidental damage and not vandalism or theft.",
-        normal_style,
-    )
-
-    incident_data = [
-        [incident_date_label, incident_date_value],
-        [damage_circumstances_label, damage_circumstances_value],
-        [police_report_label, police_report_value],
-    ]
-
-    incident_table = Table(incident_data, colWidths=[5 * cm, 10 * cm])
-    incident_table.setStyle(
-        TableStyle(
+    story.append(
+        _field_table(
             [
-                ("FONTNAME", (0, 0), (0, -1), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, -1), 10),
-                ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                ("VALIGN", (0, 0), (-1, -1), "TOP"),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+                [
+                    Paragraph("<b>Incident Date:</b>", normal_style),
+                    Paragraph(fields.incident_date.strftime("%d.%m.%Y"), normal_style),
+                ],
+                [
+                    Paragraph("<b>Damage Circumstances:</b>", normal_style),
+                    Paragraph(fields.damage_circumstances, normal_style),
+                ],
+                [
+                    Paragraph("<b>Police Report:</b>", normal_style),
+                    Paragraph(
+                        "Not required, as this was accidental damage and not vandalism or theft.",
+                        normal_style,
+                    ),
+                ],
             ]
         )
     )
-
-    story.append(incident_table)
     story.append(Spacer(1, 15))
 
     # 5 - Documentation Provided
     story.append(Paragraph("Documentation Provided", subtitle_style))
 
     additional_docs = [
-        "• Photos of damage (rear wheel, broken derailleur)",
+        "• Photos of damage",
         "• Workshop assessment and repair estimate",
         "• Original purchase receipt (for proof of value)",
         "• Completed claim form",
@@ -224,74 +419,35 @@ def generate_bicycle_insurance_invoice() -> BytesIO:
     # 6 - Repair Invoice
     story.append(Paragraph("Repair Invoice", subtitle_style))
 
-    # Invoice table header
     invoice_header = [["Position", "Description", "Quantity", "Unit Price", "Total"]]
-
-    # Invoice data
     invoice_data = [
-        ["1", "Rear wheel replacement", "1", "110.00€", "110.00€"],
-        ["2", "Rear derailleur, Shimano", "1", "65.00€", "65.00€"],
-        ["3", "Labor (wheel install)", "1", "25.00€", "25.00€"],
+        [
+            str(i),
+            position.description,
+            str(position.quantity),
+            _euro(position.unit_price),
+            _euro(position.total),
+        ]
+        for i, position in enumerate(fields.cost_positions, start=1)
     ]
 
-    # Combine header and data
-    full_invoice_data = invoice_header + invoice_data
-
     invoice_table = Table(
-        full_invoice_data, colWidths=[2 * cm, 6 * cm, 2 * cm, 3 * cm, 3 * cm]
-    )
-    invoice_table.setStyle(
-        TableStyle(
-            [
-                # Header styling
-                ("BACKGROUND", (0, 0), (-1, 0), colors.darkblue),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, 0), 10),
-                ("ALIGN", (0, 0), (-1, 0), "CENTER"),
-                # Data styling
-                ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
-                ("FONTSIZE", (0, 1), (-1, -1), 10),
-                ("ALIGN", (0, 1), (0, -1), "CENTER"),  # Position column
-                ("ALIGN", (1, 1), (1, -1), "LEFT"),  # Description column
-                ("ALIGN", (2, 1), (-1, -1), "CENTER"),  # Quantity, Unit Price, Total
-                # Grid
-                ("GRID", (0, 0), (-1, -1), 1, colors.black),
-                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-                ("TOPPADDING", (0, 0), (-1, -1), 6),
-            ]
-        )
+        invoice_header + invoice_data, colWidths=INVOICE_COLUMN_WIDTHS
     )
+    invoice_table.setStyle(INVOICE_TABLE_STYLE)
 
     story.append(invoice_table)
     story.append(Spacer(1, 10))
 
     # Totals table
     totals_data = [
-        ["", "", "", "Subtotal", "200.00€"],
-        ["", "", "", "VAT 19%", "38.00€"],
-        ["", "", "", "Total (Gross)", "238.00€"],
+        ["", "", "", "Subtotal", _euro(fields.subtotal)],
+        ["", "", "", f"VAT {VAT_RATE:.0%}", _euro(fields.vat)],
+        ["", "", "", "Total (Gross)", _euro(fields.total)],
     ]
 
-    totals_table = Table(
-        totals_data, colWidths=[2 * cm, 6 * cm, 2 * cm, 3 * cm, 3 * cm]
-    )
-    totals_table.setStyle(
-        TableStyle(
-            [
-                ("FONTNAME", (3, 0), (-1, -1), "Helvetica-Bold"),
-                ("FONTSIZE", (3, 0), (-1, -1), 10),
-                ("ALIGN", (3, 0), (-1, -1), "CENTER"),
-                ("LINEBELOW", (3, 0), (-1, 0), 1, colors.black),
-                ("LINEBELOW", (3, 1), (-1, 1), 1, colors.black),
-                ("LINEBELOW", (3, 2), (-1, 2), 2, colors.black),
-                ("BACKGROUND", (3, 2), (-1, 2), colors.lightgrey),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-                ("TOPPADDING", (0, 0), (-1, -1), 6),
-            ]
-        )
-    )
+    totals_table = Table(totals_data, colWidths=INVOICE_COLUMN_WIDTHS)
+    totals_table.setStyle(TOTALS_TABLE_STYLE)
 
     story.append(totals_table)
     story.append(Spacer(1, 15))
@@ -308,39 +464,25 @@ def generate_bicycle_insurance_invoice() -> BytesIO:
     footer_data = [
         ["Policyholder Signature:", "_" * 30, "Date:", "_" * 15],
         ["", "", "", ""],
-        ["Anna Becker", "", datetime.now().strftime("%d.%m.%Y"), ""],
+        [fields.policyholder_name, "", fields.claim_date.strftime("%d.%m.%Y"), ""],
     ]
 
     footer_table = Table(footer_data, colWidths=[4 * cm, 6 * cm, 2 * cm, 4 * cm])
-    footer_table.setStyle(
-        TableStyle(
-            [
-                ("FONTNAME", (0, 0), (0, 0), "Helvetica-Bold"),
-                ("FONTNAME", (2, 0), (2, 0), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, -1), 10),
-                ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                ("VALIGN", (0, 0), (-1, -1), "BOTTOM"),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-            ]
-        )
-    )
+    footer_table.setStyle(FOOTER_TABLE_STYLE)
 
     story.append(footer_table)
 
     # Build the PDF
     doc.build(story)
 
-    buffer.seek(0)
     pdf_bytes = buffer.getvalue()
     buffer.close()
 
-    print("PDF invoice created successfully in memory")
+    return pdf_bytes
 
-    with open("test.pdf", "wb") as f:
-        f.write(pdf_bytes)
-    print(f"PDF saved to {len(pdf_bytes)}")
 
-    return pdf_bytes
+def generate_bicycle_insurance_invoice() -> bytes:
+    return render_invoice(InvoiceFields())
 
 
 def generate_and_save_invoice_to_file(
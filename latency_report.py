@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import json
+
+from dotenv import load_dotenv
+
+from common.latency import latency_report
+
+load_dotenv()
+
+
+def print_report(report: dict):
+    end_to_end = report["end_to_end"]
+    print(
+        f"{report['claims']} claims completed in the last {report['window_s']:.0f}s {report['outcomes']}"
+    )
+    if not end_to_end["count"]:
+        return
+
+    print(
+        f"{'end-to-end':<28}{end_to_end['p50']:>10.2f}{end_to_end['p95']:>10.2f}{end_to_end['p99']:>10.2f}"
+    )
+    print(f"{'stage':<28}{'p50':>10}{'p95':>10}{'p99':>10}{'share':>10}")
+    for stage, summary in report["stages"].items():
+        for kind in ("queue_wait", "processing"):
+            stats = summary[kind]
+            if not stats["count"]:
+                continue
+            share = (
+                f"{summary['share_of_end_to_end']:>10.1%}"
+                if kind == "processing"
+                else ""
+            )
+            print(
+                f"{stage + ' ' + kind:<28}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}{share}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report end-to-end and per stage latency percentiles of completed claims."
+    )
+
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=3600,
+        help="Time window in seconds, ending now.",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the raw report as JSON."
+    )
+
+    args = parser.parse_args()
+
+    report = asyncio.run(latency_report(args.window))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
@@ -0,0 +1,467 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+
+from common.latency import get_latency_store, LatencyStore, percentiles
+from common.utils import get_logger
+from generate_dummy_invoice import generate_bicycle_insurance_invoice
+
+load_dotenv()
+
+
+@dataclass
+class Segment:
+    # Claims per second at the end of the segment.
+    rate: float
+    duration_s: float
+    # Ramp linearly from the previous segment's rate instead of stepping.
+    ramp: bool = False
+
+
+@dataclass
+class ClaimResult:
+    index: int
+    scheduled_at: float
+    sent_at: float | None = None
+    responded_at: float | None = None
+    status_code: int | None = None
+    claim_id: str | None = None
+    error: str | None = None
+    outcome: str | None = None
+    completed_at: float | None = None
+    lane: str | None = None
+
+
+def parse_priority_mix(spec: str) -> dict[str, float]:
+    # "expedited=0.1,bulk=0.3" sends those shares with an explicit priority;
+    # the remaining claims go without one and land in the default lane.
+    mix = {}
+    for item in spec.split(","):
+        lane, share = item.strip().split("=")
+        mix[lane.strip()] = float(share)
+    if sum(mix.values()) > 1:
+        raise ValueError(f"Priority shares in {spec!r} add up to more than 1.")
+    return mix
+
+
+def assign_lanes(
+    num_claims: int, mix: dict[str, float], rng: random.Random
+) -> list[str | None]:
+    lanes = []
+    for _ in range(num_claims):
+        draw, lane = rng.random(), None
+        for candidate, share in mix.items():
+            if draw < share:
+                lane = candidate
+                break
+            draw -= share
+        lanes.append(lane)
+    return lanes
+
+
+def parse_profile(stages: list[str]) -> list[Segment]:
+    # "RATE:SECONDS" holds RATE claims/s for SECONDS, "RATE:SECONDS:ramp" ramps
+    # linearly from the previous rate to RATE, e.g. 0:0 50:60:ramp 50:300.
+    profile = []
+    for stage in stages:
+        rate, duration_s, *mode = stage.split(":")
+        profile.append(
+            Segment(
+                rate=float(rate),
+                duration_s=float(duration_s),
+                ramp=mode == ["ramp"],
+            )
+        )
+    return profile
+
+
+def arrival_offsets(
+    profile: list[Segment],
+    num_claims: int | None,
+    poisson: bool,
+    rng: random.Random,
+) -> list[float]:
+    # Intended send times relative to the start of the run. The k-th claim is
+    # sent when the integrated rate of the profile reaches k, or, for Poisson
+    # arrivals, the sum of k unit exponential draws. Within a segment the rate
+    # is linear, so the integral is inverted with the quadratic formula.
+    offsets = []
+    target = rng.expovariate(1) if poisson else 0.0
+    segment_start = 0.0
+    arrivals_before = 0.0
+    previous_rate = 0.0
+
+    for segment in profile:
+        start_rate = previous_rate if segment.ramp else segment.rate
+        slope = (
+            (segment.rate - start_rate) / segment.duration_s
+            if segment.duration_s
+            else 0
+        )
+        segment_arrivals = (start_rate + segment.rate) / 2 * segment.duration_s
+
+        while (
+            segment_arrivals > 0
+            and target <= arrivals_before + segment_arrivals
+            and (num_claims is None or len(offsets) < num_claims)
+        ):
+            remaining = target - arrivals_before
+            if slope == 0:
+                elapsed = remaining / start_rate
+            else:
+                elapsed = (
+                    -start_rate
+                    + math.sqrt(max(start_rate**2 + 2 * slope * remaining, 0))
+                ) / slope
+            offsets.append(segment_start + elapsed)
+            target += rng.expovariate(1) if poisson else 1
+
+        arrivals_before += segment_arrivals
+        segment_start += segment.duration_s
+        previous_rate = segment.rate
+
+    return offsets
+
+
+class LoadGenerator:
+    # Open-loop load: claims are sent at their scheduled time whether or not
+    # earlier requests have returned, so a slow service does not lower the
+    # offered rate. At most `concurrency` requests are in flight; claims
+    # waiting for a slot count towards their ingest latency, which is measured
+    # from the scheduled time.
+
+    def __init__(
+        self,
+        url: str,
+        concurrency: int,
+        seed: int | None,
+        request_timeout: float,
+        corpus_dir: str | None = None,
+        senders: int = 1,
+    ):
+        self.url = url
+        # Claims are spread over several senders so the per-sender rate limit
+        # of the ingestion service does not cap the offered load.
+        self.senders = senders
+        self.concurrency = concurrency
+        self.seed = seed
+        self.request_timeout = request_timeout
+        self.logger = get_logger()
+        if corpus_dir:
+            # A corpus from build_invoice_corpus.py, loaded up front so reading
+            # files does not compete with sending.
+            self._documents = [
+                path.read_bytes() for path in sorted(Path(corpus_dir).glob("*.pdf"))
+            ]
+        else:
+            self._documents = [generate_bicycle_insurance_invoice()]
+
+    def document(self, index: int) -> bytes:
+        # Corpus documents are sent unchanged on the first pass. Beyond that, a
+        # PDF comment after the end of the file makes every attachment unique
+        # without regenerating it, so the content-hash caches do not turn the
+        # load test into cache hits. The suffix only depends on the seed and the
+        # index, so seeded runs send the same documents every time.
+        document = self._documents[index % len(self._documents)]
+        if len(self._documents) > 1 and index < len(self._documents):
+            return document
+        return document + f"\n% load-test {self.seed} {index}\n".encode()
+
+    async def _send(
+        self,
+        client: httpx.AsyncClient,
+        slots: asyncio.Semaphore,
+        result: ClaimResult,
+    ):
+        async with slots:
+            result.sent_at = time.time()
+            payload = {
+                "sender": f"load-test-{result.index % self.senders}@bicycle_dealer.com",
+                "subject": f"Load test claim {result.index}",
+                "body": "Dummy text",
+            }
+            if result.lane is not None:
+                payload["priority"] = result.lane
+            files = {
+                "attachment": (
+                    f"claim_{result.index}.pdf",
+                    self.document(result.index),
+                    "application/pdf",
+                )
+            }
+            try:
+                response = await client.post(self.url, data=payload, files=files)
+                result.status_code = response.status_code
+                if response.is_success:
+                    result.claim_id = response.json().get("claim_id")
+            except httpx.HTTPError as e:
+                result.error = repr(e)
+            result.responded_at = time.time()
+
+    async def run(
+        self, offsets: list[float], lanes: list[str | None] | None = None
+    ) -> list[ClaimResult]:
+        start = time.time()
+        slots = asyncio.Semaphore(self.concurrency)
+        lanes = lanes or [None] * len(offsets)
+        results = [
+            ClaimResult(index=index, scheduled_at=start + offset, lane=lane)
+            for index, (offset, lane) in enumerate(zip(offsets, lanes))
+        ]
+
+        limits = httpx.Limits(max_connections=self.concurrency)
+        async with httpx.AsyncClient(
+            limits=limits, timeout=self.request_timeout
+        ) as client:
+            tasks = []
+            for result in results:
+                delay = result.scheduled_at - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self._send(client, slots, result)))
+                if result.index and result.index % 1000 == 0:
+                    self.logger.info(f"Scheduled {result.index}/{len(results)} claims.")
+            await asyncio.gather(*tasks)
+
+        return results
+
+
+async def wait_for_completion(
+    results: list[ClaimResult],
+    store: LatencyStore,
+    timeout: float,
+    interval: float = 2,
+):
+    # Completed claims are recorded by the last stage in the latency store,
+    # see common/worker.py. Claims that end in a dead-letter queue never show
+    # up there and are reported as unfinished.
+    pending = {result.claim_id: result for result in results if result.claim_id}
+    since = min((result.scheduled_at for result in results), default=time.time())
+    deadline = time.monotonic() + timeout
+
+    while pending and time.monotonic() < deadline:
+        for record in await store.fetch(since, time.time()):
+            result = pending.pop(record["claim_id"], None)
+            if result is not None:
+                result.outcome = record["outcome"]
+                result.completed_at = record["completed_at"]
+                result.lane = record.get("lane", result.lane)
+        if pending:
+            await asyncio.sleep(interval)
+
+
+def build_report(results: list[ClaimResult]) -> dict:
+    sent = [result for result in results if result.responded_at is not None]
+    accepted = [result for result in sent if result.claim_id]
+    completed = [result for result in accepted if result.completed_at is not None]
+
+    status_codes = {}
+    for result in sent:
+        key = str(result.status_code) if result.error is None else "error"
+        status_codes[key] = status_codes.get(key, 0) + 1
+
+    outcomes = {}
+    for result in completed:
+        outcomes[result.outcome] = outcomes.get(result.outcome, 0) + 1
+
+    first_scheduled = min((r.scheduled_at for r in results), default=0)
+    last_scheduled = max((r.scheduled_at for r in results), default=0)
+    last_response = max((r.responded_at for r in sent), default=first_scheduled)
+
+    report = {
+        "claims": len(results),
+        "status_codes": status_codes,
+        # Rate the schedule asked for and the rate at which the service
+        # accepted claims over the whole send phase.
+        "offered_rate": (
+            len(results) / (last_scheduled - first_scheduled)
+            if last_scheduled > first_scheduled
+            else None
+        ),
+        "ingest_throughput": (
+            len(accepted) / (last_response - first_scheduled)
+            if last_response > first_scheduled
+            else None
+        ),
+        # From the scheduled send time, including time spent waiting for a
+        # free connection, and from the actual send time.
+        "ingest_latency": percentiles([r.responded_at - r.scheduled_at for r in sent]),
+        "ingest_service_time": percentiles([r.responded_at - r.sent_at for r in sent]),
+        "completed": len(completed),
+        "unfinished": len(accepted) - len(completed),
+        "outcomes": outcomes,
+        "time_to_final_queue": percentiles(
+            [r.completed_at - r.scheduled_at for r in completed]
+        ),
+    }
+
+    lanes = sorted({r.lane for r in completed if r.lane is not None})
+    if lanes:
+        report["lanes"] = {
+            lane: {
+                "completed": len([r for r in completed if r.lane == lane]),
+                "time_to_final_queue": percentiles(
+                    [
+                        r.completed_at - r.scheduled_at
+                        for r in completed
+                        if r.lane == lane
+                    ]
+                ),
+            }
+            for lane in lanes
+        }
+
+    if len(completed) > 1:
+        completions = sorted(r.completed_at for r in completed)
+        # Completions per second between the first and the last completed claim.
+        report["sustained_throughput"] = (len(completions) - 1) / (
+            completions[-1] - completions[0]
+        )
+
+    return report
+
+
+def write_claims(results: list[ClaimResult], path: str):
+    with open(path, "w") as f:
+        for result in results:
+            row = {
+                "index": result.index,
+                "claim_id": result.claim_id,
+                "status_code": result.status_code,
+                "error": result.error,
+                "ingest_latency": (
+                    result.responded_at - result.scheduled_at
+                    if result.responded_at
+                    else None
+                ),
+                "outcome": result.outcome,
+                "lane": result.lane,
+                "time_to_final_queue": (
+                    result.completed_at - result.scheduled_at
+                    if result.completed_at
+                    else None
+                ),
+            }
+            f.write(json.dumps(row) + "\n")
+
+
+async def main(args):
+    if args.profile:
+        profile = parse_profile(args.profile)
+    else:
+        profile = [Segment(rate=args.rate, duration_s=args.num_claims / args.rate)]
+
+    rng = random.Random(args.seed)
+    offsets = arrival_offsets(profile, args.num_claims, args.poisson, rng)
+    lanes = (
+        assign_lanes(len(offsets), parse_priority_mix(args.priority_mix), rng)
+        if args.priority_mix
+        else None
+    )
+
+    generator = LoadGenerator(
+        url=args.url,
+        concurrency=args.concurrency,
+        seed=args.seed,
+        request_timeout=args.request_timeout,
+        corpus_dir=args.corpus_dir,
+        senders=args.senders,
+    )
+    get_logger().info(
+        f"Sending {len(offsets)} claims over {offsets[-1] if offsets else 0:.1f}s."
+    )
+    results = await generator.run(offsets, lanes)
+
+    if args.drain_timeout > 0:
+        await wait_for_completion(results, get_latency_store(), args.drain_timeout)
+
+    if args.output:
+        write_claims(results, args.output)
+
+    print(json.dumps(build_report(results), indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Send claims to the email ingestion service at a target rate and report ingest latency, throughput and time to the final queue."
+    )
+
+    parser.add_argument("--url", type=str, default=os.getenv("EMAIL_INGEST_URL"))
+    parser.add_argument(
+        "--num_claims",
+        type=int,
+        default=None,
+        help="Number of claims to send. Defaults to the whole profile.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=10,
+        help="Constant claims per second, used without --profile.",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="+",
+        default=None,
+        help="Rate segments RATE:SECONDS or RATE:SECONDS:ramp, e.g. 0:0 50:60:ramp 50:300.",
+    )
+    parser.add_argument(
+        "--poisson",
+        action="store_true",
+        help="Exponential inter-arrival times instead of evenly spaced claims.",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=100, help="Maximum requests in flight."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for arrivals and documents. Set MOCK_SEED on the services for deterministic stage latencies and outcomes.",
+    )
+    parser.add_argument(
+        "--corpus_dir",
+        type=str,
+        default=None,
+        help="Send PDFs generated by build_invoice_corpus.py instead of the dummy invoice.",
+    )
+    parser.add_argument(
+        "--priority_mix",
+        type=str,
+        default=None,
+        help="Shares of claims sent with an explicit priority, e.g. expedited=0.1,bulk=0.3.",
+    )
+    parser.add_argument(
+        "--senders",
+        type=int,
+        default=100,
+        help="Number of distinct sender addresses the claims are spread over.",
+    )
+    parser.add_argument("--request_timeout", type=float, default=60)
+    parser.add_argument(
+        "--drain_timeout",
+        type=float,
+        default=600,
+        help="Seconds to wait for sent claims to reach a final queue, 0 to skip.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="JSON lines file with per claim results.",
+    )
+
+    args = parser.parse_args()
+    if args.profile is None and args.num_claims is None:
+        parser.error("--num_claims is required without --profile.")
+
+    asyncio.run(main(args))
@@ -1,68 +1,180 @@
 import asyncio
-import json
+import multiprocessing
 import os
-import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 
-import pymupdf
-import redis.asyncio as redis
+from anyio import to_thread
 from dotenv import load_dotenv
-
+from prometheus_client import Gauge
+
+from common.cache import get_stage_cache
+from common.mock import mock_delay, mock_random
+from common.pdf_text import (
+    count_pages,
+    extract_pages,
+    page_index_path,
+    write_page_index,
+)
 from common.storage import get_local_storage
 from common.utils import get_logger, Queues
+from common.worker import Route, StageWorker
 
 load_dotenv()
 
 
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", 6379))
+logger = get_logger()
+
+OCR_PROCESS_POOL_SIZE = int(os.getenv("OCR_PROCESS_POOL_SIZE", os.cpu_count() or 1))
+# Upper bound on page ranges handed to the pool at once. Work beyond it waits on
+# the event loop instead of piling up in the pool's internal queue.
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", OCR_PROCESS_POOL_SIZE))
+OCR_PAGES_PER_TASK = int(os.getenv("OCR_PAGES_PER_TASK", 4))
+OCR_PAGE_WINDOW = int(os.getenv("OCR_PAGE_WINDOW", 2 * OCR_MAX_CONCURRENCY))
+
+OCR_POOL_SIZE = Gauge("ocr_pool_size", "Number of processes in the OCR pool.")
+OCR_POOL_BUSY = Gauge(
+    "ocr_pool_busy", "Number of page ranges currently being processed by the OCR pool."
+)
+OCR_POOL_WAITING = Gauge(
+    "ocr_pool_waiting", "Number of page ranges waiting for a free OCR pool slot."
 )
 
-logger = get_logger()
-MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
 
+@lru_cache
+def get_ocr_pool() -> ProcessPoolExecutor:
+    OCR_POOL_SIZE.set(OCR_PROCESS_POOL_SIZE)
+    return ProcessPoolExecutor(
+        max_workers=OCR_PROCESS_POOL_SIZE,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
 
-async def perform_ocr(claim_id: str):
+
+@lru_cache
+def get_ocr_slots() -> asyncio.Semaphore:
+    return asyncio.Semaphore(OCR_MAX_CONCURRENCY)
+
+
+async def _extract_pages(document_path: str, start: int, stop: int) -> list[str]:
+    slots = get_ocr_slots()
+    with OCR_POOL_WAITING.track_inprogress():
+        await slots.acquire()
+    try:
+        with OCR_POOL_BUSY.track_inprogress():
+            return await asyncio.get_running_loop().run_in_executor(
+                get_ocr_pool(), extract_pages, document_path, start, stop
+            )
+    finally:
+        slots.release()
+
+
+async def perform_ocr(claim_id: str, content_hash: str | None = None):
     # This function mocks the OCR step
     # Models like Tesseract, EasyOCR can be used
 
     claim_document_dir = get_local_storage().file_path(claim_id)
-    document_path = claim_document_dir / f"{claim_id.lower()}.pdf"
-
-    document = pymupdf.open(document_path)
-    doc_text = "\n".join([page.get_text() for page in document])
+    document_path = str(claim_document_dir / f"{claim_id.lower()}.pdf")
     dummy_ocr_file = claim_document_dir / f"{claim_id.lower()}.txt"
+    partial_ocr_file = dummy_ocr_file.with_suffix(".txt.part")
+
+    ocr_files = {
+        "ocr.txt": dummy_ocr_file,
+        "ocr.pages.json": page_index_path(dummy_ocr_file),
+    }
+    if await get_stage_cache().get_files(content_hash, "ocr", ocr_files):
+        logger.info(f"[{claim_id}] reused OCR output of an identical attachment.")
+        return
+
+    page_count = await asyncio.get_running_loop().run_in_executor(
+        get_ocr_pool(), count_pages, document_path
+    )
+    page_ranges = [
+        (start, min(start + OCR_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, OCR_PAGES_PER_TASK)
+    ]
+
+    # Page ranges are extracted in parallel in the process pool and written to
+    # disk in page order as they complete. At most OCR_PAGE_WINDOW ranges are in
+    # flight per document, which bounds memory regardless of the page count.
+    in_flight: deque[asyncio.Task] = deque()
+    offsets: list[tuple[int, int]] = []
+    position = 0
+    f = await to_thread.run_sync(open, partial_ocr_file, "wb")
+    try:
+        try:
+            for page_range in page_ranges:
+                in_flight.append(
+                    asyncio.create_task(_extract_pages(document_path, *page_range))
+                )
+                if len(in_flight) < OCR_PAGE_WINDOW:
+                    continue
+                position = await _write_pages(
+                    f, await in_flight.popleft(), offsets, position
+                )
+
+            while in_flight:
+                position = await _write_pages(
+                    f, await in_flight.popleft(), offsets, position
+                )
+        finally:
+            await to_thread.run_sync(f.close)
+    except BaseException:
+        for task in in_flight:
+            task.cancel()
+        # A failed attempt leaves nothing behind; the retry starts over.
+        await to_thread.run_sync(partial_ocr_file.unlink, True)
+        raise
 
-    with open(dummy_ocr_file, "w") as f:
-        f.writelines(doc_text)
+    await to_thread.run_sync(
+        _publish_ocr_file, partial_ocr_file, dummy_ocr_file, offsets
+    )
+    await get_stage_cache().put_files(content_hash, "ocr", ocr_files)
 
-    await asyncio.sleep(random.randint(1, 5))
+    await mock_delay(mock_random("ocr", content_hash or claim_id))
 
 
-async def worker():
-    while True:
-        message = await r.brpop([Queues.OCR_QUEUE.value], timeout=10)
-        if message:
-            queue_name, data = message
-            payload = json.loads(data)
-            claim_id = payload["claim_id"]
-            retries = payload.get("retries", 0)
-            try:
-                _ = await perform_ocr(claim_id)
+def _publish_ocr_file(partial_path: Path, path: Path, offsets: list[tuple[int, int]]):
+    # The index goes first, so the text is never found without it.
+    write_page_index(path, offsets)
+    os.replace(partial_path, path)
 
-                metadata = {"claim_id": claim_id, "status": "ocr_performed"}
 
-                await r.lpush(
-                    Queues.DOCUMENT_CLASSIFIER_QUEUE.value, json.dumps(metadata)
-                )
-                logger.info(f"[{claim_id}] is being processed.")
-            except Exception as e:
-                if retries < MAX_RETRIES:
-                    payload["retries"] = retries + 1
-                    await r.lpush(Queues.OCR_QUEUE.value, json.dumps(payload))
-                else:
-                    await r.lpush(Queues.OCR_DLQ.value, json.dumps(payload))
-                    logger.error(f"Added {claim_id=} to OCR DLQ.")
+async def _write_pages(f, pages: list[str], offsets: list, position: int) -> int:
+    # Pages are separated by a newline, as in the previous single-string output.
+    chunk = bytearray()
+    for text in pages:
+        if offsets:
+            chunk += b"\n"
+            position += 1
+        encoded = text.encode("utf-8")
+        offsets.append((position, len(encoded)))
+        chunk += encoded
+        position += len(encoded)
+
+    await to_thread.run_sync(f.write, bytes(chunk))
+    return position
+
+
+async def handle_claim(payload: dict) -> Route:
+    claim_id = payload["claim_id"]
+    _ = await perform_ocr(claim_id, payload.get("content_hash"))
+
+    metadata = {"claim_id": claim_id, "status": "ocr_performed"}
+    logger.info(f"[{claim_id}] is being processed.")
+
+    return Queues.DOCUMENT_CLASSIFIER_QUEUE, metadata
+
+
+def create_worker(**kwargs) -> StageWorker:
+    return StageWorker(
+        queue=Queues.OCR_QUEUE,
+        dlq=Queues.OCR_DLQ,
+        handler=handle_claim,
+        **kwargs,
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(worker())
+    asyncio.run(create_worker().run())
@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import time
+from functools import lru_cache
+from pathlib import Path
+from types import ModuleType
+
+from dotenv import load_dotenv
+
+from common.latency import InMemoryLatencyStore, summarize
+from common.queues import InMemoryQueueBackend, QueueBackend
+from common.storage import get_local_storage
+from common.utils import get_logger, Queues
+
+load_dotenv()
+
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent
+
+WORKER_DIRS = [
+    "email-processing-worker",
+    "ocr-worker",
+    "document-classifier-worker",
+    "data-extraction-worker",
+    "policy-coverage-check-worker",
+    "cost-positions-extraction-worker",
+    "case-plausibility-check-worker",
+]
+
+# Queues nobody consumes from inside the pipeline. A claim is finished once it
+# lands on one of them, so they are never bounded.
+FINAL_QUEUES = [
+    Queues.CLAIM_ACCEPTANCE_QUEUE,
+    Queues.CLAIM_REJECTION_QUEUE,
+    Queues.OCR_DLQ,
+    Queues.DOCUMENT_CLASSIFIER_DLQ,
+    Queues.DATA_EXTRACTION_DLQ,
+    Queues.POLICY_COVERAGE_CHECK_DLQ,
+    Queues.COST_POSITIONS_EXTRACTION_DLQ,
+    Queues.CASE_PLAUSIBILITY_CHECK_DLQ,
+]
+
+
+@lru_cache
+def load_worker_module(worker_dir: str) -> ModuleType:
+    # Worker directories are not importable package names, so each worker.py is
+    # loaded from its path under a unique module name. Modules are loaded once
+    # per process, since their metrics register with the global registry, so
+    # `run_pipeline` can be called repeatedly.
+    path = REPOSITORY_ROOT / worker_dir / "worker.py"
+    spec = importlib.util.spec_from_file_location(worker_dir.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def ingest(queue_backend: QueueBackend, document: bytes) -> str:
+    # Same storage and metadata as the email ingestion service.
+    received_at = time.time()
+    claim_id, content_hash = await get_local_storage().store(
+        file_bytes=document, extension="pdf"
+    )
+    metadata = {
+        "claim_id": claim_id,
+        "status": "ingested",
+        "content_hash": content_hash,
+        "ingested_at": received_at,
+        "enqueued_at": time.time(),
+    }
+    await queue_backend.push(Queues.EMAIL_INGESTION_QUEUE.value, json.dumps(metadata))
+    return claim_id
+
+
+async def run_pipeline(
+    documents: list[bytes],
+    queue_size: int = 100,
+    concurrency: int | None = None,
+    timeout: float = 600,
+) -> dict:
+    queue_backend = InMemoryQueueBackend(
+        maxsize=queue_size, unbounded=[queue.value for queue in FINAL_QUEUES]
+    )
+    latency_store = InMemoryLatencyStore()
+
+    workers = [
+        load_worker_module(worker_dir).create_worker(
+            queue_backend=queue_backend,
+            latency_store=latency_store,
+            concurrency=concurrency,
+        )
+        for worker_dir in WORKER_DIRS
+    ]
+    worker_tasks = [
+        asyncio.create_task(worker.run(handle_signals=False)) for worker in workers
+    ]
+
+    start = time.perf_counter()
+    final_queues = [queue.value for queue in FINAL_QUEUES]
+
+    async def ingest_all():
+        for document in documents:
+            await ingest(queue_backend, document)
+
+    ingestion_task = asyncio.create_task(ingest_all())
+    try:
+        while True:
+            depths = await queue_backend.depths(final_queues)
+            if sum(depths.values()) >= len(documents):
+                break
+            if time.perf_counter() - start > timeout:
+                get_logger().error(
+                    f"Pipeline did not finish {len(documents)} claims within {timeout}s."
+                )
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+    finally:
+        ingestion_task.cancel()
+        await asyncio.gather(ingestion_task, return_exceptions=True)
+        for worker in workers:
+            worker.stop()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+
+    completed = sum(depths.values())
+    return {
+        "elapsed_s": elapsed,
+        "throughput": completed / elapsed if elapsed else 0,
+        "final_queues": {queue: depth for queue, depth in depths.items() if depth},
+        "latency": summarize(latency_store.records),
+    }
+
+
+def load_documents(input_dir: str | None, num_claims: int) -> list[bytes]:
+    if input_dir:
+        paths = sorted(Path(input_dir).glob("*.pdf"))[:num_claims]
+        return [path.read_bytes() for path in paths]
+
+    from generate_dummy_invoice import generate_bicycle_insurance_invoice
+
+    # Identical attachments share cached stage results, so only the first claim
+    # pays for OCR, classification and extraction. Use --input_dir with
+    # distinct documents to measure the full stage cost per claim.
+    document = generate_bicycle_insurance_invoice()
+    return [document] * num_claims
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run every pipeline stage in one process with in-memory queues."
+    )
+
+    parser.add_argument(
+        "--num_claims", type=int, default=10, help="Number of claims to process."
+    )
+    parser.add_argument(
+        "--input_dir",
+        type=str,
+        default=None,
+        help="Directory of claim PDFs. A dummy invoice is generated if omitted.",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=100,
+        help="Capacity of every stage queue; full queues apply backpressure.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="Claims in flight per stage (defaults to WORKER_CONCURRENCY).",
+    )
+    parser.add_argument("--timeout", type=float, default=600)
+
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        run_pipeline(
+            load_documents(args.input_dir, args.num_claims),
+            queue_size=args.queue_size,
+            concurrency=args.concurrency,
+            timeout=args.timeout,
+        )
+    )
+    print(json.dumps(result, indent=2))
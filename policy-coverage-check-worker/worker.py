@@ -1,80 +1,81 @@
 import asyncio
-import json
-import os
-import random
 
-import redis.asyncio as redis
 from dotenv import load_dotenv
 
+from common.claim_fields import claim_fields_path, load_claim_fields
+from common.mock import mock_delay, mock_random
+from common.policy_index import load_policy_index, parse_date
 from common.storage import get_local_storage
 from common.utils import get_logger, Queues
+from common.worker import Route, StageWorker
 
 load_dotenv()
 
 
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", 6379))
-)
-
 logger = get_logger()
-MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
 
+# Loaded once per worker and reloaded when the file changes. Without
+# POLICY_INDEX_PATH the coverage check stays mocked.
+policy_index = load_policy_index()
+
+
+async def run_policy_coverage_check(
+    claim_id: str, content_hash: str | None = None
+) -> tuple[bool, str]:
+    # The policy and frame numbers found by data extraction are looked up in
+    # the in-memory policy index: exact hash lookup first, then a fuzzy match
+    # for OCR-noisy numbers, see common/policy_index.py.
 
-async def run_policy_coverage_check(claim_id: str) -> bool:
-    # This function mocks the policy coverage check step
-    # Lookup table
-    # Fuzzy check
-    # Reranker
+    index = policy_index.get() if policy_index is not None else None
+    if index is None:
+        rng = mock_random("policy_coverage_check", content_hash or claim_id)
+        await mock_delay(rng)
+        result = rng.choices([True, False], [0.8, 0.2], k=1)
+        return result[0], "mocked"
 
     claim_document_dir = get_local_storage().file_path(claim_id)
-    case_df_path = claim_document_dir / f"{claim_id.lower()}.parquet"
-
-    await asyncio.sleep(random.randint(1, 5))
-
-    result = random.choices([True, False], [0.8, 0.2], k=1)
-
-    return result[0]
-
-
-async def worker():
-    while True:
-        message = await r.brpop([Queues.POLICY_COVERAGE_CHECK_QUEUE.value], timeout=10)
-        if message:
-            queue_name, data = message
-            payload = json.loads(data)
-            claim_id = payload["claim_id"]
-            retries = payload.get("retries", 0)
-            try:
-                result = await run_policy_coverage_check(claim_id)
-                metadata = {
-                    "claim_id": claim_id,
-                    "status": f"policy_coverage_check_{str(result).lower()}",
-                }
-                if result:
-                    await r.lpush(
-                        Queues.COST_POSITIONS_EXTRACTION_QUEUE.value,
-                        json.dumps(metadata),
-                    )
-                    logger.info(f"[{claim_id}] policy verified.")
-
-                else:
-                    logger.error(f"Policy check for {claim_id=} returned false.")
-                    await r.lpush(
-                        Queues.CLAIM_REJECTION_QUEUE.value, json.dumps(metadata)
-                    )
-                    # The claim is not eligible under the policy. The claim can be added to a separate queue for rejection or human feedback
-            except Exception as e:
-                if retries < MAX_RETRIES:
-                    payload["retries"] = retries + 1
-                    await r.lpush(
-                        Queues.POLICY_COVERAGE_CHECK_QUEUE.value, json.dumps(payload)
-                    )
-                else:
-                    await r.lpush(
-                        Queues.POLICY_COVERAGE_CHECK_DLQ.value, json.dumps(payload)
-                    )
-                    logger.error(f"Added {claim_id=} to policy coverage check DLQ.")
+    fields = load_claim_fields(claim_fields_path(claim_document_dir, claim_id))
+    decision = index.check_coverage(
+        fields.get("policy_number"),
+        fields.get("serial_number"),
+        parse_date(fields.get("incident_date")),
+    )
+    if decision.match == "fuzzy":
+        logger.info(
+            f"[{claim_id}] policy number {fields.get('policy_number')!r} "
+            f"matched {decision.policy_number}."
+        )
+    return decision.covered, decision.reason
+
+
+async def handle_claim(payload: dict) -> Route:
+    claim_id = payload["claim_id"]
+    result, reason = await run_policy_coverage_check(
+        claim_id, payload.get("content_hash")
+    )
+    metadata = {
+        "claim_id": claim_id,
+        "status": f"policy_coverage_check_{str(result).lower()}",
+    }
+
+    if result:
+        logger.info(f"[{claim_id}] policy verified.")
+        return Queues.COST_POSITIONS_EXTRACTION_QUEUE, metadata
+
+    metadata["coverage_reason"] = reason
+    logger.error(f"Policy check for {claim_id=} returned false ({reason}).")
+    # The claim is not eligible under the policy. The claim can be added to a separate queue for rejection or human feedback
+    return Queues.CLAIM_REJECTION_QUEUE, metadata
+
+
+def create_worker(**kwargs) -> StageWorker:
+    return StageWorker(
+        queue=Queues.POLICY_COVERAGE_CHECK_QUEUE,
+        dlq=Queues.POLICY_COVERAGE_CHECK_DLQ,
+        handler=handle_claim,
+        **kwargs,
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(worker())
+    asyncio.run(create_worker().run())
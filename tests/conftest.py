@@ -0,0 +1,31 @@
+import os
+
+# Settings read when the common modules are imported. The mocked stages finish
+# in milliseconds and failed claims are retried almost at once, so whole
+# pipeline runs fit into a test.
+os.environ.update(
+    {
+        "MOCK_LATENCY_SCALE": "0.001",
+        "RETRY_BASE_DELAY_S": "0.01",
+        "RETRY_POLL_INTERVAL_S": "0.01",
+        "WORKER_POLL_TIMEOUT_S": "0.1",
+        "MICRO_BATCH_MAX_WAIT_MS": "1",
+    }
+)
+
+import pytest
+
+from common.cache import get_stage_cache
+from common.storage import get_local_storage
+
+
+@pytest.fixture(autouse=True)
+def claims_storage(tmp_path, monkeypatch):
+    # Every test stores its claims and cached stage results in a fresh
+    # directory.
+    monkeypatch.setenv("CLAIMS_DATA_STORAGE", str(tmp_path))
+    get_local_storage.cache_clear()
+    get_stage_cache.cache_clear()
+    yield tmp_path
+    get_local_storage.cache_clear()
+    get_stage_cache.cache_clear()
@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import pytest
+
+from common.admission import AdmissionController, SpillDrainer, TokenBucket
+from common.queue_depth import QueueDepthSampler
+from common.queues import InMemoryQueueBackend
+from common.utils import Queues
+
+SPILL_QUEUE = Queues.CLAIM_SPILL_QUEUE.value
+INGESTION_QUEUE = Queues.EMAIL_INGESTION_QUEUE.value
+
+
+class FailingRoutes(InMemoryQueueBackend):
+    # Routes the first `succeed` messages and fails on the next.
+
+    def __init__(self, succeed: int):
+        super().__init__()
+        self.succeed = succeed
+
+    async def route(self, message, queue, data):
+        if self.succeed <= 0:
+            raise ConnectionError("queue unavailable")
+        self.succeed -= 1
+        await super().route(message, queue, data)
+
+
+def spilled_claim(number: int) -> str:
+    return json.dumps({"claim_id": f"claim-{number}", "spilled_at": 0})
+
+
+def test_spill_drainer_puts_back_claims_it_could_not_move():
+    async def main():
+        backend = FailingRoutes(succeed=2)
+        sampler = QueueDepthSampler(backend)
+        await sampler.sample()
+        drainer = SpillDrainer(backend, AdmissionController(sampler, spill_backlog=10))
+        for i in range(4):
+            await backend.push(SPILL_QUEUE, spilled_claim(i))
+
+        with pytest.raises(ConnectionError):
+            await drainer.drain()
+
+        # Nothing is lost: two claims moved, the other two wait to be drained.
+        moved = await backend.try_pop(INGESTION_QUEUE, 10)
+        waiting = await backend.try_pop(SPILL_QUEUE, 10)
+        assert [json.loads(m.data)["claim_id"] for m in moved] == ["claim-0", "claim-1"]
+        assert [json.loads(m.data)["claim_id"] for m in waiting] == [
+            "claim-2",
+            "claim-3",
+        ]
+
+    asyncio.run(main())
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated_at
+    assert [bucket.take(now) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(now) == pytest.approx(0.5)
+    # Half a second later one token has been refilled.
+    assert bucket.take(now + 0.5) == 0
+    # A long pause refills no more than the burst.
+    assert [bucket.take(now + 60) for _ in range(4)][-1] > 0
+
+
+def sampled_controller(backlog: int, spilled: int = 0, **limits) -> AdmissionController:
+    sampler = QueueDepthSampler(InMemoryQueueBackend())
+    controller = AdmissionController(sampler, **limits)
+    sampler.depths = {controller.queues[0]: backlog, SPILL_QUEUE: spilled}
+    sampler.sampled_at = 1.0
+    return controller
+
+
+def decisions(controller: AdmissionController, lane: str, count: int) -> list:
+    return [
+        controller.admit(f"sender-{i}@example.com", lane).decision for i in range(count)
+    ]
+
+
+def test_claims_are_admitted_before_the_first_sample():
+    controller = AdmissionController(
+        QueueDepthSampler(InMemoryQueueBackend()), spill_backlog=1, max_backlog=1
+    )
+    assert decisions(controller, "standard", 3) == ["admitted"] * 3
+
+
+def test_backlog_spills_then_rejects():
+    controller = sampled_controller(8, spill_backlog=10, max_backlog=14)
+    # Claims admitted since the sample count towards the backlog.
+    assert decisions(controller, "standard", 7) == ["admitted"] * 2 + [
+        "spilled"
+    ] * 4 + ["rejected"]
+    admission = controller.admit("late@example.com", "standard")
+    assert (admission.reason, admission.retry_after_s) == ("backlog", 30)
+
+
+def test_priority_lane_is_never_spilled():
+    controller = sampled_controller(10, spill_backlog=10, max_backlog=12)
+    assert decisions(controller, "expedited", 3) == ["admitted"] * 2 + ["rejected"]
+
+
+def test_claims_queue_up_behind_spilled_ones():
+    controller = sampled_controller(0, spilled=1, spill_backlog=10)
+    assert decisions(controller, "standard", 1) == ["spilled"]
+    assert controller.spill_room() == 10
+
+
+def test_sender_rate_limit_and_cancel():
+    controller = sampled_controller(0, sender_rate=1, sender_burst=2)
+    first = controller.admit("Claims@Example.com", "standard")
+    controller.admit("claims@example.com", "standard")
+    rejected = controller.admit("claims@example.com", "standard")
+    assert (rejected.decision, rejected.reason) == ("rejected", "sender_rate")
+    assert 0 < rejected.retry_after_s <= 1
+
+    # A cancelled claim returns its token and its place in the backlog.
+    controller.cancel(first)
+    assert controller.backlog() == 1
+    assert controller.admit("claims@example.com", "standard").decision == "admitted"
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from common.batching import MicroBatcher
+
+
+class Recorder:
+    # Batch function doubling every item and remembering the batches.
+
+    def __init__(self):
+        self.batches: list[list[int]] = []
+
+    async def __call__(self, items: list[int]) -> list:
+        self.batches.append(items)
+        return [ValueError(item) if item < 0 else item * 2 for item in items]
+
+
+def test_full_batch_is_dispatched_without_waiting():
+    async def main():
+        recorder = Recorder()
+        batcher = MicroBatcher("test", recorder, max_batch_size=3, max_wait_ms=10000)
+        started = time.monotonic()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+        assert time.monotonic() - started < 1
+        assert results == [0, 2, 4, 6, 8, 10]
+        assert recorder.batches == [[0, 1, 2], [3, 4, 5]]
+
+    asyncio.run(main())
+
+
+def test_partial_batch_is_dispatched_after_the_linger():
+    async def main():
+        recorder = Recorder()
+        batcher = MicroBatcher("test", recorder, max_batch_size=10, max_wait_ms=50)
+        started = time.monotonic()
+        first = asyncio.create_task(batcher.submit(1))
+        await asyncio.sleep(0.02)
+        # Joins the batch of the first claim rather than starting its own wait.
+        assert await batcher.submit(2) == 4
+        assert await first == 2
+        assert 0.04 < time.monotonic() - started < 0.5
+        assert recorder.batches == [[1, 2]]
+
+    asyncio.run(main())
+
+
+def test_batch_size_one_dispatches_every_claim_alone():
+    async def main():
+        recorder = Recorder()
+        batcher = MicroBatcher("test", recorder, max_batch_size=1, max_wait_ms=10000)
+        assert await asyncio.gather(batcher.submit(1), batcher.submit(2)) == [2, 4]
+        assert recorder.batches == [[1], [2]]
+
+    asyncio.run(main())
+
+
+def test_failures_are_delivered_per_item():
+    async def main():
+        batcher = MicroBatcher("test", Recorder(), max_batch_size=2)
+        results = await asyncio.gather(
+            batcher.submit(-1), batcher.submit(1), return_exceptions=True
+        )
+        assert isinstance(results[0], ValueError) and results[1] == 2
+
+        async def wrong_length(items):
+            return []
+
+        batcher = MicroBatcher("test", wrong_length, max_batch_size=1)
+        with pytest.raises(ValueError, match="returned 0 results for 1 items"):
+            await batcher.submit(1)
+
+    asyncio.run(main())
+
+
+def test_settings_fall_back_from_the_stage_to_the_global_ones(monkeypatch):
+    monkeypatch.setenv("DOCUMENT_CLASSIFIER_MICRO_BATCH_SIZE", "4")
+    batcher = MicroBatcher("document-classifier", Recorder())
+    assert batcher.max_batch_size == 4
+    # MICRO_BATCH_MAX_WAIT_MS is set to 1 ms for the tests.
+    assert batcher.max_wait == 0.001
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from capacity_simulator import default_model, PipelineModel, Simulation
+
+
+def model_with_routes(**routes) -> str:
+    model = json.loads(default_model().to_json())
+    for stage, stage_routes in routes.items():
+        model["stages"][stage]["routes"] = stage_routes
+    return json.dumps(model)
+
+
+def test_default_model_round_trips_and_simulates():
+    model = PipelineModel.from_json(default_model(latency_scale=0.01).to_json())
+    report = Simulation(model, seed=1).run([i * 0.1 for i in range(50)])
+    assert sum(report["outcomes"].values()) == 50
+
+
+def test_stage_without_routes_is_rejected_at_load():
+    with pytest.raises(ValueError, match="'ocr' has no routes"):
+        PipelineModel.from_json(model_with_routes(ocr={}))
+    with pytest.raises(ValueError, match="unknown stages \\['archive'\\]"):
+        PipelineModel.from_json(model_with_routes(ocr={"archive": 1.0}))
+
+
+def test_simulation_rejects_a_model_without_routes():
+    model = default_model()
+    model.stages["ocr"].routes = {}
+    with pytest.raises(ValueError, match="no routes"):
+        Simulation(model)
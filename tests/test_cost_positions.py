@@ -0,0 +1,49 @@
+import numpy as np
+
+from common.cost_positions import (
+    CostPositionTable,
+    load_cost_positions,
+    write_cost_positions,
+)
+
+
+def table(*positions: tuple[str, int, int]) -> CostPositionTable:
+    descriptions, quantities, unit_prices = zip(*positions)
+    quantity = np.array(quantities, dtype=np.int32)
+    unit_price = np.array(unit_prices, dtype=np.int64)
+    return CostPositionTable(
+        description=np.array(descriptions, dtype=np.str_),
+        quantity=quantity,
+        unit_price_cents=unit_price,
+        total_cents=quantity * unit_price,
+        totals={"subtotal_cents": int((quantity * unit_price).sum())},
+    )
+
+
+def test_rewritten_table_replaces_the_previous_version(tmp_path):
+    directory = tmp_path / "claim.cost_positions"
+    write_cost_positions(directory, table(("Rear wheel", 1, 8999)))
+    first_version = directory.resolve()
+    write_cost_positions(directory, table(("Labor", 2, 4500), ("Chain", 1, 2999)))
+
+    loaded = load_cost_positions(directory)
+    assert loaded.description.tolist() == ["Labor", "Chain"]
+    assert loaded.total_cents.tolist() == [9000, 2999]
+    assert loaded.totals == {"subtotal_cents": 11999}
+
+    # Only the symlink and the version it points to are left.
+    assert not first_version.exists()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "claim.cost_positions",
+        directory.resolve().name,
+    ]
+
+
+def test_plain_directory_is_replaced(tmp_path):
+    directory = tmp_path / "claim.cost_positions"
+    directory.mkdir()
+    (directory / "stale.npy").touch()
+
+    write_cost_positions(directory, table(("Rear wheel", 1, 8999)))
+    assert directory.is_symlink()
+    assert load_cost_positions(directory).description.tolist() == ["Rear wheel"]
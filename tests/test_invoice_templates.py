@@ -0,0 +1,47 @@
+import random
+
+import pymupdf
+
+from common.claim_fields import fields_from_text
+from common.invoice_templates import (
+    BICYCLE_CLAIM_INVOICE,
+    match_template,
+    read_first_page_spans,
+)
+from generate_dummy_invoice import random_invoice_fields, render_invoice
+
+
+def test_template_extracts_every_field_of_a_generated_invoice(tmp_path):
+    fields = random_invoice_fields(random.Random(3))
+    document_path = tmp_path / "invoice.pdf"
+    document_path.write_bytes(render_invoice(fields))
+
+    extraction = match_template(read_first_page_spans(str(document_path)))
+    assert extraction.template == BICYCLE_CLAIM_INVOICE.name
+    assert extraction.confidence == 1
+    assert extraction.fields == {
+        "claim_number": fields.claim_id,
+        "policyholder_name": fields.policyholder_name,
+        "policy_number": fields.policy_number,
+        "repair_shop_name": fields.repair_shop_name,
+        "repair_shop_address": fields.repair_shop_address,
+        "iban": fields.iban,
+        "bicycle_model": fields.bicycle_model,
+        "serial_number": fields.serial_number,
+        "purchase_date": fields.purchase_date.strftime("%d.%m.%Y"),
+        "incident_date": fields.incident_date.strftime("%d.%m.%Y"),
+    }
+
+    # The model path reads the same fields from the text of the document.
+    with pymupdf.open(document_path) as document:
+        text = "\n".join(page.get_text() for page in document)
+    assert fields_from_text(text) == extraction.fields
+
+
+def test_unknown_layout_has_no_template(tmp_path):
+    document_path = tmp_path / "letter.pdf"
+    with pymupdf.open() as document:
+        document.new_page().insert_text((72, 72), "Dear Sir or Madam,")
+        document.save(document_path)
+
+    assert match_template(read_first_page_spans(str(document_path))) is None
@@ -0,0 +1,19 @@
+import asyncio
+
+from common.latency import InMemoryLatencyStore
+
+
+def test_in_memory_store_drops_records_past_the_retention():
+    async def main():
+        store = InMemoryLatencyStore(retention_s=60)
+        for completed_at in (0, 30, 61, 100):
+            await store.record(
+                {"claim_id": str(completed_at), "completed_at": completed_at}
+            )
+
+        # The claims completed at 0 and 30 are more than a minute older than the
+        # last one.
+        assert [record["completed_at"] for record in store.records] == [61, 100]
+        assert await store.fetch(50, 90) == [{"claim_id": "61", "completed_at": 61}]
+
+    asyncio.run(main())
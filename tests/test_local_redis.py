@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+from common.local_redis import COMPARE_AND_DELETE, LocalRedis
+
+
+def run(test):
+    asyncio.run(test(LocalRedis()))
+
+
+def test_lists_reply_with_bytes_like_redis_py():
+    async def test(client: LocalRedis):
+        assert await client.lpush("queue", "a", "b") == 2
+        assert await client.lpush("queue", b"c") == 3
+        assert await client.llen("queue") == 3
+        assert await client.lindex("queue", -1) == b"a"
+        assert await client.lindex("queue", 5) is None
+        assert await client.lmpop(1, "queue", direction="RIGHT", count=2) == [
+            b"queue",
+            [b"a", b"b"],
+        ]
+        assert await client.brpop("queue", timeout=1) == (b"queue", b"c")
+        # An emptied list no longer exists.
+        assert await client.lmpop(1, "queue", direction="RIGHT") is None
+        assert await client.llen("queue") == 0
+
+    run(test)
+
+
+def test_blmpop_serves_the_first_non_empty_key():
+    async def test(client: LocalRedis):
+        await client.lpush("second", "x")
+        await client.lpush("third", "y")
+        assert await client.blmpop(
+            1, 3, "first", "second", "third", direction="RIGHT", count=5
+        ) == [b"second", [b"x"]]
+
+    run(test)
+
+
+def test_blocking_pops_return_none_after_timeout():
+    async def test(client: LocalRedis):
+        for pop in (
+            client.blmpop(0.1, 1, "queue", direction="RIGHT"),
+            client.brpop("queue", timeout=0.1),
+        ):
+            start = time.monotonic()
+            assert await pop is None
+            assert 0.08 <= time.monotonic() - start < 1
+
+    run(test)
+
+
+def test_blocking_pop_with_timeout_zero_waits_for_a_push():
+    async def test(client: LocalRedis):
+        pop = asyncio.create_task(client.blmpop(0, 1, "queue", direction="RIGHT"))
+        await asyncio.sleep(0.2)
+        # 0 blocks until an element arrives, as in Redis.
+        assert not pop.done()
+
+        await client.lpush("queue", "a")
+        assert await asyncio.wait_for(pop, 1) == [b"queue", [b"a"]]
+
+    run(test)
+
+
+def test_blocking_pop_wakes_up_on_a_pipelined_push():
+    async def test(client: LocalRedis):
+        pop = asyncio.create_task(client.brpop(["queue"], timeout=5))
+        await asyncio.sleep(0.05)
+        await client.pipeline().lpush("queue", "a").llen("queue").execute()
+        assert await asyncio.wait_for(pop, 1) == (b"queue", b"a")
+
+    run(test)
+
+
+def test_sorted_sets():
+    async def test(client: LocalRedis):
+        assert await client.zadd("retry", {"a": 3, "b": 1, "c": 2}) == 3
+        assert await client.zadd("retry", {"a": 0}) == 0
+        assert await client.zrangebyscore("retry", "-inf", 2) == [b"a", b"b", b"c"]
+        assert await client.zrangebyscore("retry", 1, "+inf", start=0, num=1) == [b"b"]
+        assert await client.zrem("retry", "a", "missing") == 1
+        assert await client.zremrangebyscore("retry", 0, 1) == 1
+        assert await client.zrangebyscore("retry", "-inf", "+inf") == [b"c"]
+
+    run(test)
+
+
+def test_set_nx_and_expiry():
+    async def test(client: LocalRedis):
+        assert await client.set("lock", "one", nx=True, px=100) is True
+        assert await client.set("lock", "two", nx=True) is None
+        assert await client.get("lock") == b"one"
+        await asyncio.sleep(0.15)
+        assert await client.get("lock") is None
+        assert await client.set("lock", "two", nx=True) is True
+        assert await client.delete("lock", "missing") == 1
+
+    run(test)
+
+
+def test_compare_and_delete_keeps_the_lock_of_another_holder():
+    async def test(client: LocalRedis):
+        await client.set("lock", "mine", px=50)
+        await asyncio.sleep(0.1)
+        # The lock expired and was taken over before its first holder released it.
+        await client.set("lock", "theirs", nx=True)
+        assert await client.eval(COMPARE_AND_DELETE, 1, "lock", "mine") == 0
+        assert await client.get("lock") == b"theirs"
+        assert await client.eval(COMPARE_AND_DELETE, 1, "lock", "theirs") == 1
+        assert await client.get("lock") is None
+
+    run(test)
+
+
+def test_pipeline_replies_in_command_order():
+    async def test(client: LocalRedis):
+        replies = await (
+            client.pipeline(transaction=True)
+            .lpush("queue", "a", "b")
+            .zadd("retry", {"a": 1})
+            .llen("queue")
+            .get("missing")
+            .execute()
+        )
+        assert replies == [2, 1, 2, None]
+
+    run(test)
@@ -0,0 +1,17 @@
+from common.pdf_text import read_pages, write_page_index
+
+
+def test_read_pages_reads_only_the_requested_pages(tmp_path):
+    pages = ["First page", "Zweite Seite €", "Third page"]
+    text_path = tmp_path / "claim.txt"
+    offsets, position = [], 0
+    for page in pages:
+        encoded = page.encode("utf-8")
+        offsets.append((position, len(encoded)))
+        position += len(encoded) + 1
+    text_path.write_bytes("\n".join(pages).encode("utf-8"))
+    write_page_index(text_path, offsets)
+
+    assert read_pages(text_path, [2, 1]) == ["Third page", "Zweite Seite €"]
+    # Pages the document does not have are skipped.
+    assert read_pages(text_path, range(5)) == pages
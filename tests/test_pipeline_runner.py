@@ -0,0 +1,54 @@
+import asyncio
+import random
+
+import pytest
+
+from common.utils import Queues
+from generate_dummy_invoice import random_invoice_fields, render_invoice
+from pipeline_runner import FINAL_QUEUES, load_worker_module, run_pipeline
+
+NUM_CLAIMS = 6
+
+
+@pytest.fixture(scope="module")
+def runner():
+    # One event loop for all runs, as the worker modules are loaded once and
+    # keep loop-bound state such as the OCR semaphore.
+    with asyncio.Runner() as runner:
+        yield runner
+
+
+def generate_documents(num_claims: int = NUM_CLAIMS) -> list[bytes]:
+    rng = random.Random(7)
+    return [render_invoice(random_invoice_fields(rng)) for _ in range(num_claims)]
+
+
+def test_every_claim_reaches_a_final_queue(runner):
+    result = runner.run(run_pipeline(generate_documents(), timeout=60))
+
+    final_queues = {queue.value for queue in FINAL_QUEUES}
+    assert set(result["final_queues"]) <= final_queues
+    assert sum(result["final_queues"].values()) == NUM_CLAIMS
+    assert result["latency"]["claims"] == sum(
+        result["final_queues"].get(queue.value, 0)
+        for queue in (Queues.CLAIM_ACCEPTANCE_QUEUE, Queues.CLAIM_REJECTION_QUEUE)
+    )
+
+
+def test_failing_stage_dead_letters_claims_after_retries(runner, monkeypatch):
+    monkeypatch.setenv("DOCUMENT_CLASSIFIER_MAX_RETRIES", "2")
+    attempts = []
+
+    async def always_fails(payload: dict):
+        attempts.append(payload["claim_id"])
+        raise RuntimeError("classifier unavailable")
+
+    classifier = load_worker_module("document-classifier-worker")
+    monkeypatch.setattr(classifier, "handle_claim", always_fails)
+
+    result = runner.run(run_pipeline(generate_documents(), timeout=60))
+
+    assert result["final_queues"] == {Queues.DOCUMENT_CLASSIFIER_DLQ.value: NUM_CLAIMS}
+    # The first attempt and two retries per claim.
+    assert len(attempts) == 3 * NUM_CLAIMS
+    assert len(set(attempts)) == NUM_CLAIMS
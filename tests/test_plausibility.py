@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from common.cost_positions import CostPositionTable
+from common.plausibility import load_plausibility_rules, PlausibilityRules
+
+
+def table(positions: list[tuple[str, int, int]], **totals) -> CostPositionTable:
+    # Positions of (description, quantity, unit price in cents); the printed
+    # totals default to the correct ones with 19% VAT.
+    subtotal = sum(quantity * unit_price for _, quantity, unit_price in positions)
+    vat = round(subtotal * 0.19)
+    totals = {
+        "subtotal_cents": subtotal,
+        "vat_cents": vat,
+        "total_cents": subtotal + vat,
+        **totals,
+    }
+    descriptions, quantities, unit_prices = zip(*positions) if positions else [()] * 3
+    return CostPositionTable(
+        description=np.array(descriptions, dtype=np.str_),
+        quantity=np.array(quantities, dtype=np.int32),
+        unit_price_cents=np.array(unit_prices, dtype=np.int64),
+        total_cents=np.array(quantities, dtype=np.int64)
+        * np.array(unit_prices, dtype=np.int64),
+        totals=totals,
+    )
+
+
+PLAUSIBLE = [("Rear wheel", 1, 8999), ("Labor", 2, 4500)]
+
+
+def test_plausible_invoice_passes():
+    assert load_plausibility_rules().check([table(PLAUSIBLE)]) == [[]]
+
+
+def test_empty_extraction_is_rejected():
+    rules = load_plausibility_rules()
+    empty = table([], subtotal_cents=None, vat_cents=None, total_cents=None)
+    without_totals = table(PLAUSIBLE, vat_cents=None, total_cents=None)
+
+    assert rules.check([empty, without_totals]) == [
+        ["no_cost_positions", "missing_totals"],
+        ["missing_totals"],
+    ]
+
+
+def miscounted_line() -> CostPositionTable:
+    # The totals fit the position totals, one of which is not quantity times
+    # unit price.
+    invoice = table(PLAUSIBLE, subtotal_cents=18000, vat_cents=3420, total_cents=21420)
+    invoice.total_cents[0] += 1
+    return invoice
+
+
+IMPLAUSIBLE = {
+    "line_total": miscounted_line(),
+    "subtotal": table(PLAUSIBLE, subtotal_cents=18000),
+    "gross_total": table(PLAUSIBLE, total_cents=21420),
+    "vat_rate": table(PLAUSIBLE, vat_cents=3000, total_cents=20999),
+    "quantity": table([("Chain", 11, 2999)]),
+    "labor_hours": table([("Labor", 5, 4500), ("Labour", 4, 4500)]),
+    "labor_rate": table([("Labor", 1, 20000)]),
+    "wheel_price": table([("Front wheel", 1, 1000)]),
+    "derailleur_price": table([("Rear derailleur", 1, 30000)]),
+    "drivetrain_price": table([("Cassette", 1, 1000)]),
+    "brake_price": table([("Brake pads", 1, 500)]),
+    "handlebar_price": table([("Handlebar", 1, 20000)]),
+    "saddle_price": table([("Saddle", 1, 500)]),
+    "tube_price": table([("Inner tube", 1, 100)]),
+}
+
+
+def test_each_rule_fires_on_its_own():
+    rules = load_plausibility_rules()
+    fired = rules.check([table(PLAUSIBLE), *IMPLAUSIBLE.values()])
+    assert fired == [[]] + [[name] for name in IMPLAUSIBLE]
+    # Every default rule is covered by one of the cases above.
+    assert {rule.name for rule in rules.rules} == {
+        "no_cost_positions",
+        "missing_totals",
+        *IMPLAUSIBLE,
+    }
+
+
+def test_vat_within_the_tolerance_passes():
+    rounded_up = table(PLAUSIBLE, vat_cents=3421, total_cents=21420)
+    assert load_plausibility_rules().check([rounded_up]) == [[]]
+
+
+def test_rules_are_configured_as_data():
+    rules = PlausibilityRules.from_config(
+        {
+            "categories": {"wheel": ["wheel"]},
+            "rules": [
+                {"name": "vat", "type": "missing_totals", "totals": ["vat_cents"]},
+                {
+                    "name": "cheap_wheel",
+                    "type": "price_band",
+                    "category": "wheel",
+                    "min_cents": 10000,
+                },
+            ],
+        }
+    )
+    assert rules.check([table(PLAUSIBLE, subtotal_cents=None)]) == [["cheap_wheel"]]
+    assert rules.check([table(PLAUSIBLE, vat_cents=None)]) == [["vat", "cheap_wheel"]]
+
+
+def test_invalid_rules_are_rejected():
+    invalid = [
+        {"name": "unknown", "type": "unknown"},
+        {"name": "seat", "type": "price_band", "category": "seat"},
+        {"name": "totals", "type": "missing_totals", "totals": ["net_cents"]},
+    ]
+    for rule in invalid:
+        with pytest.raises(ValueError):
+            PlausibilityRules.from_config({"rules": [rule]})
+    with pytest.raises(ValueError, match="unique"):
+        PlausibilityRules.from_config(
+            {"rules": [{"name": "twice", "type": "line_total"}] * 2}
+        )
@@ -0,0 +1,102 @@
+import random
+from datetime import date
+
+from common.policy_index import edit_distance, Policy, PolicyIndex
+
+
+def levenshtein(a: str, b: str) -> int:
+    row = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        previous, row[0] = row[0], i
+        for j, char_b in enumerate(b, 1):
+            previous, row[j] = row[j], min(
+                row[j] + 1, row[j - 1] + 1, previous + (char_a != char_b)
+            )
+    return row[-1]
+
+
+def test_edit_distance_matches_the_distance_table():
+    rng = random.Random(3)
+    for _ in range(300):
+        a = "".join(rng.choices("AB01", k=rng.randint(0, 80)))
+        b = "".join(rng.choices("AB01", k=rng.randint(0, 80)))
+        for max_distance in (2, 100):
+            expected = min(levenshtein(a, b), max_distance + 1)
+            assert edit_distance(a, b, max_distance) == expected, (a, b)
+
+
+def test_edit_distance_is_capped():
+    assert edit_distance("BIKE3421987", "BIKE3421987", 2) == 0
+    assert edit_distance("BIKE3421987", "BIKE3421897", 2) == 2
+    assert edit_distance("BIKE3421987", "CAR1", 2) == 3
+    assert edit_distance("", "BIKE", 2) == 3
+
+
+POLICIES = [
+    Policy(
+        "BIKE-3421987",
+        "CUBE9876543",
+        date(2023, 4, 1),
+        date(2027, 3, 31),
+        {"partial_damage": True},
+    ),
+    Policy("BIKE-3421988", "TREK1234567"),
+    Policy("BIKE-7000001", "TREK7654321"),
+    Policy("BIKE-7000002", "TREK7654321"),
+    *(Policy(f"BIKE-{number}") for number in range(5000000, 5000500)),
+]
+
+
+def test_lookup_by_exact_and_ocr_noisy_numbers():
+    index = PolicyIndex(POLICIES)
+    exact = index.lookup("bike 3421987")
+    assert (exact.policy.policy_number, exact.match) == ("BIKE-3421987", "exact")
+
+    # O and I read for 0 and 1 fold onto the same number.
+    folded = index.lookup("BIKE-342I987")
+    assert (folded.policy.policy_number, folded.match, folded.distance) == (
+        "BIKE-3421987",
+        "fuzzy",
+        0,
+    )
+
+    swapped = index.lookup("BIKE-3421897")
+    assert (swapped.policy.policy_number, swapped.distance) == ("BIKE-3421987", 2)
+
+    assert index.lookup("CAR-1").match == "none"
+
+
+def test_equally_close_policies_are_told_apart_by_frame():
+    index = PolicyIndex(POLICIES)
+    # One edit away from both BIKE-3421987 and BIKE-3421988.
+    assert index.lookup("BIKE-3421989").policy is None
+    assert index.lookup("BIKE-3421989", "TREK1234567").policy == POLICIES[1]
+
+
+def test_lookup_falls_back_to_an_unambiguous_frame():
+    index = PolicyIndex(POLICIES)
+    by_frame = index.lookup(None, "CUBE 9876543")
+    assert (by_frame.policy, by_frame.match) == (POLICIES[0], "frame")
+    # Two policies insure this frame.
+    assert index.lookup(None, "TREK7654321").policy is None
+
+
+def test_check_coverage_reasons():
+    index = PolicyIndex(POLICIES)
+    incident = date(2024, 6, 1)
+    reasons = [
+        index.check_coverage("BIKE-3421987", "CUBE9876543", incident).reason,
+        index.check_coverage("BIKE-3421987", "GIANT000000", incident).reason,
+        index.check_coverage("BIKE-3421987", "CUBE9876543").reason,
+        index.check_coverage("BIKE-3421987", None, date(2028, 1, 1)).reason,
+        index.check_coverage("BIKE-3421988", None, incident).reason,
+        index.check_coverage("CAR-1", None, incident).reason,
+    ]
+    assert reasons == [
+        "covered",
+        "frame_mismatch",
+        "missing_incident_date",
+        "outside_coverage_period",
+        "not_covered",
+        "unknown_policy",
+    ]
@@ -0,0 +1,71 @@
+import asyncio
+import json
+from collections import Counter
+
+from common.priority import WeightedLanes, choose_lane, lane_queue
+from common.queues import InMemoryQueueBackend
+
+LANES = {"expedited": 6, "standard": 3, "bulk": 1}
+
+
+def lanes_of(messages) -> Counter:
+    return Counter(json.loads(message.data)["lane"] for message in messages)
+
+
+async def fill(backend, lanes: dict[str, int]):
+    for lane, count in lanes.items():
+        for i in range(count):
+            data = json.dumps({"claim_id": f"{lane}-{i}", "lane": lane})
+            await backend.push(lane_queue("ocr-queue", lane), data)
+
+
+def test_busy_lanes_are_served_by_weight():
+    async def main():
+        backend = InMemoryQueueBackend(linger_ms=0)
+        await fill(backend, {lane: 100 for lane in LANES})
+        scheduler = WeightedLanes("ocr-queue", LANES)
+
+        served = Counter()
+        for _ in range(5):
+            messages = await scheduler.pop_batch(backend, count=10, timeout=1)
+            assert len(messages) == 10
+            served += lanes_of(messages)
+        assert served == {"expedited": 30, "standard": 15, "bulk": 5}
+
+    asyncio.run(main())
+
+
+def test_idle_lanes_leave_their_slots_to_the_highest_lanes():
+    async def main():
+        backend = InMemoryQueueBackend(linger_ms=0)
+        await fill(backend, {"standard": 20, "bulk": 20})
+        scheduler = WeightedLanes("ocr-queue", LANES)
+
+        messages = await scheduler.pop_batch(backend, count=10, timeout=1)
+        assert lanes_of(messages) == {"standard": 9, "bulk": 1}
+
+        # The idle expedited lane did not save up credit for a later burst.
+        await fill(backend, {"expedited": 20})
+        messages = await scheduler.pop_batch(backend, count=10, timeout=1)
+        assert lanes_of(messages)["expedited"] == 6
+
+    asyncio.run(main())
+
+
+def test_pop_batch_waits_for_the_first_claim_on_any_lane():
+    async def main():
+        backend = InMemoryQueueBackend(linger_ms=0)
+        scheduler = WeightedLanes("ocr-queue", LANES)
+        popping = asyncio.create_task(scheduler.pop_batch(backend, 10, timeout=1))
+        await asyncio.sleep(0.01)
+        await fill(backend, {"bulk": 1})
+        assert lanes_of(await popping) == {"bulk": 1}
+
+    asyncio.run(main())
+
+
+def test_choose_lane_prefers_an_explicit_priority():
+    assert choose_lane("claims@example.com", "expedited") == "expedited"
+    assert choose_lane("claims@example.com", "unknown") == "standard"
+    assert lane_queue("ocr-queue", "standard") == "ocr-queue"
+    assert lane_queue("ocr-queue", "bulk") == "ocr-queue:bulk"
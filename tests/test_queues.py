@@ -0,0 +1,251 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+import pytest
+
+from common.local_redis import LocalRedis
+from common.queues import (
+    InMemoryQueueBackend,
+    QueueBackend,
+    RedisListQueue,
+    RedisStreamQueue,
+)
+
+BACKENDS = {
+    "memory": lambda: InMemoryQueueBackend(linger_ms=0),
+    "local": lambda: RedisListQueue(LocalRedis(), linger_ms=0),
+}
+
+
+@pytest.fixture(params=BACKENDS)
+def make_backend(request):
+    # Backends are created inside the test's event loop.
+    return BACKENDS[request.param]
+
+
+def run(make_backend, test):
+    async def main():
+        await test(make_backend())
+
+    asyncio.run(main())
+
+
+def claim(number: int, **fields) -> str:
+    return json.dumps({"claim_id": f"claim-{number}", **fields})
+
+
+def claim_ids(messages) -> list[str]:
+    return [json.loads(message.data)["claim_id"] for message in messages]
+
+
+def test_push_and_pop_batch_are_fifo(make_backend):
+    async def test(backend: QueueBackend):
+        depths = [await backend.push("ocr-queue", claim(i)) for i in range(5)]
+        assert depths == [1, 2, 3, 4, 5]
+
+        messages = await backend.pop_batch("ocr-queue", count=3, timeout=1)
+        assert claim_ids(messages) == ["claim-0", "claim-1", "claim-2"]
+        assert {message.queue for message in messages} == {"ocr-queue"}
+        assert await backend.depths(["ocr-queue", "other-queue"]) == {
+            "ocr-queue": 2,
+            "other-queue": 0,
+        }
+
+        messages = await backend.pop_batch("ocr-queue", count=10, timeout=1)
+        assert claim_ids(messages) == ["claim-3", "claim-4"]
+
+    run(make_backend, test)
+
+
+def test_pop_batch_returns_nothing_after_timeout(make_backend):
+    async def test(backend: QueueBackend):
+        start = time.monotonic()
+        assert await backend.pop_batch("ocr-queue", count=4, timeout=0.2) == []
+        assert 0.15 <= time.monotonic() - start < 1
+
+    run(make_backend, test)
+
+
+def test_pop_batch_wakes_up_on_push(make_backend):
+    async def test(backend: QueueBackend):
+        async def push_later():
+            await asyncio.sleep(0.05)
+            await backend.push("ocr-queue", claim(1))
+
+        pusher = asyncio.create_task(push_later())
+        start = time.monotonic()
+        messages = await backend.pop_batch("ocr-queue", count=4, timeout=5)
+        await pusher
+        assert claim_ids(messages) == ["claim-1"]
+        assert time.monotonic() - start < 1
+
+    run(make_backend, test)
+
+
+def test_wait_any_and_try_pop(make_backend):
+    async def test(backend: QueueBackend):
+        assert await backend.try_pop("bulk-queue", 4) == []
+        await backend.push("bulk-queue", claim(1))
+        await backend.push("standard-queue", claim(2))
+
+        # The first queue in order that holds messages is served.
+        messages = await backend.wait_any(["standard-queue", "bulk-queue"], 4, 1)
+        assert claim_ids(messages) == ["claim-2"]
+        assert messages[0].queue == "standard-queue"
+
+        messages = await backend.try_pop("bulk-queue", 4)
+        assert claim_ids(messages) == ["claim-1"]
+
+    run(make_backend, test)
+
+
+def test_route_and_ack(make_backend):
+    async def test(backend: QueueBackend):
+        await backend.push("ocr-queue", claim(1))
+        await backend.push("ocr-queue", claim(2))
+        first, second = await backend.pop_batch("ocr-queue", count=2, timeout=1)
+
+        await backend.route(first, "document-classifier-queue", first.data)
+        await backend.ack(second)
+
+        assert await backend.depths(["ocr-queue", "document-classifier-queue"]) == {
+            "ocr-queue": 0,
+            "document-classifier-queue": 1,
+        }
+        messages = await backend.try_pop("document-classifier-queue", 4)
+        assert claim_ids(messages) == ["claim-1"]
+
+    run(make_backend, test)
+
+
+def test_oldest_enqueued_at(make_backend):
+    async def test(backend: QueueBackend):
+        await backend.push("ocr-queue", claim(1, enqueued_at=100.0))
+        await backend.push("ocr-queue", claim(2, enqueued_at=200.0))
+        assert await backend.oldest_enqueued_at(["ocr-queue", "other-queue"]) == {
+            "ocr-queue": 100.0,
+            "other-queue": None,
+        }
+
+    run(make_backend, test)
+
+
+def test_schedule_and_release_due(make_backend):
+    async def test(backend: QueueBackend):
+        for i in range(4):
+            await backend.push("ocr-queue", claim(i))
+        messages = await backend.pop_batch("ocr-queue", count=4, timeout=1)
+
+        now = time.time()
+        for message, due_at in zip(messages, (now - 2, now - 1, now - 0.5, now + 60)):
+            await backend.schedule(message, "ocr-queue", message.data, due_at)
+
+        assert await backend.depths(["ocr-queue"]) == {"ocr-queue": 0}
+        assert await backend.release_due(limit=2) == 2
+        assert await backend.release_due(limit=10) == 1
+        # The last claim is not due for another minute.
+        assert await backend.release_due(limit=10) == 0
+
+        messages = await backend.try_pop("ocr-queue", 10)
+        assert claim_ids(messages) == ["claim-0", "claim-1", "claim-2"]
+
+    run(make_backend, test)
+
+
+class StreamReads:
+    # Answers XREADGROUP like Redis from the entries waiting on each stream.
+
+    def __init__(self, streams: dict[str, list[str]]):
+        self.streams = {
+            queue: deque(
+                (f"{i}-0".encode(), {b"data": data}) for i, data in enumerate(entries)
+            )
+            for queue, entries in streams.items()
+        }
+        self.reads = 0
+        self.refreshed: list[tuple[str, list]] = []
+
+    def pipeline(self, transaction: bool = True):
+        return self
+
+    def xclaim(self, queue, group, consumer, min_idle_time, receipts, justid):
+        self.refreshed.append((queue, receipts))
+
+    async def execute(self):
+        pass
+
+    async def xgroup_create(self, *args, **kwargs):
+        pass
+
+    async def xreadgroup(self, group, consumer, streams, count, block):
+        self.reads += 1
+        result = []
+        for queue in streams:
+            entries = self.streams[queue]
+            read = [entries.popleft() for _ in range(min(count, len(entries)))]
+            if read:
+                result.append([queue.encode(), read])
+        return result
+
+
+def test_stream_wait_any_hands_out_at_most_count():
+    async def main():
+        client = StreamReads(
+            {
+                "ocr-queue:expedited": [claim(1), claim(2)],
+                "ocr-queue": [claim(3), claim(4)],
+                "ocr-queue:bulk": [claim(5), claim(6)],
+            }
+        )
+        backend = RedisStreamQueue(client, linger_ms=0)
+        lanes = list(client.streams)
+
+        messages = await backend.wait_any(lanes, 2, 1)
+        assert claim_ids(messages) == ["claim-1", "claim-2"]
+
+        # The other entries of the read are handed out before reading again.
+        messages = await backend.try_pop("ocr-queue", 4)
+        assert claim_ids(messages) == ["claim-3", "claim-4"]
+        messages = await backend.wait_any(lanes, 8, 1)
+        assert claim_ids(messages) == ["claim-5", "claim-6"]
+        assert client.reads == 1
+
+    asyncio.run(main())
+
+
+def test_stream_refresh_keeps_held_entries():
+    async def main():
+        client = StreamReads(
+            {"ocr-queue": [claim(1), claim(2)], "ocr-queue:bulk": [claim(3)]}
+        )
+        backend = RedisStreamQueue(client, linger_ms=0, claim_min_idle_ms=60000)
+        assert backend.refresh_interval == 20
+
+        first, second = await backend.wait_any(list(client.streams), 2, 1)
+        await backend.refresh([first, second])
+        # The entry held back from the read is refreshed along with those in
+        # flight.
+        assert client.refreshed == [
+            ("ocr-queue", [b"0-0", b"1-0"]),
+            ("ocr-queue:bulk", [b"0-0"]),
+        ]
+
+    asyncio.run(main())
+
+
+def test_close_waits_for_buffered_pushes():
+    async def main():
+        backend = RedisListQueue(LocalRedis(), linger_ms=60000)
+        pushes = [
+            asyncio.create_task(backend.push("ocr-queue", claim(i))) for i in range(3)
+        ]
+        await asyncio.sleep(0)
+
+        # The pushes wait for the linger to expire, or for the backend to close.
+        await backend.close()
+        assert await backend.depths(["ocr-queue"]) == {"ocr-queue": 3}
+        assert await asyncio.gather(*pushes) == [3, 3, 3]
+
+    asyncio.run(main())
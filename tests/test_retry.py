@@ -0,0 +1,55 @@
+import asyncio
+import json
+import random
+import time
+
+from common.local_redis import LocalRedis
+from common.queues import RedisListQueue
+from common.retry import RetryPolicy, RetryScheduler
+
+
+def test_delay_grows_exponentially_up_to_the_cap():
+    policy = RetryPolicy(base_delay_s=2, max_delay_s=10, multiplier=3, jitter=0)
+    assert [policy.delay(retry) for retry in range(1, 5)] == [2, 6, 10, 10]
+
+
+def test_jitter_shortens_the_delay_by_at_most_its_fraction():
+    policy = RetryPolicy(base_delay_s=4, jitter=0.5)
+    rng = random.Random(7)
+    delays = [policy.delay(1, rng) for _ in range(1000)]
+    assert all(2 < delay <= 4 for delay in delays)
+    # Claims that failed together come back spread over the window.
+    assert max(delays) - min(delays) > 1.5
+
+
+def test_stage_settings_override_the_global_ones(monkeypatch):
+    monkeypatch.setenv("MAX_RETRIES", "5")
+    monkeypatch.setenv("RETRY_BASE_DELAY_S", "1.5")
+    monkeypatch.setenv("OCR_RETRY_BASE_DELAY_S", "0.25")
+    assert RetryPolicy.from_env("ocr") == RetryPolicy(max_retries=5, base_delay_s=0.25)
+    assert RetryPolicy.from_env("document-classifier") == RetryPolicy(
+        max_retries=5, base_delay_s=1.5
+    )
+
+
+def test_concurrent_schedulers_release_each_claim_once():
+    async def main():
+        client = LocalRedis()
+        backend = RedisListQueue(client, linger_ms=0)
+        for i in range(25):
+            await backend.push("ocr-queue", json.dumps({"claim_id": f"claim-{i}"}))
+        messages = await backend.pop_batch("ocr-queue", count=25, timeout=1)
+        for message in messages:
+            await backend.schedule(message, "ocr-queue", message.data, time.time() - 1)
+
+        schedulers = [
+            RetryScheduler(RedisListQueue(client, linger_ms=0), batch_size=4)
+            for _ in range(3)
+        ]
+        released = await asyncio.gather(*(s.release() for s in schedulers))
+        assert sum(released) == 25
+        assert await backend.depths(["ocr-queue"]) == {"ocr-queue": 25}
+        # The lock of the last release is gone, so the next poll is not blocked.
+        assert not client.strings
+
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+import random
+
+import numpy as np
+
+from common.similarity_cache import (
+    lsh_bands,
+    MinHasher,
+    shingles,
+    SimilarityCache,
+)
+
+WORDS = [f"word{chr(97 + i)}{chr(97 + j)}" for i in range(26) for j in range(26)]
+
+
+def document(seed: int, length: int = 200) -> list[str]:
+    return random.Random(seed).choices(WORDS, k=length)
+
+
+def jaccard(a: str, b: str) -> float:
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+
+def test_shingles_mask_digits():
+    assert shingles("Total 119,00 EUR due") == shingles("total 420,50 eur due")
+    assert shingles("two words") == {"two words"}
+    assert shingles("") == set()
+
+
+def test_signatures_estimate_the_jaccard_similarity():
+    hasher = MinHasher(num_perm=256)
+    words = document(1)
+    for changed in (5, 20, 60):
+        edited = list(words)
+        for i in range(0, 200, 200 // changed):
+            edited[i] = "changed"
+        a, b = " ".join(words), " ".join(edited)
+        estimate = np.mean(hasher.signature(a) == hasher.signature(b))
+        assert abs(estimate - jaccard(a, b)) < 0.1
+
+
+def test_lsh_threshold_lies_below_the_similarity_threshold():
+    for threshold in (0.5, 0.8, 0.9):
+        bands, rows = lsh_bands(128, threshold)
+        assert bands * rows == 128
+        assert (1 / bands) ** (1 / rows) <= threshold
+
+
+def test_near_duplicates_hit_and_different_documents_miss():
+    cache = SimilarityCache("test", threshold=0.8, max_entries=100)
+    hasher = cache.hasher
+    for seed in range(20):
+        cache.add(hasher.signature(" ".join(document(seed))), f"label-{seed}")
+
+    # Same invoice with other amounts and one changed word.
+    words = document(7)
+    words[100] = "changed"
+    near_duplicate = " ".join(words) + " 123,45 EUR"
+    match = cache.lookup(hasher.signature(near_duplicate))
+    assert match.value == "label-7" and match.similarity >= 0.8
+
+    assert cache.lookup(hasher.signature(" ".join(document(99)))) is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SimilarityCache("test", threshold=0.8, max_entries=2)
+    signatures = [cache.hasher.signature(" ".join(document(seed))) for seed in range(3)]
+    cache.add(signatures[0], "first")
+    cache.add(signatures[1], "second")
+    assert cache.lookup(signatures[0]).value == "first"
+    cache.add(signatures[2], "third")
+
+    assert len(cache) == 2
+    assert cache.lookup(signatures[1]) is None
+    assert cache.lookup(signatures[0]).value == "first"
+    # Evicted entries leave no empty buckets behind.
+    assert sum(len(buckets) for buckets in cache._buckets) == 2 * cache.bands
+
+
+def test_disabled_cache_stores_nothing():
+    cache = SimilarityCache("test", threshold=0.8, max_entries=0)
+    signature = cache.hasher.signature("claim document")
+    cache.add(signature, "label")
+    assert len(cache) == 0 and cache.lookup(signature) is None